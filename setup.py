@@ -29,6 +29,9 @@ setup(
         "pytest-runner"
     ],
     extras_require={
+        'fast_json': [
+            "orjson>=3.6"
+        ],
         'tests': [
             "Faker==19.13.0",
             "pytest==7.4.3"
@@ -36,6 +39,7 @@ setup(
     entry_points='''
       [console_scripts]
       target-snowflake=target_snowflake:cli
+      target-snowflake-bench=target_snowflake.bench.cli:main
     ''',
     packages=find_packages()
 )
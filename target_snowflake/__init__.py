@@ -1,12 +1,17 @@
 import singer
 from singer import utils
-from target_postgres import target_tools
-from target_redshift.s3 import S3
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import serialization
 
-from target_snowflake.connection import connect
+from target_snowflake import ingest
+from target_snowflake.batching import AdaptiveBatchSizer
+from target_snowflake.connection import RetryPolicy, connect
+from target_snowflake.flight_recorder import FlightRecorder
+from target_snowflake.journal import LoadJournal
+from target_snowflake.profiling import FlushProfiler
+from target_snowflake.s3 import S3
 from target_snowflake.snowflake import SnowflakeTarget
+from target_snowflake.workers import RecordWorkerPool
 
 LOGGER = singer.get_logger()
 
@@ -18,7 +23,7 @@ REQUIRED_CONFIG_KEYS = [
 ]
 
 
-def main(config, input_stream=None):
+def main(config, input_stream=None, connection_factory=None):
     # Validate that we have either password or private_key for authentication
     password = config.get('snowflake_password')
     private_key_data = config.get('snowflake_private_key')
@@ -42,8 +47,21 @@ def main(config, input_stream=None):
         # why: https://www.snowflake.com/blog/latest-changes-to-how-snowflake-handles-ocsp/
         # doc: https://community.snowflake.com/s/article/How-to-turn-off-OCSP-checking-in-Snowflake-client-drivers
         'insecure_mode': True,
+        'retry_policy': RetryPolicy(max_attempts=config.get('retry_max_attempts', 3),
+                                    backoff_seconds=config.get('retry_backoff_seconds', 1),
+                                    max_backoff_seconds=config.get('retry_max_backoff_seconds', 60)),
+        'slow_statement_millis': config.get('slow_statement_millis'),
+        'statement_log_sample_rate': config.get('statement_log_sample_rate', 1.0),
+        'statement_summary_seconds': config.get('statement_summary_seconds'),
     }
 
+    flight_recorder = None
+    if config.get('flight_recorder_file'):
+        flight_recorder = FlightRecorder(config.get('flight_recorder_file'),
+                                         config.get('flight_recorder_millis', 60000),
+                                         operator_stats=config.get('flight_recorder_operator_stats', True))
+        connection_params['flight_recorder'] = flight_recorder
+
     # Use private key authentication if available, otherwise fall back to password
     if private_key_data:
         # Convert PEM-formatted private key string to bytes for Snowflake connector
@@ -72,7 +90,7 @@ def main(config, input_stream=None):
         connection_params['authenticator'] = config.get('snowflake_authenticator', 'snowflake')
         LOGGER.info('Using password authentication for Snowflake connection')
 
-    with connect(**connection_params) as connection:
+    with (connection_factory or connect)(**connection_params) as connection:
         s3_config = config.get('target_s3')
 
         s3 = None
@@ -80,19 +98,80 @@ def main(config, input_stream=None):
             s3 = S3(s3_config.get('aws_access_key_id'),
                     s3_config.get('aws_secret_access_key'),
                     s3_config.get('bucket'),
-                    s3_config.get('key_prefix'))
+                    s3_config.get('key_prefix'),
+                    compression=s3_config.get('compression', 'gzip'),
+                    max_file_size=s3_config.get('max_file_size', 268435456),
+                    multipart_chunksize=s3_config.get('multipart_chunksize', 16777216),
+                    max_concurrency=s3_config.get('max_concurrency', 8))
+
+        batch_sizer = None
+        if config.get('adaptive_batch_mode'):
+            max_batch_rows = config.get('max_batch_rows', 200000)
+            batch_sizer = AdaptiveBatchSizer(
+                mode=config.get('adaptive_batch_mode'),
+                target_seconds=config.get('adaptive_batch_target_seconds', 60),
+                min_rows=config.get('adaptive_batch_min_rows', min(1000, max_batch_rows)),
+                max_rows=config.get('adaptive_batch_max_rows', max_batch_rows * 5))
+
+        record_workers = None
+        if config.get('record_workers'):
+            record_workers = RecordWorkerPool(config.get('record_workers'))
+
+        journal = None
+        if config.get('load_journal'):
+            journal = LoadJournal(config.get('load_journal'))
+
+        profiler = None
+        if config.get('profile_directory'):
+            profiler = FlushProfiler(config.get('profile_directory'),
+                                     every_batches=config.get('profile_every_batches'),
+                                     slow_seconds=config.get('profile_slow_batch_seconds'),
+                                     allocations=config.get('profile_allocations', False))
 
         target = SnowflakeTarget(
             connection,
             s3=s3,
             logging_level=config.get('logging_level'),
-            persist_empty_tables=config.get('persist_empty_tables')
+            persist_empty_tables=config.get('persist_empty_tables'),
+            batch_sizer=batch_sizer,
+            record_workers=record_workers,
+            s3_stage=s3_config.get('snowflake_stage') if s3_config else None,
+            s3_purge=s3_config.get('purge', False) if s3_config else False,
+            internal_stage=config.get('internal_stage'),
+            internal_stage_purge=config.get('internal_stage_purge', False),
+            journal=journal,
+            direct_load_versions=config.get('direct_load_versions', False),
+            cluster_min_rows=config.get('cluster_min_rows'),
+            cluster_min_bytes=config.get('cluster_min_bytes'),
+            cluster_by=config.get('cluster_by'),
+            row_hash=config.get('row_hash', False),
+            query_tag=config.get('query_tag', False),
+            profiler=profiler
         )
 
-        if input_stream:
-            target_tools.stream_to_target(input_stream, target, config=config)
-        else:
-            target_tools.main(target)
+        try:
+            target.recover()
+
+            if input_stream:
+                ingest.stream_to_target(input_stream, target, config=config, record_workers=record_workers)
+            else:
+                ingest.main(target, config, record_workers=record_workers)
+        finally:
+            if record_workers:
+                record_workers.shutdown()
+
+            try:
+                target.cleanup()
+            except Exception:
+                LOGGER.warning('Could not clean up staged files', exc_info=True)
+
+            if journal:
+                journal.close()
+
+            connection.log_statement_summary()
+
+            if flight_recorder:
+                flight_recorder.close()
 
 
 def cli():
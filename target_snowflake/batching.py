@@ -0,0 +1,92 @@
+import singer
+
+LOGGER = singer.get_logger()
+
+LATENCY = 'latency'
+THROUGHPUT = 'throughput'
+MODES = (LATENCY, THROUGHPUT)
+
+
+class AdaptiveBatchSizer:
+    """
+    Tunes each stream buffer's `max_rows` from the measured time spent writing its batches.
+
+    `latency` mode sizes batches so that a flush (serialization, staging, COPY and merge) takes
+    roughly `target_seconds`. `throughput` mode hill-climbs towards the batch size with the
+    highest observed rows/sec. Either way the result stays within `[min_rows, max_rows]`, and a
+    single adjustment never moves further than `max_step` times the current size.
+    """
+
+    def __init__(self,
+                 mode=LATENCY,
+                 target_seconds=60,
+                 min_rows=1000,
+                 max_rows=1000000,
+                 max_step=2.0,
+                 smoothing=0.5,
+                 min_fill_ratio=0.5):
+        if mode not in MODES:
+            raise ValueError('Unknown adaptive batch mode `{}`. Expected one of: {}'.format(mode, MODES))
+        if min_rows < 1 or max_rows < min_rows:
+            raise ValueError('Adaptive batch limits must satisfy 1 <= min_rows <= max_rows. Got {} and {}'.format(
+                min_rows,
+                max_rows))
+
+        self.mode = mode
+        self.target_seconds = target_seconds
+        self.min_rows = min_rows
+        self.max_rows = max_rows
+        self.max_step = max_step
+        self.smoothing = smoothing
+        self.min_fill_ratio = min_fill_ratio
+
+        # {'<stream>': {'rate': float, 'direction': 1|-1}}
+        self._streams = {}
+
+    def observe(self, stream_buffer, row_count, elapsed_seconds):
+        """
+        Record that `row_count` rows of `stream_buffer` took `elapsed_seconds` to write, and
+        update `stream_buffer.max_rows` accordingly.
+        :param stream_buffer: BufferedSingerStream
+        :param row_count: int
+        :param elapsed_seconds: float
+        :return: the new `max_rows`, or None when the observation was not used
+        """
+        current = stream_buffer.max_rows
+
+        # Batches flushed early (STATE, ACTIVATE_VERSION, end of input) are dominated by fixed
+        # per-flush overhead and would drag the estimate down.
+        if row_count <= 0 or elapsed_seconds <= 0 or row_count < current * self.min_fill_ratio:
+            return None
+
+        rate = row_count / elapsed_seconds
+        stats = self._streams.get(stream_buffer.stream)
+
+        if self.mode == LATENCY:
+            if stats is not None:
+                rate = self.smoothing * rate + (1 - self.smoothing) * stats['rate']
+            proposed = rate * self.target_seconds
+            self._streams[stream_buffer.stream] = {'rate': rate}
+        else:
+            direction = 1
+            if stats is not None:
+                direction = stats['direction']
+                if rate < stats['rate']:
+                    direction = -direction
+            proposed = current * (self.max_step ** direction)
+            self._streams[stream_buffer.stream] = {'rate': rate, 'direction': direction}
+
+        proposed = max(current / self.max_step, min(current * self.max_step, proposed))
+        proposed = int(max(self.min_rows, min(self.max_rows, proposed)))
+
+        if proposed != current:
+            LOGGER.info('Adaptive batching: `{}` wrote {} rows in {:.2f}s ({:.0f} rows/s), max_rows {} -> {}'.format(
+                stream_buffer.stream,
+                row_count,
+                elapsed_seconds,
+                row_count / elapsed_seconds,
+                current,
+                proposed))
+            stream_buffer.max_rows = proposed
+
+        return proposed
@@ -0,0 +1,2 @@
+from target_snowflake.bench.fake import FakeConnection, FakeCursor
+from target_snowflake.bench.measure import Measurement, PhaseRecorder, peak_rss_mb
@@ -0,0 +1,213 @@
+import argparse
+import contextlib
+import gzip
+import hashlib
+import json
+import os
+import sys
+
+import target_snowflake
+from target_snowflake import ingest
+from target_snowflake.bench import fake
+from target_snowflake.bench.measure import Measurement, PhaseRecorder
+
+## Settings a local stand-in needs `target_snowflake.main` to get past its validation with
+BENCH_CONFIG = {
+    'snowflake_account': 'bench',
+    'snowflake_warehouse': 'BENCH',
+    'snowflake_database': 'BENCH',
+    'snowflake_schema': 'PUBLIC',
+    'snowflake_username': 'bench',
+    'snowflake_password': 'bench',
+}
+
+
+def scrub_value(value, salt=''):
+    """
+    Replace a string with a hash of the same length. Equal strings stay equal, so keys still
+    collide where they did. Other values are returned unchanged.
+    :param value: any JSON value
+    :param salt: string
+    :return: any JSON value
+    """
+    if not isinstance(value, str) or not value:
+        return value
+
+    digest = hashlib.sha256((salt + value).encode('utf-8')).hexdigest()
+    return (digest * (len(value) // len(digest) + 1))[:len(value)]
+
+
+def scrub_record(record, paths, salt=''):
+    """
+    Scrub the string values of `record` at each of `paths`, in place. Arrays along a path are
+    scrubbed element by element.
+    :param record: dict
+    :param paths: [(key, ...), ...]
+    :param salt: string
+    :return: dict, `record`
+    """
+    for path in paths:
+        _scrub_path(record, path, salt)
+    return record
+
+
+def _scrub_path(value, path, salt):
+    if isinstance(value, list):
+        for i, element in enumerate(value):
+            if path:
+                _scrub_path(element, path, salt)
+            else:
+                value[i] = scrub_value(element, salt)
+        return None
+
+    if not path or not isinstance(value, dict) or path[0] not in value:
+        return None
+
+    if len(path) == 1 and not isinstance(value[path[0]], (dict, list)):
+        value[path[0]] = scrub_value(value[path[0]], salt)
+    else:
+        _scrub_path(value[path[0]], path[1:], salt)
+
+
+def record(input_stream, output_path, scrub=None, salt='', tee=None):
+    """
+    Capture a Singer message stream to a gzip compressed file, one message per line.
+    :param input_stream: binary file-like object
+    :param output_path: string
+    :param scrub: [string, ...], dotted paths of RECORD fields whose string values are replaced by hashes
+    :param salt: string, salt of the hashes
+    :param tee: [optional] binary file-like object which is sent every input line unchanged
+    :return: int, number of captured lines
+    """
+    paths = [tuple(field.split('.')) for field in scrub or []]
+    count = 0
+
+    with gzip.open(output_path, 'wb', compresslevel=6) as output:
+        for line in ingest.read_lines(input_stream):
+            if tee is not None:
+                tee.write(line + b'\n')
+
+            if paths and ingest.record_stream(line) is not None:
+                message = json.loads(line)
+                scrub_record(message['record'], paths, salt)
+                line = json.dumps(message).encode('utf-8')
+
+            output.write(line + b'\n')
+            count += 1
+
+    if tee is not None:
+        tee.flush()
+
+    return count
+
+
+def scan_capture(path):
+    """
+    :return: ({'<stream>': int, ...}, int), RECORD messages in the capture at `path` by stream,
+             and its uncompressed size in bytes
+    """
+    counts = {}
+    size = 0
+    with gzip.open(path, 'rb') as capture:
+        for line in ingest.read_lines(capture):
+            size += len(line) + 1
+            stream = ingest.record_stream(line)
+            if stream is None and b'"RECORD"' in line:
+                message = json.loads(line)
+                if message.get('type') == 'RECORD':
+                    stream = message.get('stream')
+            if stream is not None:
+                counts[stream] = counts.get(stream, 0) + 1
+    return counts, size
+
+
+def replay(input_path, config, stand_in=False, quiet=True):
+    """
+    Replay a capture through `target_snowflake.main` at full speed.
+    :param input_path: string, file written by `record`
+    :param config: dict, target config
+    :param stand_in: boolean, load into `target_snowflake.bench.FakeConnection` instead of Snowflake
+    :param quiet: boolean, only let warnings through to the logs
+    :return: dict, report of the replay
+    """
+    record_counts, size = scan_capture(input_path)
+    connection_factory = target_snowflake.connect
+    if stand_in:
+        config = dict(BENCH_CONFIG, **config)
+        connection_factory = fake.connect
+
+    with gzip.open(input_path, 'rb') as capture, \
+            open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull), \
+            PhaseRecorder(quiet=quiet) as recorder, \
+            Measurement('replay', rows=sum(record_counts.values()), bytes=size) as measurement:
+        target_snowflake.main(config, input_stream=capture, connection_factory=connection_factory)
+
+    report = measurement.result()
+    report['input'] = input_path
+    report['stand_in'] = stand_in
+    report['phases'] = {phase: round(seconds, 6) for phase, seconds in sorted(recorder.phase_seconds.items())}
+    report['streams'] = {}
+    for stream, records in sorted(record_counts.items()):
+        write_seconds = recorder.stream_write_seconds(stream)
+        report['streams'][stream] = {
+            'records': records,
+            'write_seconds': round(write_seconds, 6),
+            'records_per_sec': round(records / write_seconds, 1) if write_seconds else None,
+            'phases': {phase: round(seconds, 6)
+                       for phase, seconds in sorted(recorder.stream_phase_seconds.get(stream, {}).items())}}
+
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='target-snowflake-bench',
+                                     description='Record Singer message streams, and replay them through the target.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    record_parser = commands.add_parser('record', help='Capture stdin to a compressed file')
+    record_parser.add_argument('-o', '--output', required=True, help='Path of the capture, eg. `sync.jsonl.gz`')
+    record_parser.add_argument('--scrub', default='',
+                               help='Comma separated, dotted, paths of RECORD fields whose strings are replaced by hashes')
+    record_parser.add_argument('--salt', default='', help='Salt of the scrubbing hashes')
+    record_parser.add_argument('--tee', action='store_true',
+                               help='Also copy stdin to stdout, to capture a stream on its way to a target')
+
+    replay_parser = commands.add_parser('replay', help='Load a capture through the target, and report timings')
+    replay_parser.add_argument('-i', '--input', required=True, help='Path of a capture written by `record`')
+    replay_parser.add_argument('-c', '--config', help='Target config file. Required unless `--stand-in`')
+    replay_parser.add_argument('--stand-in', action='store_true',
+                               help='Load into a local stand-in for Snowflake instead of a real account')
+    replay_parser.add_argument('--verbose', action='store_true', help='Keep the target\'s INFO logs')
+    replay_parser.add_argument('--report', help='File to append the report to, as a JSON line')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'record':
+        count = record(sys.stdin.buffer,
+                       args.output,
+                       scrub=[field for field in args.scrub.split(',') if field],
+                       salt=args.salt,
+                       tee=sys.stdout.buffer if args.tee else None)
+        print('Captured {} messages to {}'.format(count, args.output), file=sys.stderr)
+        return None
+
+    if not args.config and not args.stand_in:
+        parser.error('replay requires --config, or --stand-in')
+
+    config = {}
+    if args.config:
+        with open(args.config) as config_file:
+            config = json.load(config_file)
+
+    report = replay(args.input, config, stand_in=args.stand_in, quiet=not args.verbose)
+    print(json.dumps(report, indent=2))
+
+    if args.report:
+        with open(args.report, 'a') as report_file:
+            report_file.write(json.dumps(report, sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+    main()
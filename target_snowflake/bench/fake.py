@@ -0,0 +1,327 @@
+import glob
+import os
+import re
+import time
+import uuid
+
+import singer
+
+from target_snowflake.connection import Connection
+from target_snowflake.statements import StatementStats
+
+_NAME = r'(?:(?:"(?:[^"]|"")+"|[\w$]+)\.){0,2}(?:"(?:[^"]|"")+"|[\w$]+)'
+
+_SHOW_TABLES = re.compile(r'\s*SHOW\s+TABLES\b', re.IGNORECASE)
+_COLUMNS = re.compile(r'\s*SELECT\s+table_name\s*,\s*column_name\b.*\binformation_schema\.columns\b',
+                      re.IGNORECASE | re.DOTALL)
+_CREATE_LIKE = re.compile(r'\s*CREATE\s+(?:OR\s+REPLACE\s+)?TABLE\s+({name})\s+LIKE\s+({name})'.format(name=_NAME),
+                          re.IGNORECASE)
+_CREATE = re.compile(r'\s*CREATE\s+(?:OR\s+REPLACE\s+)?TABLE\s+({name})\s*\((.*)\)\s*$'.format(name=_NAME),
+                     re.IGNORECASE | re.DOTALL)
+_COMMENT = re.compile(r"\s*COMMENT\s+ON\s+TABLE\s+({name})\s+IS\s+'(.*)'\s*$".format(name=_NAME),
+                      re.IGNORECASE | re.DOTALL)
+_ALTER = re.compile(r'\s*ALTER\s+TABLE\s+({name})\s+(.*?)\s*$'.format(name=_NAME), re.IGNORECASE | re.DOTALL)
+_ADD_COLUMN = re.compile(r'ADD\s+COLUMN\s+({name})\s+(.*)$'.format(name=_NAME), re.IGNORECASE | re.DOTALL)
+_ALTER_COLUMNS = re.compile(r'ALTER\s*\((.*)\)$', re.IGNORECASE | re.DOTALL)
+_ALTER_NULL = re.compile(r'(?:ALTER\s+COLUMN\s+)?({name})\s+(SET|DROP)\s+NOT\s+NULL$'.format(name=_NAME),
+                         re.IGNORECASE)
+_DROP_COLUMN = re.compile(r'DROP\s+COLUMN\s+({name})$'.format(name=_NAME), re.IGNORECASE)
+_RENAME_COLUMN = re.compile(r'RENAME\s+COLUMN\s+({name})\s+TO\s+({name})$'.format(name=_NAME), re.IGNORECASE)
+_SWAP = re.compile(r'SWAP\s+WITH\s+({name})$'.format(name=_NAME), re.IGNORECASE)
+_CLUSTER = re.compile(r'CLUSTER\s+BY\s*\((.*)\)$', re.IGNORECASE | re.DOTALL)
+_DROP_TABLE = re.compile(r'\s*DROP\s+TABLE\s+(?:IF\s+EXISTS\s+)?({name})'.format(name=_NAME), re.IGNORECASE)
+_COUNT = re.compile(r'\s*SELECT\s+COUNT\(1\)\s+FROM\s+({name})'.format(name=_NAME), re.IGNORECASE)
+_PUT = re.compile(r'\s*PUT\s+file://(\S+)', re.IGNORECASE)
+_INSERT = re.compile(r'\s*INSERT\s+INTO\s+({name})'.format(name=_NAME), re.IGNORECASE)
+_OPERATOR_STATS = re.compile(r'\s*SELECT\b.*\bGET_QUERY_OPERATOR_STATS\b', re.IGNORECASE | re.DOTALL)
+_SELECT = re.compile(r'\s*SELECT\b', re.IGNORECASE)
+
+## Enough columns for any `SELECT` of bounds the target runs against a temp table
+_NULL_ROW = (None,) * 256
+
+
+def _unquote(name):
+    """
+    :param name: string, possibly qualified, identifier
+    :return: string, the unqualified, unquoted, name
+    """
+    parts = re.findall(r'"((?:[^"]|"")+)"|([\w$]+)', name)
+    quoted, bare = parts[-1]
+    return quoted.replace('""', '"') if quoted else bare.upper()
+
+
+def _column_type(definition):
+    """
+    :param definition: string, eg. `text NOT NULL`
+    :return: (type, is_nullable)
+    """
+    definition = definition.strip()
+    not_null = re.search(r'\bNOT\s+NULL\b', definition, re.IGNORECASE) is not None
+    data_type = re.sub(r'\bNOT\s+NULL\b', '', definition, flags=re.IGNORECASE).strip().upper()
+    return data_type, 'NO' if not_null else 'YES'
+
+
+class FakeTable:
+    def __init__(self, columns=None):
+        # {'<name>': (type, is_nullable)}
+        self.columns = dict(columns or {})
+        self.comment = ''
+        self.cluster_by = ''
+        self.rows = 0
+        self.bytes = 0
+
+
+class FakeCursor:
+    """
+    Cursor of a `FakeConnection`. Runs the target's DDL against the connection's catalog,
+    answers the queries the target makes about it, and accepts everything else.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.sfqid = None
+        self.rowcount = None
+        self.query = None
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        pass
+
+    def execute(self, command, params=None, num_statements=None, **kwargs):
+        timestamp = time.monotonic()
+        failed = True
+
+        try:
+            self.query = command
+            statements = command.split(';') if num_statements else [command]
+            self._rows = []
+            self.rowcount = 0
+            for statement in statements:
+                if statement.strip():
+                    self._run(statement)
+            self.sfqid = str(uuid.uuid4())
+            failed = False
+        finally:
+            self.connection.executed.append(command)
+            self.connection.record_statement(command,
+                                             (time.monotonic() - timestamp) * 1000,
+                                             None if failed else self.sfqid,
+                                             self.rowcount,
+                                             failed,
+                                             params=params)
+
+        return self
+
+    def execute_async(self, command, **kwargs):
+        return self.execute(command, **kwargs)
+
+    def fetchall(self):
+        rows = self._rows
+        self._rows = []
+        return rows
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def _table(self, name):
+        table = self.connection.tables.get(_unquote(name))
+        if table is None:
+            raise Exception('Table {} does not exist'.format(name))
+        return table
+
+    def _run(self, statement):
+        tables = self.connection.tables
+
+        if _SHOW_TABLES.match(statement):
+            self._rows = [(None, name, self.connection.configured_database, self.connection.configured_schema,
+                           'TABLE', table.comment, table.cluster_by, table.rows, table.bytes)
+                          for name, table in sorted(tables.items())]
+            return
+
+        if _COLUMNS.match(statement):
+            self._rows = [(name, column, data_type, is_nullable)
+                          for name, table in sorted(tables.items())
+                          for column, (data_type, is_nullable) in sorted(table.columns.items())]
+            return
+
+        match = _COUNT.match(statement)
+        if match:
+            self._rows = [(self._table(match.group(1)).rows,)]
+            return
+
+        match = _CREATE_LIKE.match(statement)
+        if match:
+            tables[_unquote(match.group(1))] = FakeTable(self._table(match.group(2)).columns)
+            return
+
+        match = _CREATE.match(statement)
+        if match:
+            columns = {}
+            for definition in match.group(2).split(','):
+                name, data_type = re.match(r'\s*({})\s+(.*)'.format(_NAME), definition, re.DOTALL).groups()
+                columns[_unquote(name)] = _column_type(data_type)
+            tables[_unquote(match.group(1))] = FakeTable(columns)
+            return
+
+        match = _COMMENT.match(statement)
+        if match:
+            self._table(match.group(1)).comment = match.group(2)
+            return
+
+        match = _ALTER.match(statement)
+        if match:
+            self._alter(_unquote(match.group(1)), match.group(2))
+            return
+
+        match = _DROP_TABLE.match(statement)
+        if match:
+            tables.pop(_unquote(match.group(1)), None)
+            return
+
+        match = _INSERT.match(statement)
+        if match:
+            self._table(match.group(1)).rows += 1
+            return
+
+        match = _PUT.match(statement)
+        if match:
+            for path in glob.glob(match.group(1)):
+                self.connection.put_files += 1
+                self.connection.put_bytes += os.path.getsize(path)
+            return
+
+        ## Statements of the stand-in have no query profile
+        if _OPERATOR_STATS.match(statement):
+            return
+
+        if _SELECT.match(statement):
+            self._rows = [_NULL_ROW]
+
+    def _alter(self, table_name, action):
+        table = self._table(table_name)
+
+        match = _ADD_COLUMN.match(action)
+        if match:
+            table.columns[_unquote(match.group(1))] = _column_type(match.group(2))
+            return
+
+        match = _ALTER_COLUMNS.match(action)
+        if match:
+            for clause in match.group(1).split(','):
+                null_match = _ALTER_NULL.match(clause.strip())
+                if null_match:
+                    column = _unquote(null_match.group(1))
+                    table.columns[column] = (table.columns[column][0],
+                                             'NO' if null_match.group(2).upper() == 'SET' else 'YES')
+                else:
+                    name, data_type = re.match(r'\s*({})\s+(.*)'.format(_NAME), clause, re.DOTALL).groups()
+                    column = _unquote(name)
+                    table.columns[column] = (_column_type(data_type)[0], table.columns[column][1])
+            return
+
+        match = _ALTER_NULL.match(action)
+        if match:
+            column = _unquote(match.group(1))
+            table.columns[column] = (table.columns[column][0], 'NO' if match.group(2).upper() == 'SET' else 'YES')
+            return
+
+        match = _DROP_COLUMN.match(action)
+        if match:
+            table.columns.pop(_unquote(match.group(1)))
+            return
+
+        match = _RENAME_COLUMN.match(action)
+        if match:
+            table.columns[_unquote(match.group(2))] = table.columns.pop(_unquote(match.group(1)))
+            return
+
+        match = _SWAP.match(action)
+        if match:
+            other_name = _unquote(match.group(1))
+            other = self._table(other_name)
+            self.connection.tables[table_name], self.connection.tables[other_name] = other, table
+            return
+
+        match = _CLUSTER.match(action)
+        if match:
+            table.cluster_by = 'LINEAR({})'.format(match.group(1).strip())
+
+
+class FakeConnection:
+    """
+    Local stand-in for `target_snowflake.connection.Connection`, to run `SnowflakeTarget` without a
+    Snowflake account. Tables and their columns and comments are kept in memory, so the target
+    goes through the same schema and merge paths as against Snowflake, but no rows are stored: a
+    table's row count is the number of INSERTs into it, which only tells empty tables apart.
+    PUTs only take the size of the uploaded files, and every executed statement is kept in `executed`.
+    """
+
+    LOGGER = singer.get_logger()
+
+    record_statement = Connection.record_statement
+    set_query_tag = Connection.set_query_tag
+    log_statement_summary = Connection.log_statement_summary
+
+    def __init__(self,
+                 warehouse='BENCH',
+                 database='BENCH',
+                 schema='PUBLIC',
+                 slow_statement_millis=None,
+                 statement_log_sample_rate=0.0,
+                 statement_summary_seconds=None,
+                 flight_recorder=None,
+                 **kwargs):
+        self.configured_warehouse = warehouse
+        self.configured_database = database
+        self.configured_schema = schema
+        self.retry_policy = None
+
+        self.slow_statement_millis = slow_statement_millis
+        self.statement_log_sample_rate = statement_log_sample_rate
+        self.statement_summary_seconds = statement_summary_seconds
+        self.statement_stats = StatementStats()
+        self._statement_summary_at = time.monotonic()
+        self._query_tag = None
+        self.flight_recorder = flight_recorder
+
+        self.tables = {}
+        self.executed = []
+        self.put_files = 0
+        self.put_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def initialize(self, logger):
+        self.LOGGER = logger
+
+    def cursor(self, as_dict=False):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def is_closed(self):
+        return False
+
+    def reconnect(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def connect(**kwargs):
+    return FakeConnection(**kwargs)
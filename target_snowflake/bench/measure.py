@@ -0,0 +1,109 @@
+import json
+import logging
+import resource
+import sys
+import time
+
+METRIC_PREFIX = 'METRIC: '
+
+## Phases which run within another phase, and are left out of a stream's total write time
+NESTED_PHASES = ('write_file', 'put', 's3_upload', 'batch', 'table')
+
+
+def peak_rss_mb():
+    """
+    :return: float, peak resident set size of this process so far, in MB
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    if sys.platform == 'darwin':
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+class PhaseRecorder(logging.Filter):
+    """
+    Sums the singer metrics the target logs: the seconds spent in each `job_duration` phase, overall
+    and by stream, and the totals of each `record_count` counter type. Installed as a filter of the root logger, as
+    `singer.get_logger()` reconfigures logging, and drops the root logger's handlers, every time
+    it is called.
+    """
+
+    def __init__(self, quiet=True):
+        super(PhaseRecorder, self).__init__()
+        self.quiet = quiet
+        self.phase_seconds = {}
+        # {'<stream>': {'<phase>': seconds}}
+        self.stream_phase_seconds = {}
+        self.counts = {}
+
+    def __enter__(self):
+        logging.getLogger().addFilter(self)
+        return self
+
+    def __exit__(self, *args):
+        logging.getLogger().removeFilter(self)
+
+    def filter(self, record):
+        message = record.getMessage()
+        if message.startswith(METRIC_PREFIX):
+            point = json.loads(message[len(METRIC_PREFIX):])
+            tags = point.get('tags', {})
+            if point['type'] == 'timer':
+                phase = tags.get('job_type')
+                self.phase_seconds[phase] = self.phase_seconds.get(phase, 0.0) + point['value']
+                if tags.get('stream'):
+                    stream_phases = self.stream_phase_seconds.setdefault(tags['stream'], {})
+                    stream_phases[phase] = stream_phases.get(phase, 0.0) + point['value']
+            elif point['type'] == 'counter':
+                count_type = tags.get('count_type')
+                self.counts[count_type] = self.counts.get(count_type, 0) + point['value']
+
+        return not self.quiet or record.levelno >= logging.WARNING
+
+    def stream_write_seconds(self, stream):
+        """
+        :return: float, seconds spent writing the batches, and activating the versions, of `stream`
+        """
+        return sum(seconds for phase, seconds in self.stream_phase_seconds.get(stream, {}).items()
+                   if phase not in NESTED_PHASES)
+
+
+class Measurement:
+    """
+    Times a block of work over `rows` rows, and `bytes` bytes, of input.
+
+        with Measurement('parse', rows=len(lines), bytes=size) as measurement:
+            ...
+        measurement.result()
+    """
+
+    def __init__(self, name, rows=0, bytes=0):
+        self.name = name
+        self.rows = rows
+        self.bytes = bytes
+        self.seconds = None
+        self.peak_rss_mb = None
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.seconds = time.perf_counter() - self._start
+        self.peak_rss_mb = peak_rss_mb()
+
+    def result(self):
+        """
+        :return: {'name': string, 'rows': int, 'bytes': int, 'seconds': float, 'rows_per_sec': float,
+                  'bytes_per_sec': float, 'peak_rss_mb': float}
+        """
+        seconds = self.seconds or float('nan')
+        return {'name': self.name,
+                'rows': self.rows,
+                'bytes': self.bytes,
+                'seconds': round(self.seconds, 6),
+                'rows_per_sec': round(self.rows / seconds, 1),
+                'bytes_per_sec': round(self.bytes / seconds, 1),
+                'peak_rss_mb': round(self.peak_rss_mb, 1)}
@@ -1,31 +1,175 @@
+import json
 import logging
+import random
 import re
 import time
 
 import singer
 from snowflake.connector import DictCursor, SnowflakeConnection
 from snowflake.connector.cursor import SnowflakeCursor
+from snowflake.connector.errors import Error
+
+from target_snowflake.statements import StatementStats, classify_statement
 
 # Ignore DEBUG, and INFO level messages from Snowflake Connector
 logger = logging.getLogger("snowflake.connector")
 logger.setLevel(logging.WARNING)
 
+TRANSIENT = 'transient'
+SESSION_LOST = 'session_lost'
+
+## https://docs.snowflake.com/en/user-guide/client-connectivity-troubleshooting/error-messages
+SESSION_LOST_ERRNOS = {
+    390111,  # Session no longer exists
+    390112,  # Session expired
+    390114,  # Authentication token expired
+    250001,  # Could not connect to Snowflake backend
+}
+TRANSIENT_ERRNOS = {
+    630,  # Statement reached its statement or warehouse timeout, eg. queued for too long
+    250003,  # Failed to get a response, eg. connection reset
+}
+## SQLSTATE classes and codes
+SESSION_LOST_SQLSTATE_PREFIXES = ('08',)  # Connection exception
+TRANSIENT_SQLSTATES = {'57014',  # Query canceled
+                       '40001'}  # Serialization failure
+
+## Statements which can be repeated within a transaction without changing its outcome
+_REPEATABLE_STATEMENT = re.compile(r'^\s*(SELECT|SHOW|DESCRIBE|DESC|LIST|PUT)\b', re.IGNORECASE)
+
+
+def classify_error(ex):
+    """
+    Classify an exception, or any exception it wraps, as a transient failure worth retrying.
+    :param ex: Exception
+    :return: `SESSION_LOST` when the session must be reopened first, `TRANSIENT`, or None
+    """
+    seen = set()
+    pending = [ex]
+    kind = None
+
+    while pending:
+        error = pending.pop()
+        if error is None or id(error) in seen or not isinstance(error, BaseException):
+            continue
+        seen.add(id(error))
+
+        if isinstance(error, Error):
+            sqlstate = error.sqlstate or ''
+            if error.errno in SESSION_LOST_ERRNOS or sqlstate.startswith(SESSION_LOST_SQLSTATE_PREFIXES):
+                return SESSION_LOST
+            if error.errno in TRANSIENT_ERRNOS or sqlstate in TRANSIENT_SQLSTATES:
+                kind = TRANSIENT
+        elif isinstance(error, ConnectionError):
+            return SESSION_LOST
+
+        ## `SnowflakeError(message, ex)` carries the original exception in its args
+        pending.extend([error.__cause__, error.__context__] + list(error.args))
+
+    return kind
+
+
+class RetryPolicy:
+    """
+    Exponential backoff, with jitter, for transient Snowflake errors.
+    """
+
+    def __init__(self, max_attempts=3, backoff_seconds=1.0, max_backoff_seconds=60.0):
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+
+    def delay(self, attempt):
+        """
+        :param attempt: int, number of the attempt which failed, starting at 1
+        :return: float, seconds to wait before the next attempt
+        """
+        delay = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+
+def with_retries(connection, operation, description):
+    """
+    Call `operation` until it succeeds, it fails with an error which is not transient, or
+    `connection.retry_policy` runs out of attempts. The session is reopened whenever it was lost.
+    `operation` must be safe to repeat from scratch, eg. a whole batch transaction.
+    :param connection: Connection
+    :param operation: function of no arguments
+    :param description: string, used in log messages
+    :return: the result of `operation`
+    """
+    policy = getattr(connection, 'retry_policy', None)
+    attempt = 1
+
+    while True:
+        try:
+            return operation()
+        except Exception as ex:
+            kind = classify_error(ex)
+            if policy is None or kind is None or attempt >= policy.max_attempts:
+                raise
+
+            delay = policy.delay(attempt)
+            connection.LOGGER.warning('{} failed with a transient error, retrying in {:.1f}s (attempt {} of {}): {}'.format(
+                description,
+                delay,
+                attempt + 1,
+                policy.max_attempts,
+                ex))
+            time.sleep(delay)
+
+            if kind == SESSION_LOST or connection.is_closed():
+                connection.reconnect()
+
+            attempt += 1
+
 
 class MillisLoggingCursor(SnowflakeCursor):
     def execute(self, command, **kwargs):
         timestamp = time.monotonic()
+        failed = True
+        query_id = None
 
         try:
-            super(MillisLoggingCursor, self).execute(command, **kwargs)
+            self._execute_with_retries(command, **kwargs)
+            failed = False
+            query_id = self.sfqid
+        except Exception as ex:
+            ## `sfqid` is still the id of the previous statement
+            query_id = getattr(ex, 'sfqid', None)
+            raise
         finally:
-            self.connection.LOGGER.info(
-            "MillisLoggingCursor: {} millis spent executing: {}".format(
-                int((time.monotonic() - timestamp) * 1000),
-                re.sub(r'\n', '  \\\\n  ', command)
-            ))
+            self.connection.record_statement(command,
+                                             (time.monotonic() - timestamp) * 1000,
+                                             query_id,
+                                             self.rowcount,
+                                             failed,
+                                             params=kwargs.get('params'))
 
         return self
 
+    def _execute_with_retries(self, command, **kwargs):
+        policy = getattr(self.connection, 'retry_policy', None)
+        attempt = 1
+
+        while True:
+            try:
+                return super(MillisLoggingCursor, self).execute(command, **kwargs)
+            except Exception as ex:
+                ## A lost session loses its transaction too, which only the caller can replay
+                if policy is None \
+                        or attempt >= policy.max_attempts \
+                        or classify_error(ex) != TRANSIENT \
+                        or not _REPEATABLE_STATEMENT.match(command):
+                    raise
+
+                delay = policy.delay(attempt)
+                self.connection.LOGGER.warning('Statement failed with a transient error, retrying in {:.1f}s: {}'.format(
+                    delay,
+                    ex))
+                time.sleep(delay)
+                attempt += 1
+
 
 class MillisLoggingDictCursor(MillisLoggingCursor):
     def __init__(self, connection):
@@ -33,12 +177,27 @@ class MillisLoggingDictCursor(MillisLoggingCursor):
 
 
 class Connection(SnowflakeConnection):
-    def __init__(self, **kwargs):
+    def __init__(self,
+                 retry_policy=None,
+                 slow_statement_millis=None,
+                 statement_log_sample_rate=1.0,
+                 statement_summary_seconds=None,
+                 flight_recorder=None,
+                 **kwargs):
         self.LOGGER = singer.get_logger()
 
         self.configured_warehouse = kwargs.get('warehouse')
         self.configured_database = kwargs.get('database')
         self.configured_schema = kwargs.get('schema')
+        self.retry_policy = retry_policy
+
+        self.slow_statement_millis = slow_statement_millis
+        self.statement_log_sample_rate = statement_log_sample_rate
+        self.statement_summary_seconds = statement_summary_seconds
+        self.statement_stats = StatementStats()
+        self._statement_summary_at = time.monotonic()
+        self._query_tag = None
+        self.flight_recorder = flight_recorder
 
         SnowflakeConnection.__init__(self, **kwargs)
 
@@ -52,6 +211,71 @@ class Connection(SnowflakeConnection):
     def initialize(self, logger):
         self.LOGGER = logger
 
+    def record_statement(self, command, millis, query_id, rows, failed, params=None):
+        """
+        Record a statement in `statement_stats`, and in `flight_recorder`, and log it when it failed,
+        was slower than `slow_statement_millis`, or is part of the `statement_log_sample_rate` sample.
+        """
+        kind = classify_statement(command)
+        self.statement_stats.record(kind, millis, rows=rows, failed=failed)
+
+        if failed \
+                or (self.slow_statement_millis is not None and millis >= self.slow_statement_millis) \
+                or random.random() < self.statement_log_sample_rate:
+            self.LOGGER.info(
+                "MillisLoggingCursor: {} millis spent executing {} query {} ({} rows): {}".format(
+                    int(millis),
+                    kind,
+                    query_id,
+                    rows,
+                    re.sub(r'\n', '  \\\\n  ', command)
+                ))
+
+        if self.flight_recorder is not None:
+            try:
+                self.flight_recorder.record(self, command, millis, query_id, rows, failed, params=params)
+            except Exception:
+                self.LOGGER.warning('Could not record slow statement {}'.format(query_id), exc_info=True)
+
+        if self.statement_summary_seconds \
+                and time.monotonic() - self._statement_summary_at >= self.statement_summary_seconds:
+            self.log_statement_summary()
+
+    def set_query_tag(self, query_tag):
+        """
+        Set the session's QUERY_TAG, unless it is already set to `query_tag`.
+        :param query_tag: string, or None to unset it
+        """
+        if query_tag == self._query_tag:
+            return None
+
+        with self.cursor() as cur:
+            if query_tag is None:
+                cur.execute('ALTER SESSION UNSET QUERY_TAG')
+            else:
+                cur.execute('ALTER SESSION SET QUERY_TAG = %s', params=[query_tag])
+
+        self._query_tag = query_tag
+
+    def log_statement_summary(self):
+        self._statement_summary_at = time.monotonic()
+        self.LOGGER.info('Statement summary: {}'.format(json.dumps(self.statement_stats.summary())))
+
+    def reconnect(self):
+        """
+        Open a new session with the settings of the lost one.
+        """
+        try:
+            self.close()
+        except Exception:
+            pass
+
+        self.LOGGER.warning('Reconnecting to Snowflake')
+        self.connect()
+
+        ## Session parameters were lost along with the session
+        self._query_tag = None
+
 
 def connect(**kwargs):
     return Connection(**kwargs)
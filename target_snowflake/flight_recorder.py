@@ -0,0 +1,78 @@
+from datetime import datetime, timezone
+import json
+import os
+
+import singer
+
+from target_snowflake.statements import COPY, DELETE, INSERT, classify_statement
+
+LOGGER = singer.get_logger()
+
+OPERATOR_STATS_QUERY = 'SELECT * FROM TABLE(GET_QUERY_OPERATOR_STATS(%s))'
+
+
+class FlightRecorder:
+    """
+    Local, append only, JSON lines record of the COPY, DELETE and INSERT statements which take
+    `threshold_millis` or more. Each entry keeps the statement's SQL, the number and types of its
+    parameters, its query id, what the target set as the `context` of the table it was loading, eg.
+    its temp table, row count and key properties, and, with `operator_stats`, the statement's
+    `GET_QUERY_OPERATOR_STATS`. The role needs to be allowed to monitor its own queries for the
+    latter. Parameter values are left out, as they can be credentials, eg. of an S3 COPY, or data.
+    """
+
+    KINDS = (COPY, DELETE, INSERT)
+
+    def __init__(self, path, threshold_millis, operator_stats=True):
+        self.path = path
+        self.threshold_millis = threshold_millis
+        self.operator_stats = operator_stats
+
+        # Table being loaded, set by the target before loading it
+        self.context = {}
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def record(self, connection, command, millis, query_id, rows, failed, params=None):
+        """
+        Record a statement executed on `connection`, when it is slow enough.
+        :return: dict, the entry, or None when the statement was not recorded
+        """
+        kind = classify_statement(command)
+        if kind not in self.KINDS or millis < self.threshold_millis:
+            return None
+
+        entry = dict(self.context)
+        entry.update({'at': datetime.now(timezone.utc).isoformat(),
+                      'kind': kind,
+                      'millis': int(millis),
+                      'query_id': query_id,
+                      'rows': rows,
+                      'failed': failed,
+                      'sql': command,
+                      'param_count': len(params) if params else 0,
+                      'param_types': [type(param).__name__ for param in params] if params else [],
+                      'warehouse': connection.configured_warehouse})
+
+        if self.operator_stats and query_id:
+            try:
+                with connection.cursor(as_dict=True) as cur:
+                    cur.execute(OPERATOR_STATS_QUERY, params=[query_id])
+                    entry['operator_stats'] = cur.fetchall()
+            except Exception as ex:
+                entry['operator_stats_error'] = str(ex)
+
+        self._file.write(json.dumps(entry, sort_keys=True, default=str) + '\n')
+        self._file.flush()
+
+        LOGGER.warning('{} took {} millis, recorded query {} to {}'.format(kind,
+                                                                           int(millis),
+                                                                           query_id,
+                                                                           self.path))
+        return entry
+
+    def close(self):
+        self._file.close()
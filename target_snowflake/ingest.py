@@ -0,0 +1,392 @@
+from collections import deque
+import decimal
+import json
+import re
+import sys
+import time
+
+import singer
+from target_postgres import json_schema, target_tools
+from target_postgres.exceptions import TargetError
+from target_postgres.singer_stream import RAW_LINE_SIZE
+
+from target_snowflake.singer_stream import BufferedSingerStream, parse_validation_mode, schema_fingerprint
+from target_snowflake.status import FAILED, ProgressTracker, StatusFile
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+LOGGER = singer.get_logger()
+
+READ_CHUNK_SIZE = 8 * 1024 * 1024  # 8MB
+
+## Matches the `{"type": "RECORD", "stream": "..."` prefix singer-python writes for every record, so that
+##  the stream of a raw line can be known without decoding it.
+_RECORD_PREFIX = r'^\s*\{\s*"type"\s*:\s*"RECORD"\s*,\s*"stream"\s*:\s*"([^"\\]*)"'
+_RECORD_PREFIX_BYTES = re.compile(_RECORD_PREFIX.encode('utf-8'))
+_RECORD_PREFIX_STR = re.compile(_RECORD_PREFIX)
+
+## `orjson` decodes integers which do not fit in 64 bits to floats, losing their precision. Lines with
+##  a run of digits that long are decoded by `json` instead.
+_LONG_DIGITS = r'\d{19}'
+_LONG_DIGITS_BYTES = re.compile(_LONG_DIGITS.encode('utf-8'))
+_LONG_DIGITS_STR = re.compile(_LONG_DIGITS)
+
+
+def read_lines(readable, chunk_size=READ_CHUNK_SIZE):
+    """
+    Given a file-like object, read it in large chunks and yield every non empty line.
+    :param readable: binary or text file-like object
+    :param chunk_size: int
+    :return: generator of bytes or str
+    """
+    remainder = None
+    while True:
+        chunk = readable.read(chunk_size)
+        if not chunk:
+            break
+
+        if remainder:
+            chunk = remainder + chunk
+
+        lines = chunk.split(b'\n' if isinstance(chunk, bytes) else '\n')
+        remainder = lines.pop()
+        for line in lines:
+            if line:
+                yield line
+
+    if remainder and remainder.strip():
+        yield remainder
+
+
+def loads(line, exact_numbers=False):
+    """
+    Decode a single Singer message. Uses `orjson` when it is installed, unless `exact_numbers`
+    is requested, in which case floats are decoded as `decimal.Decimal` as `target_tools` does.
+    Lines `orjson` cannot decode exactly, ie. with integers wider than 64 bits, or at all, eg. with
+    the `NaN` and `Infinity` simplejson writes, are decoded as `target_tools` does too.
+    :param line: bytes or str
+    :param exact_numbers: boolean
+    :return: dict
+    """
+    if orjson is not None and not exact_numbers:
+        long_digits = _LONG_DIGITS_BYTES if isinstance(line, bytes) else _LONG_DIGITS_STR
+        if not long_digits.search(line):
+            try:
+                return orjson.loads(line)
+            except orjson.JSONDecodeError:
+                pass
+    return json.loads(line, parse_float=decimal.Decimal)
+
+
+def record_stream(line):
+    """
+    Return the stream of the raw RECORD message `line`, or None when `line` is not a RECORD
+    message in the canonical singer-python layout.
+    :param line: bytes or str
+    :return: string or None
+    """
+    if isinstance(line, bytes):
+        match = _RECORD_PREFIX_BYTES.match(line)
+        return match.group(1).decode('utf-8') if match else None
+
+    match = _RECORD_PREFIX_STR.match(line)
+    return match.group(1) if match else None
+
+
+def _requires_exact_numbers(schema):
+    """
+    `multipleOf` validation is only reliable against `Decimal`s. Snowflake stores `number`s as
+    FLOAT, so every other schema can safely be decoded straight to floats.
+    """
+    if isinstance(schema, dict):
+        return 'multipleOf' in schema or any(_requires_exact_numbers(v) for v in schema.values())
+    if isinstance(schema, list):
+        return any(_requires_exact_numbers(v) for v in schema)
+    return False
+
+
+def main(target, config, record_workers=None):
+    """
+    Given a target, stream stdin to it.
+    :param target: object which implements `write_batch` and `activate_version`
+    :param config: configuration for buffers etc.
+    :param record_workers: [optional] RecordWorkerPool
+    :return: None
+    """
+    stream_to_target(sys.stdin.buffer, target, config=config, record_workers=record_workers)
+
+
+def stream_to_target(stream, target, config={}, record_workers=None):
+    """
+    Persist `stream` to `target` with optional `config`.
+
+    Drop-in replacement for `target_tools.stream_to_target` which reads file-like streams in
+    large chunks, decodes with `orjson` when available, and hands consecutive RECORD messages for
+    the same stream to the buffers as a group.
+    :param stream: file-like object, or iterator of lines, which represents a Singer data stream
+    :param target: object which implements `write_batch` and `activate_version`
+    :param config: [optional] configuration for buffers etc.
+    :param record_workers: [optional] RecordWorkerPool to decode and validate RECORD messages with
+    :return: None
+    """
+    state_support = config.get('state_support', True)
+    state_tracker = ProgressTracker(target, state_support)
+    target_tools._run_sql_hook('before_run_sql', config, target)
+
+    status_file = None
+    if config.get('status_file'):
+        status_file = StatusFile(config.get('status_file'),
+                                 state_tracker,
+                                 interval_seconds=config.get('status_interval_seconds', 10),
+                                 window_seconds=config.get('status_window_seconds', 60))
+        status_file.start()
+
+    try:
+        if not config.get('disable_collection', False):
+            target_tools._async_send_usage_stats()
+
+        if hasattr(stream, 'read'):
+            stream = read_lines(stream)
+
+        ingester = Ingester(state_tracker, target, config, record_workers=record_workers)
+        ingester.ingest(stream)
+
+        state_tracker.flush_streams(force=True)
+        target_tools._run_sql_hook('after_run_sql', config, target)
+
+        return None
+
+    except Exception as e:
+        LOGGER.critical(e)
+        if status_file:
+            status_file.close(FAILED)
+            status_file = None
+        raise e
+    finally:
+        if status_file:
+            status_file.close()
+
+        target_tools._report_invalid_records(state_tracker.streams)
+
+
+class Ingester:
+    """
+    Routes decoded Singer messages to the `StreamTracker`, grouping consecutive RECORD messages
+    for the same stream and checking buffers for flushing every `batch_detection_threshold` lines.
+    """
+
+    def __init__(self, state_tracker, target, config, record_workers=None):
+        self.state_tracker = state_tracker
+        self.target = target
+        self.record_workers = record_workers
+
+        self.invalid_records_detect = config.get('invalid_records_detect')
+        self.invalid_records_threshold = config.get('invalid_records_threshold')
+        self.max_batch_rows = config.get('max_batch_rows', 200000)
+        ## `max_batch_size` is what `target_tools.stream_to_target` called it
+        self.max_buffer_size = config.get('max_buffer_size', config.get('max_batch_size', 104857600))  # 100MB
+        self.max_buffer_seconds = config.get('max_buffer_seconds', 900)  # 15 minutes
+        self.batch_detection_threshold = config.get('batch_detection_threshold',
+                                                    max(self.max_batch_rows / 40, 50))
+        self.batch_force_flush = config.get('batch_force_flush', False)
+        self.validate_every = parse_validation_mode(config.get('validation_mode'))
+
+        self.exact_number_streams = set()
+        self.buffer_started_at = {}
+
+        ## Fingerprint and raw schema of each stream, to validate with in `record_workers`
+        self.schemas = {}
+
+        self.lines_since_check = 0
+        self.pending_stream = None
+        self.pending_raw = False
+        self.pending_records = []
+
+        ## [(stream, Future), ...] of record groups submitted to `record_workers`, in stream order
+        self.in_flight = deque()
+
+    def ingest(self, lines):
+        for line in lines:
+            if self.record_workers is not None:
+                stream = record_stream(line)
+                if stream is not None and stream in self.schemas:
+                    self._add_pending(stream, line, raw=True)
+                    self.lines_since_check += 1
+                    continue
+
+            line_data = self._decode(line)
+
+            if not isinstance(line_data, dict) or 'type' not in line_data:
+                raise TargetError('`type` is a required key: {}'.format(line))
+
+            if line_data['type'] == 'RECORD':
+                if 'stream' not in line_data:
+                    raise TargetError('`stream` is a required key: {}'.format(line))
+
+                if line_data['stream'] in self.exact_number_streams and orjson is not None:
+                    line_data = loads(line, exact_numbers=True)
+
+                line_data[RAW_LINE_SIZE] = len(line)
+
+                self._add_pending(line_data['stream'], line_data)
+            else:
+                if line_data['type'] == 'SCHEMA' and orjson is not None:
+                    line_data = loads(line, exact_numbers=True)
+
+                self._flush_pending()
+                self._drain_in_flight()
+                self._handle_message(line_data, line)
+
+            self.lines_since_check += 1
+
+        self._flush_pending()
+        self._drain_in_flight()
+
+    def _decode(self, line):
+        try:
+            return loads(line)
+        except ValueError:
+            LOGGER.error('Unable to parse JSON: {}'.format(line))
+            raise
+
+    def _add_pending(self, stream, record, raw=False):
+        if stream != self.pending_stream \
+                or raw != self.pending_raw \
+                or len(self.pending_records) >= self.batch_detection_threshold:
+            self._flush_pending()
+            self.pending_stream = stream
+            self.pending_raw = raw
+
+        self.pending_records.append(record)
+
+    def _flush_pending(self):
+        if self.pending_records:
+            if self.pending_raw:
+                fingerprint, schema = self.schemas[self.pending_stream]
+                self.in_flight.append((self.pending_stream,
+                                       self.record_workers.submit_lines(
+                                           fingerprint,
+                                           schema,
+                                           self.pending_records,
+                                           exact_numbers=self.pending_stream in self.exact_number_streams,
+                                           validate=self.validate_every == 1)))
+
+                while len(self.in_flight) > 2 * self.record_workers.workers:
+                    self._resolve_in_flight()
+            else:
+                self._drain_in_flight()
+                self.handle_records(self.pending_stream, self.pending_records)
+
+            self.pending_records = []
+
+        if self.lines_since_check >= self.batch_detection_threshold:
+            self.lines_since_check = 0
+            self._check_buffers()
+
+    def _resolve_in_flight(self):
+        stream, future = self.in_flight.popleft()
+        self.handle_records(stream, future.result())
+
+    def _drain_in_flight(self):
+        while self.in_flight:
+            self._resolve_in_flight()
+
+    def handle_records(self, stream, records):
+        """
+        Add a group of RECORD messages, all for `stream`, to that stream's buffer.
+        :param stream: string
+        :param records: [{...}, ...]
+        :return: None
+        """
+        stream_buffer = self.state_tracker.streams.get(stream)
+        if stream_buffer is not None and stream_buffer.count == 0:
+            self.buffer_started_at[stream] = time.monotonic()
+
+        for record in records:
+            self.state_tracker.handle_record_message(stream, record)
+
+    def _check_buffers(self):
+        if self.batch_force_flush:
+            self.state_tracker.flush_streams(force=True)
+            return
+
+        now = time.monotonic()
+        for stream, stream_buffer in self.state_tracker.streams.items():
+            started_at = self.buffer_started_at.get(stream)
+            if self.max_buffer_seconds \
+                    and started_at is not None \
+                    and stream_buffer.count > 0 \
+                    and now - started_at >= self.max_buffer_seconds:
+                LOGGER.info('Flushing `{}` after buffering for {} seconds'.format(stream, int(now - started_at)))
+                self.state_tracker.flush_stream(stream)
+
+        self.state_tracker.flush_streams()
+
+    def _handle_message(self, line_data, line):
+        if line_data['type'] == 'SCHEMA':
+            if 'stream' not in line_data:
+                raise TargetError('`stream` is a required key: {}'.format(line))
+
+            stream = line_data['stream']
+
+            if 'schema' not in line_data:
+                raise TargetError('`schema` is a required key: {}'.format(line))
+
+            schema = line_data['schema']
+
+            schema_validation_errors = json_schema.validation_errors(schema)
+            if schema_validation_errors:
+                raise TargetError('`schema` is an invalid JSON Schema instance: {}'.format(line),
+                                  *schema_validation_errors)
+
+            if _requires_exact_numbers(schema):
+                self.exact_number_streams.add(stream)
+            else:
+                self.exact_number_streams.discard(stream)
+
+            key_properties = line_data.get('key_properties')
+
+            self.schemas[stream] = (schema_fingerprint(schema), schema)
+
+            if stream not in self.state_tracker.streams:
+                self.state_tracker.register_stream(stream, self.new_stream_buffer(stream, schema, key_properties))
+            else:
+                self.state_tracker.streams[stream].update_schema(schema, key_properties)
+
+        elif line_data['type'] == 'ACTIVATE_VERSION':
+            if 'stream' not in line_data:
+                raise TargetError('`stream` is a required key: {}'.format(line))
+            if 'version' not in line_data:
+                raise TargetError('`version` is a required key: {}'.format(line))
+            if line_data['stream'] not in self.state_tracker.streams:
+                raise TargetError('A ACTIVATE_VERSION for stream {} was encountered before a corresponding schema'
+                                  .format(line_data['stream']))
+
+            stream_buffer = self.state_tracker.streams[line_data['stream']]
+            self.state_tracker.flush_stream(line_data['stream'])
+            self.target.activate_version(stream_buffer, line_data['version'])
+
+        elif line_data['type'] == 'STATE':
+            self.state_tracker.handle_state_message(line_data)
+
+        else:
+            raise TargetError('Unknown message type {} in message {}'.format(
+                line_data['type'],
+                line))
+
+    def new_stream_buffer(self, stream, schema, key_properties):
+        buffered_stream = BufferedSingerStream(stream,
+                                               schema,
+                                               key_properties,
+                                               invalid_records_detect=self.invalid_records_detect,
+                                               invalid_records_threshold=self.invalid_records_threshold,
+                                               validate_every=self.validate_every)
+        if self.max_batch_rows:
+            buffered_stream.max_rows = self.max_batch_rows
+        if self.max_buffer_size:
+            buffered_stream.max_buffer_size = self.max_buffer_size
+
+        return buffered_stream
@@ -0,0 +1,109 @@
+from datetime import datetime, timezone
+import json
+import os
+import uuid
+
+BEGIN = 'begin'
+TEMP_TABLE = 'temp_table'
+STAGED = 'staged'
+COMMIT = 'commit'
+ABORT = 'abort'
+
+
+class LoadJournal:
+    """
+    Local, append only, JSON lines journal of the batches being loaded. Every entry is synced to
+    disk before the work it describes starts, so that after a crash the temp tables and staged
+    files of batches which never committed can be found and cleaned up.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def _append(self, entry):
+        entry['at'] = datetime.now(timezone.utc).isoformat()
+        self._file.write(json.dumps(entry, sort_keys=True) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def begin(self, stream, table, sequence_range):
+        """
+        :param stream: string
+        :param table: string, root table the batch is loaded into
+        :param sequence_range: [min, max] `_sdc_sequence` of the batch, or None
+        :return: string, batch id
+        """
+        batch_id = str(uuid.uuid4()).replace('-', '')
+        self._append({'event': BEGIN,
+                      'batch': batch_id,
+                      'stream': stream,
+                      'table': table,
+                      'sequence': sequence_range})
+        return batch_id
+
+    def temp_table(self, batch_id, name):
+        self._append({'event': TEMP_TABLE, 'batch': batch_id, 'name': name})
+
+    def staged(self, batch_id, location):
+        """
+        :param location: string, stage path which holds the batch's files, eg. `@MY_STAGE/<run>/<batch>/`
+        """
+        self._append({'event': STAGED, 'batch': batch_id, 'location': location})
+
+    def commit(self, batch_id):
+        self._append({'event': COMMIT, 'batch': batch_id})
+
+    def abort(self, batch_id):
+        self._append({'event': ABORT, 'batch': batch_id})
+
+    def pending(self):
+        """
+        Batches which began but neither committed nor were aborted.
+        :return: [{'batch': string, 'stream': string, 'table': string, 'sequence': [min, max],
+                   'temp_tables': [string, ...], 'staged': [string, ...]}, ...]
+        """
+        batches = {}
+
+        with open(self.path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    ## A crash can leave the last line partially written
+                    continue
+
+                batch_id = entry.get('batch')
+                event = entry.get('event')
+
+                if event == BEGIN:
+                    batches[batch_id] = {'batch': batch_id,
+                                         'stream': entry.get('stream'),
+                                         'table': entry.get('table'),
+                                         'sequence': entry.get('sequence'),
+                                         'temp_tables': [],
+                                         'staged': []}
+                elif batch_id not in batches:
+                    continue
+                elif event == TEMP_TABLE:
+                    batches[batch_id]['temp_tables'].append(entry['name'])
+                elif event == STAGED:
+                    batches[batch_id]['staged'].append(entry['location'])
+                elif event in (COMMIT, ABORT):
+                    batches.pop(batch_id)
+
+        return list(batches.values())
+
+    def reset(self):
+        """
+        Empty the journal. Only safe once no batch is pending.
+        """
+        self._file.close()
+        self._file = open(self.path, 'w', encoding='utf-8')
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,164 @@
+from collections import Counter
+import contextlib
+import cProfile
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+
+import singer
+
+LOGGER = singer.get_logger()
+
+
+def _file_name(stream):
+    return re.sub(r'[^\w.-]+', '_', stream or 'stream')
+
+
+class _StackSampler:
+    """
+    Samples the stack of one thread from a background thread, as `;` separated `file:function:line`
+    frames, outermost first. This is the "collapsed" format flame graph tools read.
+    """
+
+    def __init__(self, thread_id, interval_seconds):
+        self.thread_id = thread_id
+        self.interval_seconds = interval_seconds
+        self.samples = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='flush-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval_seconds):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{}:{}:{}'.format(os.path.basename(code.co_filename), code.co_name, frame.f_lineno))
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as output:
+            for stack, count in self.samples.most_common():
+                output.write('{} {}\n'.format(stack, count))
+
+
+class FlushProfiler:
+    """
+    Profiles the Python side of writing batches, and writes the profiles to `directory`.
+
+    Every `every_batches`th batch runs under `cProfile`, and its stats are written to
+    `<run>.<stream>.<batch>.prof` (see `pstats`), where `<run>` is when the profiler was created.
+    With `allocations`, these batches also write a `tracemalloc` snapshot of the allocations made
+    while serializing each of their tables, to `<run>.<stream>.<batch>.<table>.tracemalloc`.
+
+    With `slow_seconds`, the other batches are sampled from a background thread every
+    `sample_interval_seconds`, which is cheap enough to leave on. The samples of a batch which takes
+    `slow_seconds` or more are written to `<run>.<stream>.<batch>.folded`, as collapsed stacks, and
+    the others are discarded.
+    """
+
+    def __init__(self, directory, every_batches=None, slow_seconds=None, allocations=False,
+                 sample_interval_seconds=0.01):
+        if not every_batches and slow_seconds is None:
+            raise ValueError('Profiling batches requires `every_batches`, `slow_seconds`, or both')
+
+        self.directory = directory
+        self.every_batches = every_batches
+        self.slow_seconds = slow_seconds
+        self.allocations = allocations
+        self.sample_interval_seconds = sample_interval_seconds
+
+        os.makedirs(directory, exist_ok=True)
+        self.prefix = time.strftime('%Y%m%dT%H%M%S')
+
+        self._profiled_batch = None
+
+    def _path(self, stream, batch_number, *suffixes):
+        return os.path.join(self.directory,
+                            '.'.join([self.prefix, _file_name(stream), '{:06d}'.format(batch_number)]
+                                     + list(suffixes)))
+
+    @contextlib.contextmanager
+    def batch(self, stream, batch_number):
+        """
+        Profile writing batch `batch_number` of `stream`, when it is sampled.
+        """
+        if self.every_batches and batch_number % self.every_batches == 0:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                ## Only one profiler can be active at a time
+                LOGGER.warning('{} - Could not profile batch {}, another profiler is active'.format(stream,
+                                                                                                    batch_number))
+                yield None
+                return
+
+            self._profiled_batch = (stream, batch_number)
+            try:
+                yield None
+            finally:
+                profile.disable()
+                self._profiled_batch = None
+                path = self._path(stream, batch_number, 'prof')
+                profile.dump_stats(path)
+                LOGGER.info('{} - Wrote profile of batch {} to {}'.format(stream, batch_number, path))
+            return
+
+        if self.slow_seconds is None:
+            yield None
+            return
+
+        sampler = _StackSampler(threading.get_ident(), self.sample_interval_seconds)
+        started = time.monotonic()
+        sampler.start()
+        try:
+            yield None
+        finally:
+            sampler.stop()
+            elapsed = time.monotonic() - started
+            if elapsed >= self.slow_seconds:
+                path = self._path(stream, batch_number, 'folded')
+                sampler.write(path)
+                LOGGER.info('{} - Batch {} took {:.1f} seconds, wrote its stack samples to {}'.format(stream,
+                                                                                                      batch_number,
+                                                                                                      elapsed,
+                                                                                                      path))
+
+    @contextlib.contextmanager
+    def serialization(self, table_name):
+        """
+        Trace the allocations made while serializing the rows of `table_name`, when the batch is
+        profiled and `allocations` is set.
+        """
+        if not self.allocations or self._profiled_batch is None:
+            yield None
+            return
+
+        ## Leave tracing on when it was started elsewhere, eg. by `PYTHONTRACEMALLOC`
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+        try:
+            yield None
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            if not was_tracing:
+                tracemalloc.stop()
+
+            stream, batch_number = self._profiled_batch
+            path = self._path(stream, batch_number, _file_name(table_name), 'tracemalloc')
+            snapshot.dump(path)
+            LOGGER.info('{} - Wrote allocations of serializing {} to {}'.format(stream, table_name, path))
@@ -0,0 +1,163 @@
+import gzip
+import uuid
+
+from boto3.s3.transfer import TransferConfig
+from target_redshift import s3
+
+COMPRESSION_GZIP = 'gzip'
+COMPRESSION_NONE = 'none'
+
+## Favour throughput over ratio, CSV still compresses several times over at level 1
+GZIP_COMPRESS_LEVEL = 1
+
+## Rows are compressed in blocks of at least this many bytes to amortise per call overhead
+WRITE_BLOCK_SIZE = 256 * 1024  # 256KB
+
+
+class _Sink:
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class _PartReader:
+    """
+    Readable, non seekable, file-like view over the next `max_bytes` (uncompressed) of a stream
+    of CSV rows, optionally gzip compressed on the fly. Only holds what has not been read yet.
+    """
+
+    def __init__(self, readable, first_row, max_bytes, compress):
+        self.input = readable
+        self.max_bytes = max_bytes
+        self.raw_bytes = 0
+        self.exhausted = False
+
+        self._next_row = first_row
+        self._done = False
+        self._sink = _Sink()
+        self._gzip = None
+        if compress:
+            self._gzip = gzip.GzipFile(fileobj=self._sink, mode='wb', compresslevel=GZIP_COMPRESS_LEVEL)
+
+    def readable(self):
+        return True
+
+    def _write(self, data):
+        if self._gzip:
+            self._gzip.write(data)
+        else:
+            self._sink.write(data)
+
+    def _fill(self, size):
+        block = []
+        block_size = 0
+        while not self._done and (size is None or size < 0 or len(self._sink.buffer) < size):
+            row = self._next_row if self._next_row is not None else self.input.read()
+            self._next_row = None
+
+            if row == '':
+                self.exhausted = True
+                self._done = True
+            else:
+                data = row.encode('utf-8')
+                block.append(data)
+                block_size += len(data)
+                self.raw_bytes += len(data)
+                if self.raw_bytes >= self.max_bytes:
+                    self._done = True
+
+            if block_size >= WRITE_BLOCK_SIZE or self._done:
+                self._write(b''.join(block))
+                block = []
+                block_size = 0
+
+        if self._done and self._gzip:
+            self._gzip.close()
+            self._gzip = None
+
+    def read(self, size=-1):
+        self._fill(size)
+
+        if size is None or size < 0:
+            size = len(self._sink.buffer)
+
+        output = bytes(self._sink.buffer[:size])
+        del self._sink.buffer[:size]
+        return output
+
+
+class S3(s3.S3):
+    """
+    `target_redshift.s3.S3` which streams uploads instead of holding them in memory. Rows are
+    compressed as they are read, uploaded as concurrent multipart uploads, and split over several
+    objects of at most `max_file_size` uncompressed bytes so that Snowflake can load them in parallel.
+    """
+
+    def __init__(self,
+                 aws_access_key_id,
+                 aws_secret_access_key,
+                 bucket,
+                 key_prefix='',
+                 aws_session_token=None,
+                 compression=COMPRESSION_GZIP,
+                 max_file_size=268435456,  # 256MB
+                 multipart_chunksize=16777216,  # 16MB
+                 max_concurrency=8):
+        super(S3, self).__init__(aws_access_key_id,
+                                 aws_secret_access_key,
+                                 bucket,
+                                 key_prefix=key_prefix or '',
+                                 aws_session_token=aws_session_token)
+
+        if compression not in (COMPRESSION_GZIP, COMPRESSION_NONE):
+            raise ValueError('Unknown S3 compression `{}`. Expected `{}` or `{}`'.format(
+                compression,
+                COMPRESSION_GZIP,
+                COMPRESSION_NONE))
+
+        self.compression = compression
+        self.max_file_size = max_file_size
+        self.transfer_config = TransferConfig(multipart_threshold=multipart_chunksize,
+                                              multipart_chunksize=multipart_chunksize,
+                                              max_concurrency=max_concurrency)
+
+    @property
+    def compressed(self):
+        return self.compression == COMPRESSION_GZIP
+
+    def persist_parts(self, readable, key_prefix='', on_part=None):
+        """
+        Upload `readable` under a new, unique, key prefix.
+        :param readable: object whose `read()` returns one CSV row at a time, and '' when done
+        :param key_prefix: string
+        :param on_part: optional function called with the key, and uncompressed size, of each uploaded object
+        :return: [bucket, prefix, [key, ...]]
+        """
+        prefix = self.key_prefix + key_prefix + str(uuid.uuid4()).replace('-', '') + '/'
+        extension = '.csv.gz' if self.compressed else '.csv'
+
+        keys = []
+        while True:
+            first_row = readable.read()
+            if first_row == '' and keys:
+                break
+
+            part = _PartReader(readable, first_row, self.max_file_size, self.compressed)
+            key = '{}part_{:05d}{}'.format(prefix, len(keys), extension)
+
+            self.client.upload_fileobj(part, self.bucket, key, Config=self.transfer_config)
+            keys.append(key)
+
+            if on_part:
+                on_part(key, part.raw_bytes)
+
+            if part.exhausted:
+                break
+
+        return [self.bucket, prefix, keys]
@@ -0,0 +1,196 @@
+from copy import deepcopy
+import hashlib
+import json
+
+from jsonschema import Draft4Validator, FormatChecker
+from jsonschema.exceptions import ValidationError
+from target_postgres import singer, singer_stream
+from target_postgres.exceptions import SingerStreamError
+
+VALIDATED = '__validated'
+
+VALIDATION_FULL = 'full'
+VALIDATION_OFF = 'off'
+VALIDATION_SAMPLE_PREFIX = 'sample:'
+
+## Fields `get_batch` adds to buffered records in place
+_BATCH_FIELDS = (singer.TABLE_VERSION, singer.RECEIVED_AT, singer.PK, singer.BATCHED_AT, singer.SEQUENCE)
+
+_VALIDATOR_CACHE_SIZE = 128
+_validators = {}
+
+
+def schema_fingerprint(schema):
+    """
+    Stable identifier for the content of a JSON Schema.
+    :param schema: JSON Schema
+    :return: string
+    """
+    return hashlib.sha1(json.dumps(schema, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def compiled_validator(fingerprint, schema):
+    """
+    Return the validator for `schema`, building it only the first time a fingerprint is seen.
+    :param fingerprint: string, see `schema_fingerprint`
+    :param schema: JSON Schema
+    :return: Draft4Validator
+    """
+    validator = _validators.get(fingerprint)
+    if validator is None:
+        if len(_validators) >= _VALIDATOR_CACHE_SIZE:
+            _validators.pop(next(iter(_validators)))
+        validator = Draft4Validator(schema, format_checker=FormatChecker())
+        _validators[fingerprint] = validator
+    return validator
+
+
+def parse_validation_mode(mode):
+    """
+    Parse a `validation_mode` config value into how often records should be validated.
+    :param mode: `full`, `off`, `sample:N` or None
+    :return: int, 1 to validate every record, N for every Nth record, 0 to never validate
+    """
+    if mode is None or mode == VALIDATION_FULL:
+        return 1
+    if mode == VALIDATION_OFF:
+        return 0
+    if isinstance(mode, str) and mode.startswith(VALIDATION_SAMPLE_PREFIX):
+        try:
+            every = int(mode[len(VALIDATION_SAMPLE_PREFIX):])
+        except ValueError:
+            every = 0
+        if every > 0:
+            return every
+
+    raise ValueError('Invalid `validation_mode` `{}`. Expected `{}`, `{}` or `{}N` with N > 0'.format(
+        mode,
+        VALIDATION_FULL,
+        VALIDATION_OFF,
+        VALIDATION_SAMPLE_PREFIX))
+
+
+class _SkipValidation:
+    def validate(self, record):
+        pass
+
+
+_SKIP_VALIDATION = _SkipValidation()
+
+
+class BufferedSingerStream(singer_stream.BufferedSingerStream):
+    """
+    `BufferedSingerStream` which:
+    - reuses validators across identical schemas
+    - only validates every `validate_every`th record (never when 0)
+    - accepts record messages which have already been validated, eg. by a `RecordWorkerPool`.
+      Such messages are flagged with `VALIDATED`.
+    """
+
+    def __init__(self, *args, validate_every=1, **kwargs):
+        self.validate_every = validate_every
+        self.schema_fingerprint = None
+        self.original_key_properties = None
+        self.unvalidated_count = 0
+        self._records_seen = 0
+        self._size = 0
+
+        super(BufferedSingerStream, self).__init__(*args, **kwargs)
+
+    def update_schema(self, schema, key_properties):
+        fingerprint = schema_fingerprint(schema)
+
+        ## Taps commonly repeat the same SCHEMA message. Simplifying the schema is expensive, so skip it.
+        if fingerprint == self.schema_fingerprint and key_properties == self.original_key_properties:
+            return None
+
+        super(BufferedSingerStream, self).update_schema(schema, key_properties)
+
+        self.schema_fingerprint = fingerprint
+        self.original_key_properties = deepcopy(key_properties)
+        self.validator = compiled_validator(fingerprint, schema)
+
+    @property
+    def size(self):
+        """
+        Bytes of the raw lines of the buffered records.
+        """
+        return self._size
+
+    def _should_validate(self):
+        if self.validate_every == 1:
+            return True
+        if self.validate_every == 0:
+            return False
+
+        self._records_seen += 1
+        return self._records_seen % self.validate_every == 1
+
+    def add_record_message(self, record_message):
+        count = self.count
+        result = self._add_record_message(record_message)
+
+        ## The base class keeps its own size private, and does not add every message it is given
+        if self.count > count:
+            self._size += singer_stream.get_line_size(record_message)
+
+        return result
+
+    def _add_record_message(self, record_message):
+        if record_message.pop(VALIDATED, False):
+            skip = True
+        elif not self._should_validate():
+            skip = True
+            self.unvalidated_count += 1
+        else:
+            skip = False
+
+        if not skip:
+            return super(BufferedSingerStream, self).add_record_message(record_message)
+
+        validator = self.validator
+        self.validator = _SKIP_VALIDATION
+        try:
+            return super(BufferedSingerStream, self).add_record_message(record_message)
+        finally:
+            self.validator = validator
+
+    def flush_buffer(self):
+        self.unvalidated_count = 0
+        self._size = 0
+        return super(BufferedSingerStream, self).flush_buffer()
+
+    def validate_buffer(self):
+        """
+        Validate every buffered record which skipped validation. Invalid records are dropped from
+        the buffer and treated as `add_record_message` treats them.
+        :return: int, number of invalid records found
+        """
+        if not self.unvalidated_count:
+            return 0
+
+        properties = self.validator.schema.get('properties', {})
+        batch_fields = [field for field in _BATCH_FIELDS if field not in properties]
+
+        invalid_count = 0
+        for record_message in self.flush_buffer():
+            record = dict((k, v) for k, v in record_message['record'].items() if k not in batch_fields)
+            try:
+                self.validator.validate(record)
+            except ValidationError as error:
+                invalid_count += 1
+                self.invalid_records.append((error, record_message))
+                continue
+
+            record_message[VALIDATED] = True
+            self.add_record_message(record_message)
+
+        if invalid_count \
+                and self.invalid_records_detect \
+                and len(self.invalid_records) >= self.invalid_records_threshold:
+            raise SingerStreamError(
+                'Invalid records detected above threshold: {}. See `.args` for details.'.format(
+                    self.invalid_records_threshold),
+                self.invalid_records)
+
+        return invalid_count
@@ -1,16 +1,22 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
 from copy import deepcopy
 import csv
+import hashlib
 import io
 import json
 import logging
 import os
 import re
+import shutil
+import time
 import uuid
 from functools import lru_cache
 
 import arrow
 from psycopg2 import sql
-from target_postgres import json_schema
+import singer.metrics as metrics
+from target_postgres import denest, json_schema
 from target_postgres.postgres import TransformStream
 from target_postgres.singer_stream import (
     SINGER_LEVEL,
@@ -19,7 +25,7 @@ from target_postgres.singer_stream import (
 from target_postgres.sql_base import SEPARATOR, SQLInterface
 
 from target_snowflake import sql
-from target_snowflake.connection import connect
+from target_snowflake.connection import connect, with_retries
 from target_snowflake.exceptions import SnowflakeError
 
 # copied in from optimization in PostgresTarget: https://github.com/datamill-co/target-postgres/commit/6a3da026d2bb4681fdf46bd7ca69fbb164489d8a
@@ -44,7 +50,20 @@ class SnowflakeTarget(SQLInterface):
     CREATE_TABLE_INITIAL_COLUMN = '_SDC_TARGET_SNOWFLAKE_CREATE_TABLE_PLACEHOLDER'
     CREATE_TABLE_INITIAL_COLUMN_TYPE = 'BOOLEAN'
 
-    def __init__(self, connection, *args, s3=None, logging_level=None, persist_empty_tables=False, **kwargs):
+    # Maximum number of file names a `COPY INTO ... FILES = (...)` accepts
+    COPY_MAX_FILES = 1000
+
+    # Maximum number of files of a batch uploaded at once
+    MAX_CONCURRENT_UPLOADS = 8
+
+    # Hash of a root table row's non `_sdc` columns, see `row_hash`
+    ROW_HASH_FIELD = '_sdc_row_hash'
+
+    def __init__(self, connection, *args, s3=None, logging_level=None, persist_empty_tables=False,
+                 batch_sizer=None, record_workers=None, s3_stage=None, s3_purge=False,
+                 internal_stage=None, internal_stage_purge=False, journal=None, direct_load_versions=False,
+                 cluster_min_rows=None, cluster_min_bytes=None, cluster_by=None, row_hash=False, query_tag=False, profiler=None,
+                 **kwargs):
         self.LOGGER.info('SnowflakeTarget created. Connected to WAREHOUSE: `{}` DB: `{}` SCHEMA: `{}`'.format(
             connection.configured_warehouse,
             connection.configured_database,
@@ -63,10 +82,47 @@ class SnowflakeTarget(SQLInterface):
 
         self.connection = connection
         self.s3 = s3
+        self.s3_stage = sql.stage_name(s3_stage) if s3_stage else None
+        self.s3_purge = s3_purge
+        self.internal_stage = sql.stage_name(internal_stage) if internal_stage else None
+        self.internal_stage_purge = internal_stage_purge
+        # Staged files of this run are grouped under this prefix, for bulk cleanup
+        self.run_id = str(uuid.uuid4()).replace('-', '')
         self.persist_empty_tables = persist_empty_tables
         if self.persist_empty_tables:
             self.LOGGER.debug('SnowflakeTarget is persisting empty tables')
 
+        self.batch_sizer = batch_sizer
+        self.record_workers = record_workers
+
+        self.journal = journal
+        self.journal_batch_id = None
+
+        self.direct_load_versions = direct_load_versions
+        # Tables of new table versions which were empty when this run started loading them
+        self.direct_load_tables = set()
+        self.loading_new_version = False
+
+        self.cluster_min_rows = cluster_min_rows
+        self.cluster_min_bytes = cluster_min_bytes
+        self.cluster_by = cluster_by or {}
+        # Tables whose clustering was checked by this run
+        self.clustering_checked = set()
+
+        self.row_hash = row_hash
+
+        # Columns which `migrate_column` renamed, and so are not left for `drop_column` to drop
+        self.migrated_columns = set()
+
+        # Stream whose batch is being written, to tag metrics with
+        self.metrics_stream = None
+
+        self.query_tag = query_tag
+        # Number of the batch being written by this run, to tag queries with
+        self.batch_number = 0
+
+        self.profiler = profiler
+
         self.table_info_cache = {}
         self.table_schema_cache = {}
 
@@ -75,6 +131,139 @@ class SnowflakeTarget(SQLInterface):
                 'database': self.connection.configured_database,
                 'schema': self.connection.configured_schema}
 
+    def _phase_timer(self, phase, path=None, table_name=None):
+        """
+        Timer for one phase of writing a batch, eg. `copy` or `merge_insert`.
+        :param phase: String
+        :param path: (String, ...), table path, when the phase is specific to a table
+        :param table_name: String
+        :return: singer.metrics.Timer
+        """
+        timer = self._set_timer_tags(metrics.job_timer(), phase, path)
+        timer.tags['stream'] = self.metrics_stream
+        if table_name:
+            self._set_metrics_tags__table(timer, table_name)
+        return timer
+
+    def _count(self, count_type, value, path=None, table_name=None):
+        with self._set_counter_tags(metrics.record_counter(None), count_type, path) as counter:
+            counter.tags['stream'] = self.metrics_stream
+            if table_name:
+                self._set_metrics_tags__table(counter, table_name)
+            counter.increment(value)
+
+    def _profile_serialization(self, table_name):
+        if self.profiler:
+            return self.profiler.serialization(table_name)
+        return contextlib.nullcontext()
+
+    def _tag_queries(self, phase, table_name=None):
+        """
+        Set the session's QUERY_TAG to what the following statements are run for, so that their
+        cost can be attributed in `QUERY_HISTORY`.
+        :param phase: String, eg. `copy` or `merge`
+        :param table_name: String
+        """
+        if not self.query_tag:
+            return None
+
+        self.connection.set_query_tag(json.dumps({'target': 'target-snowflake',
+                                                  'run': self.run_id,
+                                                  'batch': self.batch_number,
+                                                  'stream': self.metrics_stream,
+                                                  'table': table_name,
+                                                  'phase': phase},
+                                                 sort_keys=True))
+
+    def _set_flight_context(self, table_name, **context):
+        """
+        Set what slow statements are recorded with by the connection's `FlightRecorder`, if any.
+        :param table_name: String, table being loaded, or None once it is loaded
+        """
+        flight_recorder = getattr(self.connection, 'flight_recorder', None)
+        if flight_recorder is None:
+            return None
+
+        if table_name is None:
+            flight_recorder.context = {}
+            return None
+
+        context.update({'run': self.run_id,
+                        'batch': self.batch_number,
+                        'stream': self.metrics_stream,
+                        'table': table_name})
+        flight_recorder.context = context
+
+    def cleanup(self):
+        """
+        Remove files this run left in its stages. Called once streaming is over.
+        """
+        if self.journal and not self.journal.pending():
+            self.journal.reset()
+
+        stages = []
+        if self.s3:
+            if self.s3_stage and not self.s3_purge:
+                stages.append(self.s3_stage)
+        elif self.internal_stage and not self.internal_stage_purge:
+            stages.append(self.internal_stage)
+
+        if stages:
+            self.metrics_stream = None
+            self._tag_queries('cleanup')
+
+        for stage in stages:
+            with self.connection.cursor() as cur:
+                cur.execute('''
+                    REMOVE @{stage}/{run_id}/
+                '''.format(
+                    stage=stage,
+                    run_id=self.run_id))
+
+    def recover(self):
+        """
+        Roll back the loads which `self.journal` shows were interrupted before they committed. Their
+        records are sent again from the last emitted STATE, so only their temp tables and staged
+        files are left to clean up.
+        """
+        if not self.journal:
+            return None
+
+        pending = self.journal.pending()
+        if pending:
+            self._tag_queries('recover')
+
+        for batch in pending:
+            self.LOGGER.warning('{} - Rolling back interrupted load of `_sdc_sequence` range {} into {}'.format(
+                batch['stream'],
+                batch['sequence'],
+                batch['table']))
+            self.roll_back_load(batch)
+
+        self.journal.reset()
+
+    def roll_back_load(self, batch):
+        """
+        Drop the temp tables, and remove the staged files, of a journaled batch which did not commit.
+        :param batch: see `LoadJournal.pending`
+        """
+        with self.connection.cursor() as cur:
+            for temp_table_name in batch['temp_tables']:
+                cur.execute('''
+                    DROP TABLE IF EXISTS {db}.{schema}.{temp_table}
+                '''.format(
+                    db=sql.identifier(self.connection.configured_database),
+                    schema=sql.identifier(self.connection.configured_schema),
+                    temp_table=sql.identifier(temp_table_name)))
+
+            for location in batch['staged']:
+                cur.execute('''
+                    REMOVE {location}
+                '''.format(location=location))
+
+        self.connection.commit()
+        self.journal.abort(batch['batch'])
+
     def _get_all_table_info(self, cur, database, schema):
         key = '{}.{}'.format(database, schema)
         tables = self.table_info_cache.get(key)
@@ -106,6 +295,13 @@ class SnowflakeTarget(SQLInterface):
 
         tables[table] = [None, table, database, schema, 'TABLE', json.dumps(comment)]
 
+    def _remove_table_info(self, database, schema, table):
+        key = '{}.{}'.format(database, schema)
+        tables = self.table_info_cache.get(key)
+
+        if tables is not None:
+            tables.pop(table, None)
+
     def _get_table_info(self, database, schema, table):
         key = '{}.{}'.format(database, schema)
         tables = self.table_info_cache.get(key)
@@ -128,10 +324,50 @@ class SnowflakeTarget(SQLInterface):
             if table_path:
                 self.table_mapping_cache[tuple(table_path)] = mapped_name
 
+    def _with_retries(self, operation, description):
+        """
+        Run `operation`, a whole transaction, again from scratch when it fails with a transient error.
+        """
+        attempts = [0]
+
+        def attempt():
+            if attempts[0]:
+                ## What a failed attempt cached may not match what Snowflake kept of it
+                self.table_info_cache = {}
+                self.table_schema_cache = {}
+                self.direct_load_tables = set()
+            attempts[0] += 1
+            return operation()
+
+        return with_retries(self.connection, attempt, description)
+
     def write_batch(self, stream_buffer):
+        self.batch_number += 1
+
+        # The buffer is only flushed once the batch is written, so every attempt replays it
+        write_batch = lambda: self._with_retries(lambda: self._write_batch(stream_buffer),
+                                                 '{} - Writing batch'.format(stream_buffer.stream))
+        try:
+            if self.profiler:
+                with self.profiler.batch(stream_buffer.stream, self.batch_number):
+                    return write_batch()
+            return write_batch()
+        except SnowflakeError:
+            # Records buffered without validation (see `validation_mode`) are validated once the batch
+            # fails, and the batch is retried without the invalid ones.
+            if getattr(stream_buffer, 'unvalidated_count', 0) and stream_buffer.validate_buffer() > 0:
+                self.LOGGER.warning('{} - Retrying batch without invalid records'.format(stream_buffer.stream))
+                return write_batch()
+            raise
+
+    def _write_batch(self, stream_buffer):
         if not self.persist_empty_tables and stream_buffer.count == 0:
             return None
 
+        write_batch__start = time.monotonic()
+        self.metrics_stream = stream_buffer.stream
+        self._tag_queries('schema')
+
         with self.connection.cursor() as cur:
             try:
                 self.setup_table_mapping_cache(cur)
@@ -171,6 +407,8 @@ class SnowflakeTarget(SQLInterface):
 
                 target_table_version = current_table_version or stream_buffer.max_version
 
+                self.loading_new_version = current_table_schema is None
+
                 self.LOGGER.info('Stream {} ({}) with max_version {} targetting {}'.format(
                     stream_buffer.stream,
                     root_table_name,
@@ -190,27 +428,265 @@ class SnowflakeTarget(SQLInterface):
                     elif stream_buffer.max_version > current_table_version:
                         root_table_name += SEPARATOR + str(stream_buffer.max_version)
                         target_table_version = stream_buffer.max_version
+                        self.loading_new_version = True
 
                 self.LOGGER.info('Root table name {}'.format(root_table_name))
 
+                records = stream_buffer.get_batch()
+
+                if self.journal:
+                    sequences = [record[SINGER_SEQUENCE] for record in records
+                                 if record.get(SINGER_SEQUENCE) is not None]
+                    self.journal_batch_id = self.journal.begin(
+                        stream_buffer.stream,
+                        root_table_name,
+                        [min(sequences), max(sequences)] if sequences else None)
+
                 written_batches_details = self.write_batch_helper(cur,
                                                                   root_table_name,
                                                                   stream_buffer.schema,
                                                                   stream_buffer.key_properties,
-                                                                  stream_buffer.get_batch(),
+                                                                  records,
                                                                   {'version': target_table_version})
 
                 self.connection.commit()
 
+                if self.journal_batch_id:
+                    self.journal.commit(self.journal_batch_id)
+                    self.journal_batch_id = None
+
+                if self.batch_sizer:
+                    self.batch_sizer.observe(stream_buffer,
+                                             stream_buffer.count,
+                                             time.monotonic() - write_batch__start)
+
                 return written_batches_details
             except Exception as ex:
                 self.connection.rollback()
                 message = 'Exception writing records'
                 self.LOGGER.exception(message)
+
+                if self.journal_batch_id:
+                    batch_id = self.journal_batch_id
+                    self.journal_batch_id = None
+                    try:
+                        for batch in self.journal.pending():
+                            if batch['batch'] == batch_id:
+                                self.roll_back_load(batch)
+                    except Exception:
+                        self.LOGGER.warning('Could not roll back load, it is retried on restart', exc_info=True)
+
                 raise SnowflakeError(message, ex)
 
+    def write_batch_helper(self, cur, root_table_name, schema, key_properties, records, metadata):
+        """
+        Same as `SQLInterface.write_batch_helper`, but denests `records` in `self.record_workers`
+        when configured, and uploads the root table and subtables of the batch together before
+        loading each of them.
+        """
+        with self._set_timer_tags(metrics.job_timer(),
+                                  'batch',
+                                  (root_table_name,)):
+            with self._set_counter_tags(metrics.record_counter(None),
+                                        'batch_rows_persisted',
+                                        (root_table_name,)) as batch_counter:
+                self.LOGGER.info('Writing batch with {} records for `{}` with `key_properties`: `{}`'.format(
+                    len(records),
+                    root_table_name,
+                    key_properties
+                ))
+
+                if self.record_workers:
+                    table_batches = self.record_workers.to_table_batches(schema, key_properties, records)
+                else:
+                    table_batches = denest.to_table_batches(schema, key_properties, records)
+
+                staged_tables = []
+                for table_batch in table_batches:
+                    table_batch['streamed_schema']['path'] = (root_table_name,) + \
+                                                             table_batch['streamed_schema']['path']
+
+                    self.LOGGER.info('Writing table batch schema for `{}`...'.format(
+                        table_batch['streamed_schema']['path']
+                    ))
+
+                    ## Subtable rows are merged by their root's keys, which a row hash cannot represent
+                    row_hash = self.row_hash and len(table_batch['streamed_schema']['path']) == 1
+                    if row_hash:
+                        table_batch['streamed_schema']['schema']['properties'][(self.ROW_HASH_FIELD,)] = \
+                            {'anyOf': [{'type': ['string', 'null']}]}
+
+                    with self._phase_timer('schema', table_batch['streamed_schema']['path']):
+                        remote_schema = self.upsert_table_helper(cur,
+                                                                 table_batch['streamed_schema'],
+                                                                 metadata)
+
+                        self.manage_clustering(cur, remote_schema)
+
+                    self.LOGGER.info('Writing table batch with {} rows for `{}`...'.format(
+                        len(table_batch['records']),
+                        table_batch['streamed_schema']['path']
+                    ))
+
+                    with self._phase_timer('serialize', table_batch['streamed_schema']['path'], remote_schema['name']), \
+                            self._profile_serialization(remote_schema['name']):
+                        serialized_records = self._serialize_table_records(remote_schema,
+                                                                           table_batch['streamed_schema'],
+                                                                           table_batch['records'])
+
+                        row_hash_column = None
+                        if row_hash:
+                            row_hash_column = self.fetch_column_from_path((self.ROW_HASH_FIELD,), remote_schema)[0]
+                            self._add_row_hashes(row_hash_column, serialized_records)
+
+                    staged_table = self.prepare_table_batch(
+                        cur,
+                        {'remote_schema': remote_schema,
+                         'records': serialized_records})
+
+                    if staged_table:
+                        staged_table['path'] = table_batch['streamed_schema']['path']
+
+                    if staged_table and row_hash_column:
+                        staged_table['row_hash_column'] = row_hash_column
+
+                    if staged_table and self.loading_new_version:
+                        staged_table['merge'] = self._requires_merge(cur, remote_schema['name'])
+
+                    staged_tables.append((table_batch['streamed_schema']['path'], remote_schema, staged_table))
+
+                ## Upload the root table and all of its subtables together
+                self._tag_queries('stage')
+                with self._phase_timer('stage', (root_table_name,)):
+                    self.stage_csv_rows(cur, [staged_table for _, _, staged_table in staged_tables if staged_table])
+
+                for path, remote_schema, staged_table in staged_tables:
+                    with self._set_timer_tags(metrics.job_timer(),
+                                              'table',
+                                              path) as table_batch_timer:
+                        with self._set_counter_tags(metrics.record_counter(None),
+                                                    'table_rows_persisted',
+                                                    path) as table_batch_counter:
+                            self._set_metrics_tags__table(table_batch_timer, remote_schema['name'])
+                            self._set_metrics_tags__table(table_batch_counter, remote_schema['name'])
+
+                            batch_rows_persisted = 0
+                            if staged_table:
+                                self.copy_staged_rows(cur, staged_table)
+                                batch_rows_persisted = staged_table['record_count']
+
+                            table_batch_counter.increment(batch_rows_persisted)
+                            batch_counter.increment(batch_rows_persisted)
+
+                return {
+                    'records_persisted': len(records),
+                    'rows_persisted': batch_counter.value
+                }
+
+    def _clustering_expression(self, remote_schema):
+        table_name = remote_schema['name']
+
+        if table_name in self.cluster_by:
+            if self.cluster_by[table_name]:
+                return self.cluster_by[table_name]
+        else:
+            table_info = self._get_table_info(self.connection.configured_database,
+                                              self.connection.configured_schema,
+                                              table_name)
+
+            ## `SHOW TABLES` rows hold the table's row count and size in bytes
+            row_count = table_info[7] if table_info is not None and len(table_info) > 8 else None
+            byte_count = table_info[8] if table_info is not None and len(table_info) > 8 else None
+
+            if not (self.cluster_min_rows is not None and row_count is not None and row_count >= self.cluster_min_rows) \
+                    and not (self.cluster_min_bytes is not None and byte_count is not None and byte_count >= self.cluster_min_bytes):
+                return None
+
+        key_columns = [sql.identifier(self.fetch_column_from_path((key_property,), remote_schema)[0])
+                       for key_property in remote_schema['key_properties']]
+        return ', '.join(key_columns) or None
+
+    def manage_clustering(self, cur, remote_schema):
+        """
+        Cluster `remote_schema`'s table by its key properties, or by the expression configured in
+        `cluster_by`, once it is listed in `cluster_by` or has grown past `cluster_min_rows` or
+        `cluster_min_bytes`. The clustering key is recorded in the table's metadata.
+        :param cur: Cursor
+        :param remote_schema: TABLE_SCHEMA(remote)
+        :return: None
+        """
+        table_name = remote_schema['name']
+        if table_name in self.clustering_checked:
+            return None
+        self.clustering_checked.add(table_name)
+
+        expression = self._clustering_expression(remote_schema)
+        if expression is None:
+            return None
+
+        metadata = self._get_table_metadata(cur, table_name) or {}
+        if metadata.get('cluster_by') == expression:
+            return None
+
+        self.LOGGER.info('Clustering `{}` by `{}`'.format(table_name, expression))
+
+        cur.execute('''
+            ALTER TABLE {db}.{schema}.{table} CLUSTER BY ({expression})
+            '''.format(
+                db=sql.identifier(self.connection.configured_database),
+                schema=sql.identifier(self.connection.configured_schema),
+                table=sql.identifier(table_name),
+                expression=expression))
+
+        metadata['cluster_by'] = expression
+        self._set_table_metadata(cur, table_name, metadata)
+
+    def _add_row_hashes(self, row_hash_column, rows):
+        """
+        Set `row_hash_column` of each serialized row to a hash of its values, leaving out the
+        `_sdc` columns, which change every time a record is sent.
+        :param row_hash_column: String
+        :param rows: [{...}, ...]
+        :return: None
+        """
+        if not rows:
+            return None
+
+        hashed_columns = sorted(column for column in rows[0].keys()
+                                if not column.upper().startswith('_SDC_'))
+
+        for row in rows:
+            row[row_hash_column] = hashlib.md5(
+                json.dumps([row[column] for column in hashed_columns], default=str).encode('utf-8')
+            ).hexdigest()
+
+    def _requires_merge(self, cur, table_name):
+        """
+        Whether rows loaded into `table_name`, a table of a new table version, have to be merged
+        with the rows already in it. They do not while the table is empty, nor, with
+        `direct_load_versions`, when the table was empty when this run started loading it.
+        :param cur: Cursor
+        :param table_name: String
+        :return: Boolean
+        """
+        if table_name in self.direct_load_tables:
+            return not self.direct_load_versions
+
+        if self.is_table_empty(cur, table_name):
+            self.direct_load_tables.add(table_name)
+            return False
+
+        return True
+
     def activate_version(self, stream_buffer, version):
-        with self.connection.cursor() as cur:
+        return self._with_retries(lambda: self._activate_version(stream_buffer, version),
+                                  '{} - Activating table version {}'.format(stream_buffer.stream, version))
+
+    def _activate_version(self, stream_buffer, version):
+        self.metrics_stream = stream_buffer.stream
+        self._tag_queries('activate_version')
+
+        with self.connection.cursor() as cur, self._phase_timer('activate_version'):
             try:
                 self.setup_table_mapping_cache(cur)
                 root_table_name = self.add_table_mapping(cur, (stream_buffer.stream,), {})
@@ -219,10 +695,6 @@ class SnowflakeTarget(SQLInterface):
                 if not current_table_schema:
                     self.LOGGER.error('{} - Table for stream does not exist'.format(
                         stream_buffer.stream))
-                elif current_table_schema.get('version') is not None and current_table_schema.get('version') >= version:
-                    self.LOGGER.warning('{} - Table version {} already active'.format(
-                        stream_buffer.stream,
-                        version))
                 else:
                     versioned_root_table = root_table_name + SEPARATOR + str(version)
 
@@ -230,49 +702,86 @@ class SnowflakeTarget(SQLInterface):
 
                     all_tables = self._get_all_table_info(cur, self.connection.configured_database, self.connection.configured_schema)
 
+                    db_schema = '{}.{}'.format(
+                        sql.identifier(self.connection.configured_database),
+                        sql.identifier(self.connection.configured_schema))
+
+                    activated = []
+                    statements = []
                     for versioned_table_name in all_tables.keys():
                         # equivalent to SQL check of `<versioned_table_name> NOT LIKE '<versioned_root_table>%`
-                        if len(versioned_table_name) <= len(versioned_root_table) or versioned_table_name.startswith(versioned_root_table) == False:
+                        if len(versioned_table_name) < len(versioned_root_table) or versioned_table_name.startswith(versioned_root_table) == False:
                             continue
 
                         table_name = root_table_name + versioned_table_name[len(versioned_root_table):]
                         table_path = names_to_paths[table_name]
 
-                        args = {'db_schema': '{}.{}'.format(
-                                    sql.identifier(self.connection.configured_database),
-                                    sql.identifier(self.connection.configured_schema)),
-                                'stream_table_old': sql.identifier(table_name +
-                                                                SEPARATOR +
-                                                                'OLD'),
-                                'stream_table': sql.identifier(table_name),
-                                'version_table': sql.identifier(versioned_table_name)}
-
-                        cur.execute(
-                            '''
-                            ALTER TABLE {db_schema}.{stream_table} RENAME TO {db_schema}.{stream_table_old}
-                            '''.format(**args))
-
-                        cur.execute(
-                            '''
-                            ALTER TABLE {db_schema}.{version_table} RENAME TO {db_schema}.{stream_table}
-                            '''.format(**args))
-
-                        cur.execute(
-                            '''
-                            DROP TABLE {db_schema}.{stream_table_old}
-                            '''.format(**args))
-
-                        self.connection.commit()
+                        ## A table whose own metadata is of this version was swapped by an earlier
+                        ##  attempt, so only its versioned table, holding the previous version, is
+                        ##  left to drop
+                        current_metadata = self._get_table_metadata(cur, table_name) or {}
+                        if current_metadata.get('version') is not None and current_metadata['version'] >= version:
+                            activated.append((table_name, versioned_table_name, current_metadata))
+                            continue
 
-                        metadata = self._get_table_metadata(cur, table_name)
+                        metadata = self._get_table_metadata(cur, versioned_table_name)
+                        metadata['path'] = table_path
 
-                        self.LOGGER.info('Activated {}, setting path to {}'.format(
-                            metadata,
-                            table_path
-                        ))
+                        activated.append((table_name, versioned_table_name, metadata))
+
+                        ## Once swapped, the versioned table holds the previous version along with its
+                        ##  metadata, so its own path is set back, lest it claims the stream table's too
+                        current_metadata['path'] = names_to_paths[versioned_table_name]
+
+                        statements.append('''
+                            ALTER TABLE {db_schema}.{version_table} SWAP WITH {db_schema}.{stream_table}
+                            '''.format(
+                                db_schema=db_schema,
+                                version_table=sql.identifier(versioned_table_name),
+                                stream_table=sql.identifier(table_name)))
+                        statements.append(self._set_table_metadata_statement(table_name, metadata))
+                        statements.append(self._set_table_metadata_statement(versioned_table_name, current_metadata))
+
+                    if not activated:
+                        if current_table_schema.get('version') is not None \
+                                and current_table_schema.get('version') >= version:
+                            self.LOGGER.warning('{} - Table version {} already active'.format(
+                                stream_buffer.stream,
+                                version))
+                    else:
+                        ## Each SWAP is atomic, but the request is not: every DDL statement commits
+                        ##  on its own. When a request fails part way, the next attempt only swaps the
+                        ##  tables which were not swapped yet, and drops all of the versioned tables.
+                        if statements:
+                            cur.execute(';'.join(statements), num_statements=len(statements))
+                            self.connection.commit()
+
+                        for table_name, versioned_table_name, metadata in activated:
+                            self.LOGGER.info('Activated {}, setting path to {}'.format(
+                                metadata,
+                                metadata['path']
+                            ))
 
-                        metadata['path'] = table_path
-                        self._set_table_metadata(cur, table_name, metadata)
+                            self._add_table_info(self.connection.configured_database,
+                                                 self.connection.configured_schema,
+                                                 table_name,
+                                                 metadata)
+                            self._remove_table_info(self.connection.configured_database,
+                                                    self.connection.configured_schema,
+                                                    versioned_table_name)
+
+                        # reset table schema cache so the next request for schema will update from the DB
+                        self.table_schema_cache = {}
+
+                        ## The versioned tables now hold the previous versions. Snowflake keeps
+                        ## running detached queries, so dropping them does not hold up the sync.
+                        drops = ['''
+                            DROP TABLE IF EXISTS {db_schema}.{version_table}
+                            '''.format(
+                                db_schema=db_schema,
+                                version_table=sql.identifier(versioned_table_name))
+                                 for _, versioned_table_name, _ in activated]
+                        cur.execute_async(';'.join(drops), num_statements=len(drops))
             except Exception as ex:
                 self.connection.rollback()
                 message = '{} - Exception activating table version {}'.format(
@@ -347,7 +856,49 @@ class SnowflakeTarget(SQLInterface):
     def serialize_table_record_datetime_value(self, remote_schema, streamed_schema, field, value):
         return _format_datetime(value)
 
-    def perform_update(self, cur, target_table_name, temp_table_name, key_properties, columns, subkeys):
+    def _key_range_predicates(self, cur, full_table_name, full_temp_table_name, key_properties, sequence_identifier):
+        """
+        Bound the keys, and sequences, of the target table's rows a batch can match, so that
+        Snowflake can prune the micro-partitions the merge has to scan. The bounds come from the
+        temp table's metadata, which makes the query cheap.
+        :return: (key range predicates, their params, sequence range predicate, its params)
+        """
+        bounds = []
+        for pk in key_properties:
+            bounds.append('MIN({pk}), MAX({pk})'.format(pk=sql.identifier(pk)))
+        bounds.append('MAX({})'.format(sequence_identifier))
+
+        cur.execute('''
+            SELECT {bounds} FROM {temp_table}
+            '''.format(
+                bounds=', '.join(bounds),
+                temp_table=full_temp_table_name))
+        row = cur.fetchone()
+
+        key_ranges = ''
+        key_range_params = []
+        for i, pk in enumerate(key_properties):
+            low, high = row[2 * i], row[2 * i + 1]
+            if low is None or high is None:
+                continue
+
+            key_ranges += ' AND {table}.{pk} BETWEEN %s AND %s'.format(
+                table=full_table_name,
+                pk=sql.identifier(pk))
+            key_range_params += [low, high]
+
+        sequence_range = ''
+        sequence_range_params = []
+        if row[-1] is not None:
+            sequence_range = ' AND {table}.{sequence} <= %s'.format(
+                table=full_table_name,
+                sequence=sequence_identifier)
+            sequence_range_params = [row[-1]]
+
+        return key_ranges, key_range_params, sequence_range, sequence_range_params
+
+    def perform_update(self, cur, target_table_name, temp_table_name, key_properties, columns, subkeys, merge=True,
+                       row_hash_column=None):
         full_table_name = '{}.{}.{}'.format(
             sql.identifier(self.connection.configured_database),
             sql.identifier(self.connection.configured_schema),
@@ -400,6 +951,13 @@ class SnowflakeTarget(SQLInterface):
             full_table_name,
             sequence_identifier)
 
+        if row_hash_column:
+            ## Rows which did not change are neither deleted nor, as their keys are still in the
+            ## table, inserted again
+            sequence_join += ' AND "dedupped".{hash} IS DISTINCT FROM {table}.{hash}'.format(
+                hash=sql.identifier(row_hash_column),
+                table=full_table_name)
+
         distinct_order_by = ' ORDER BY {}, {}.{} DESC'.format(
             pk_temp_select,
             full_temp_table_name,
@@ -429,158 +987,335 @@ class SnowflakeTarget(SQLInterface):
         insert_columns = ', '.join(insert_columns_list)
         dedupped_columns = ', '.join(dedupped_columns_list)
 
-        cur.execute('''
-            DELETE FROM {table} USING (
-                    SELECT {pk_dedupped_col}
-                    FROM (
-                        SELECT *,
-                               ROW_NUMBER() OVER (PARTITION BY {pk_temp_select}
-                                                  {distinct_order_by}) AS "_sdc_pk_ranked"
-                        FROM {temp_table}
-                        {distinct_order_by}
-                    ) AS "dedupped"
-                    JOIN {table} ON {pk_where}{sequence_join}
-                    WHERE "_sdc_pk_ranked" = 1
-                    GROUP BY {pk_dedupped_col}
-                ) AS "pks" WHERE {cxt_where};
-            '''.format(
-                table=full_table_name,
-                temp_table=full_temp_table_name,
-                pk_temp_select=pk_temp_select,
-                pk_where=pk_where,
-                cxt_where=cxt_where,
-                sequence_join=sequence_join,
-                distinct_order_by=distinct_order_by,
-                pk_dedupped_col=pk_dedupped_col))
+        self._tag_queries('merge', target_table_name)
+
+        if not merge:
+            ## Nothing to merge with, only dedup within the batch
+            with self._phase_timer('insert', table_name=target_table_name):
+                cur.execute('''
+                    INSERT INTO {table}({insert_columns}) (
+                        SELECT {dedupped_columns}
+                        FROM (
+                            SELECT *,
+                                   ROW_NUMBER() OVER (PARTITION BY {insert_distinct_on}
+                                                      {insert_distinct_order_by}) AS "_sdc_pk_ranked"
+                            FROM {temp_table}) AS "dedupped"
+                        WHERE "_sdc_pk_ranked" = 1
+                    );
+                    '''.format(
+                        table=full_table_name,
+                        temp_table=full_temp_table_name,
+                        insert_distinct_on=insert_distinct_on,
+                        insert_distinct_order_by=insert_distinct_order_by,
+                        insert_columns=insert_columns,
+                        dedupped_columns=dedupped_columns))
+        else:
+            with self._phase_timer('merge_delete', table_name=target_table_name):
+                key_ranges, key_range_params, sequence_range, sequence_range_params = self._key_range_predicates(
+                    cur,
+                    full_table_name,
+                    full_temp_table_name,
+                    key_properties,
+                    sequence_identifier)
+
+                cur.execute('''
+                    DELETE FROM {table} USING (
+                            SELECT {pk_dedupped_col}
+                            FROM (
+                                SELECT *,
+                                       ROW_NUMBER() OVER (PARTITION BY {pk_temp_select}
+                                                          {distinct_order_by}) AS "_sdc_pk_ranked"
+                                FROM {temp_table}
+                                {distinct_order_by}
+                            ) AS "dedupped"
+                            JOIN {table} ON {pk_where}{sequence_join}{key_ranges}{sequence_range}
+                            WHERE "_sdc_pk_ranked" = 1
+                            GROUP BY {pk_dedupped_col}
+                        ) AS "pks" WHERE {cxt_where}{key_ranges}{sequence_range};
+                    '''.format(
+                        table=full_table_name,
+                        temp_table=full_temp_table_name,
+                        pk_temp_select=pk_temp_select,
+                        pk_where=pk_where,
+                        cxt_where=cxt_where,
+                        sequence_join=sequence_join,
+                        key_ranges=key_ranges,
+                        sequence_range=sequence_range,
+                        distinct_order_by=distinct_order_by,
+                        pk_dedupped_col=pk_dedupped_col),
+                    params=(key_range_params + sequence_range_params) * 2)
+
+            with self._phase_timer('merge_insert', table_name=target_table_name):
+                cur.execute('''
+                    INSERT INTO {table}({insert_columns}) (
+                        SELECT {dedupped_columns}
+                        FROM (
+                            SELECT *,
+                                   ROW_NUMBER() OVER (PARTITION BY {insert_distinct_on}
+                                                      {insert_distinct_order_by}) AS "_sdc_pk_ranked"
+                            FROM {temp_table}
+                            {insert_distinct_order_by}) AS "dedupped"
+                        LEFT JOIN {table} ON {pk_where}{key_ranges}
+                        WHERE "_sdc_pk_ranked" = 1 AND {pk_null}
+                    );
+                    '''.format(
+                        table=full_table_name,
+                        temp_table=full_temp_table_name,
+                        pk_where=pk_where,
+                        key_ranges=key_ranges,
+                        pk_null=pk_null,
+                        insert_distinct_on=insert_distinct_on,
+                        insert_distinct_order_by=insert_distinct_order_by,
+                        insert_columns=insert_columns,
+                        dedupped_columns=dedupped_columns),
+                    params=key_range_params)
+
+        with self._phase_timer('cleanup', table_name=target_table_name):
+            if not self.s3 and not self.internal_stage:
+                # Clear out the associated stage for the table
+                cur.execute('''
+                    REMOVE @{db}.{schema}.%{temp_table}
+                '''.format(
+                    db=sql.identifier(self.connection.configured_database),
+                    schema=sql.identifier(self.connection.configured_schema),
+                    temp_table=sql.identifier(temp_table_name)))
 
-        cur.execute('''
-            INSERT INTO {table}({insert_columns}) (
-                SELECT {dedupped_columns}
-                FROM (
-                    SELECT *,
-                           ROW_NUMBER() OVER (PARTITION BY {insert_distinct_on}
-                                              {insert_distinct_order_by}) AS "_sdc_pk_ranked"
-                    FROM {temp_table}
-                    {insert_distinct_order_by}) AS "dedupped"
-                LEFT JOIN {table} ON {pk_where}
-                WHERE "_sdc_pk_ranked" = 1 AND {pk_null}
-            );
-            '''.format(
-                table=full_table_name,
-                temp_table=full_temp_table_name,
-                pk_where=pk_where,
-                pk_null=pk_null,
-                insert_distinct_on=insert_distinct_on,
-                insert_distinct_order_by=insert_distinct_order_by,
-                insert_columns=insert_columns,
-                dedupped_columns=dedupped_columns))
-
-        if not self.s3:
-            # Clear out the associated stage for the table
+            # Drop the tmp table
             cur.execute('''
-                REMOVE @{db}.{schema}.%{temp_table}
-            '''.format(
-                db=sql.identifier(self.connection.configured_database),
-                schema=sql.identifier(self.connection.configured_schema),
-                temp_table=sql.identifier(temp_table_name)))
+                DROP TABLE {temp_table};
+                '''.format(temp_table=full_temp_table_name))
 
-        # Drop the tmp table
-        cur.execute('''
-            DROP TABLE {temp_table};
-            '''.format(temp_table=full_temp_table_name))
+    def _stage_s3(self, staged_table, key_prefix):
+        temp_table_name = staged_table['temp_table_name']
+        part_sizes = []
 
-    def persist_csv_rows(self,
-                         cur,
-                         remote_schema,
-                         temp_table_name,
-                         columns,
-                         csv_rows):
-        params = []
+        with self._phase_timer('s3_upload', staged_table.get('path'), staged_table['remote_schema']['name']):
+            bucket, prefix, keys = self.s3.persist_parts(staged_table['csv_rows'],
+                                                         key_prefix=key_prefix + temp_table_name + SEPARATOR,
+                                                         on_part=lambda key, size: part_sizes.append(size))
+        self.LOGGER.debug('Staged {} files under s3://{}/{}'.format(len(keys), bucket, prefix))
 
-        if self.s3:
-            bucket, key = self.s3.persist(csv_rows,
-                                          key_prefix=temp_table_name + SEPARATOR)
-            stage_location = "'s3://{bucket}/{key}' credentials=(AWS_KEY_ID=%s AWS_SECRET_KEY=%s)".format(
-                bucket=bucket,
-                key=key)
-            params = [self.s3.credentials()['aws_access_key_id'],
-                      self.s3.credentials()['aws_secret_access_key']]
+        self._count('staged_bytes', sum(part_sizes), staged_table.get('path'), staged_table['remote_schema']['name'])
+
+        if self.s3_stage:
+            # The stage's URL points at `s3://<bucket>/<key_prefix>`
+            stage_location = '@{stage}/{path}'.format(
+                stage=self.s3_stage,
+                path=prefix[len(self.s3.key_prefix):])
+
+            if len(keys) <= self.COPY_MAX_FILES:
+                stage_location += ' FILES = ({})'.format(
+                    ', '.join(["'{}'".format(key[len(prefix):]) for key in keys]))
+
+            if self.s3_purge:
+                staged_table['copy_options'] = 'PURGE = TRUE'
         else:
-            stage_location = '@{db}.{schema}.%{table}'.format(
-                db=sql.identifier(self.connection.configured_database),
-                schema=sql.identifier(self.connection.configured_schema),
-                table=sql.identifier(temp_table_name)
-            )
+            # `prefix` is unique to this upload, so loading everything under it loads all of its files in parallel
+            stage_location = "'s3://{bucket}/{prefix}' credentials=(AWS_KEY_ID=%s AWS_SECRET_KEY=%s)".format(
+                bucket=bucket,
+                prefix=prefix)
+            credentials = self.s3.credentials()
+            staged_table['params'] = [credentials['aws_access_key_id'],
+                                      credentials['aws_secret_access_key']]
 
-            rel_path = '/tmp/target-snowflake/'
-            file_name = str(uuid.uuid4()).replace('-', '_')
+        staged_table['stage_location'] = stage_location
+        if self.s3.compressed:
+            staged_table['compression'] = 'GZIP'
 
-            # Make tmp folder to hold data file
-            os.makedirs(rel_path, exist_ok=True)
+    def stage_csv_rows(self, cur, staged_tables):
+        """
+        Upload the CSV rows of every table in `staged_tables`, and record where `copy_staged_rows`
+        finds them. Tables share one upload where the stage allows it: S3 uploads run concurrently,
+        and files for a named internal stage are sent with a single PUT. Table stages belong to a
+        single table, so each of them gets its own PUT.
+        :param cur: Cursor
+        :param staged_tables: [STAGED_TABLE, ...], see `prepare_table_batch`
+        :return: None
+        """
+        if not staged_tables:
+            return None
 
-            # Write readable csv_rows to file
-            with open(rel_path + file_name, 'wb') as file:
-                line = csv_rows.read()
-                while line:
-                    file.write(line.encode('utf-8'))
-                    line = csv_rows.read()
+        batch_id = str(uuid.uuid4()).replace('-', '')
 
-            # Upload to internal table stage
-            cur.execute('''
-                PUT file://{rel_path}{file_name} {stage_location}
-            '''.format(
-                rel_path=rel_path,
-                file_name=file_name,
-                stage_location=stage_location))
+        if self.s3:
+            key_prefix = batch_id + '/'
+            if self.s3_stage:
+                key_prefix = self.run_id + '/' + key_prefix
 
-            # Tidy up and remove tmp staging file
-            os.remove(rel_path + file_name)
+                if self.journal_batch_id:
+                    self.journal.staged(self.journal_batch_id, '@{}/{}'.format(self.s3_stage, key_prefix))
 
-            stage_location += '/{}'.format(file_name)
+            if len(staged_tables) == 1:
+                self._stage_s3(staged_tables[0], key_prefix)
+            else:
+                with ThreadPoolExecutor(max_workers=min(len(staged_tables), self.MAX_CONCURRENT_UPLOADS)) as executor:
+                    for future in [executor.submit(self._stage_s3, staged_table, key_prefix)
+                                   for staged_table in staged_tables]:
+                        future.result()
+            return None
 
-        cur.execute('''
-            COPY INTO {db}.{schema}.{table} ({cols})
-            FROM {stage_location}
-            FILE_FORMAT = (TYPE = CSV EMPTY_FIELD_AS_NULL = FALSE FIELD_OPTIONALLY_ENCLOSED_BY = '"')
-        '''.format(
-            db=sql.identifier(self.connection.configured_database),
-            schema=sql.identifier(self.connection.configured_schema),
-            table=sql.identifier(temp_table_name),
-            cols=','.join([sql.identifier(x) for x in columns]),
-            stage_location=stage_location),
-        params=params)
+        rel_path = '/tmp/target-snowflake/{}/'.format(batch_id)
 
-        pattern = re.compile(SINGER_LEVEL.upper().format('[0-9]+'))
-        subkeys = list(filter(lambda header: re.match(pattern, header) is not None, columns))
+        # Make tmp folder to hold data files
+        os.makedirs(rel_path, exist_ok=True)
+
+        try:
+            for staged_table in staged_tables:
+                file_name = staged_table['temp_table_name'] + '.csv'
+                csv_rows = staged_table['csv_rows']
+
+                # Write readable csv_rows to file
+                with self._phase_timer('write_file', staged_table.get('path'), staged_table['remote_schema']['name']):
+                    with open(rel_path + file_name, 'wb') as file:
+                        line = csv_rows.read()
+                        while line:
+                            file.write(line.encode('utf-8'))
+                            line = csv_rows.read()
+
+                self._count('staged_bytes',
+                            os.path.getsize(rel_path + file_name),
+                            staged_table.get('path'),
+                            staged_table['remote_schema']['name'])
+
+                if not self.internal_stage:
+                    stage_location = '@{db}.{schema}.%{table}'.format(
+                        db=sql.identifier(self.connection.configured_database),
+                        schema=sql.identifier(self.connection.configured_schema),
+                        table=sql.identifier(staged_table['temp_table_name']))
+
+                    # Upload to internal table stage
+                    with self._phase_timer('put', staged_table.get('path'), staged_table['remote_schema']['name']):
+                        cur.execute('''
+                            PUT file://{rel_path}{file_name} {stage_location}
+                        '''.format(
+                            rel_path=rel_path,
+                            file_name=file_name,
+                            stage_location=stage_location))
+
+                    staged_table['stage_location'] = stage_location + '/' + file_name
+
+            if self.internal_stage:
+                # Every batch of the run gets its own path in one stage, which is cleaned up in bulk
+                stage_location = '@{stage}/{run_id}/{batch_id}'.format(
+                    stage=self.internal_stage,
+                    run_id=self.run_id,
+                    batch_id=batch_id)
+
+                if self.journal_batch_id:
+                    self.journal.staged(self.journal_batch_id, stage_location + '/')
+
+                # Upload the files of all tables at once
+                with self._phase_timer('put'):
+                    cur.execute('''
+                        PUT file://{rel_path}* {stage_location} PARALLEL = {parallel}
+                    '''.format(
+                        rel_path=rel_path,
+                        stage_location=stage_location,
+                        parallel=self.MAX_CONCURRENT_UPLOADS))
+
+                for staged_table in staged_tables:
+                    staged_table['stage_location'] = '{}/{}.csv'.format(stage_location,
+                                                                        staged_table['temp_table_name'])
+                    if self.internal_stage_purge:
+                        staged_table['copy_options'] = 'PURGE = TRUE'
+        finally:
+            # Tidy up and remove tmp staging files
+            shutil.rmtree(rel_path, ignore_errors=True)
+
+    def copy_staged_rows(self, cur, staged_table):
+        """
+        Load a table's staged CSV rows into its temp table, and merge them into the table.
+        :param cur: Cursor
+        :param staged_table: STAGED_TABLE, staged by `stage_csv_rows`
+        :return: None
+        """
+        remote_schema = staged_table['remote_schema']
+        temp_table_name = staged_table['temp_table_name']
+        columns = staged_table['columns']
 
         canonicalized_key_properties = [self.fetch_column_from_path((key_property,), remote_schema)[0]
                                         for key_property in remote_schema['key_properties']]
 
-        self.perform_update(
-            cur,
-            remote_schema['name'],
-            temp_table_name,
-            canonicalized_key_properties,
-            columns,
-            subkeys)
+        self._set_flight_context(remote_schema['name'],
+                                 temp_table=temp_table_name,
+                                 temp_rows=staged_table['record_count'],
+                                 key_properties=canonicalized_key_properties,
+                                 merge=staged_table.get('merge', True))
 
-    def write_table_batch(self, cur, table_batch, metadata):
+        self._tag_queries('copy', remote_schema['name'])
+        with self._phase_timer('copy', staged_table.get('path'), remote_schema['name']):
+            cur.execute('''
+                COPY INTO {db}.{schema}.{table} ({cols})
+                FROM {stage_location}
+                FILE_FORMAT = (TYPE = CSV EMPTY_FIELD_AS_NULL = FALSE FIELD_OPTIONALLY_ENCLOSED_BY = '"' COMPRESSION = {compression})
+                {copy_options}
+            '''.format(
+                db=sql.identifier(self.connection.configured_database),
+                schema=sql.identifier(self.connection.configured_schema),
+                table=sql.identifier(temp_table_name),
+                cols=','.join([sql.identifier(x) for x in columns]),
+                stage_location=staged_table['stage_location'],
+                compression=staged_table.get('compression', 'AUTO'),
+                copy_options=staged_table.get('copy_options', '')),
+            params=staged_table.get('params', []))
+
+        pattern = re.compile(SINGER_LEVEL.upper().format('[0-9]+'))
+        subkeys = list(filter(lambda header: re.match(pattern, header) is not None, columns))
+
+        try:
+            self.perform_update(
+                cur,
+                remote_schema['name'],
+                temp_table_name,
+                canonicalized_key_properties,
+                columns,
+                subkeys,
+                merge=staged_table.get('merge', True),
+                row_hash_column=staged_table.get('row_hash_column'))
+        finally:
+            self._set_flight_context(None)
+
+    def persist_csv_rows(self,
+                         cur,
+                         remote_schema,
+                         temp_table_name,
+                         columns,
+                         csv_rows):
+        staged_table = {'remote_schema': remote_schema,
+                        'temp_table_name': temp_table_name,
+                        'columns': columns,
+                        'csv_rows': csv_rows}
+
+        self.stage_csv_rows(cur, [staged_table])
+        self.copy_staged_rows(cur, staged_table)
+
+    def prepare_table_batch(self, cur, table_batch):
+        """
+        Create the temp table a table batch is loaded into, and make its records streamable as CSV.
+        :param cur: Cursor
+        :param table_batch: {'remote_schema': TABLE_SCHEMA(remote), 'records': [{...}, ...]}
+        :return: STAGED_TABLE, or None when there are no records
+        """
         record_count = len(table_batch['records'])
         if record_count == 0:
-            return 0
+            return None
 
         remote_schema = table_batch['remote_schema']
 
         ## Create temp table to upload new data to
         target_table_name = self.canonicalize_identifier('tmp_' + str(uuid.uuid4()))
-        cur.execute('''
-            CREATE TABLE {db}.{schema}.{temp_table} LIKE {db}.{schema}.{table}
-        '''.format(
-            db=sql.identifier(self.connection.configured_database),
-            schema=sql.identifier(self.connection.configured_schema),
-            temp_table=sql.identifier(target_table_name),
-            table=sql.identifier(remote_schema['name'])
-        ))
+        if self.journal_batch_id:
+            self.journal.temp_table(self.journal_batch_id, target_table_name)
+
+        with self._phase_timer('create_temp_table', table_name=remote_schema['name']):
+            cur.execute('''
+                CREATE TABLE {db}.{schema}.{temp_table} LIKE {db}.{schema}.{table}
+            '''.format(
+                db=sql.identifier(self.connection.configured_database),
+                schema=sql.identifier(self.connection.configured_schema),
+                temp_table=sql.identifier(target_table_name),
+                table=sql.identifier(remote_schema['name'])
+            ))
 
         ## Make streamable CSV records
         csv_headers = list(remote_schema['schema']['properties'].keys())
@@ -600,16 +1335,22 @@ class SnowflakeTarget(SQLInterface):
             except StopIteration:
                 return ''
 
-        csv_rows = TransformStream(transform)
+        return {'remote_schema': remote_schema,
+                'temp_table_name': target_table_name,
+                'columns': csv_headers,
+                'csv_rows': TransformStream(transform),
+                'record_count': record_count}
+
+    def write_table_batch(self, cur, table_batch, metadata):
+        staged_table = self.prepare_table_batch(cur, table_batch)
+        if staged_table is None:
+            return 0
 
         ## Persist csv rows
-        self.persist_csv_rows(cur,
-                              remote_schema,
-                              target_table_name,
-                              csv_headers,
-                              csv_rows)
+        self.stage_csv_rows(cur, [staged_table])
+        self.copy_staged_rows(cur, staged_table)
 
-        return record_count
+        return staged_table['record_count']
 
     def add_column(self, cur, table_name, column_name, column_schema):
         table_schema = self.get_table_schema(cur, table_name)
@@ -645,20 +1386,46 @@ class SnowflakeTarget(SQLInterface):
         self.table_schema_cache = {}
 
     def migrate_column(self, cur, table_name, from_column, to_column):
+        """
+        Move the values of `from_column` into `to_column`, a new, empty, column which is followed by
+        dropping `from_column`. `to_column` is always added as the nullable version of `from_column`,
+        so rather than rewriting the table with an UPDATE, `from_column` is renamed into place, which
+        only changes metadata.
+        """
+        table_schema = self.get_table_schema(cur, table_name)
+        from_schema = table_schema['schema']['properties'][from_column]
+        to_schema = table_schema['schema']['properties'][to_column]
+
+        args = {'table': '{}.{}.{}'.format(
+                    sql.identifier(self.connection.configured_database),
+                    sql.identifier(self.connection.configured_schema),
+                    sql.identifier(table_name)),
+                'from_column': sql.identifier(from_column),
+                'to_column': sql.identifier(to_column)}
+
         cur.execute('''
-            UPDATE {database}.{table_schema}.{table_name}
-            SET {to_column} = {from_column}
-            '''.format(
-                database=sql.identifier(self.connection.configured_database),
-                table_schema=sql.identifier(self.connection.configured_schema),
-                table_name=sql.identifier(table_name),
-                to_column=sql.identifier(to_column),
-                from_column=sql.identifier(from_column)))
+            ALTER TABLE {table} DROP COLUMN {to_column}
+            '''.format(**args))
+        cur.execute('''
+            ALTER TABLE {table} RENAME COLUMN {from_column} TO {to_column}
+            '''.format(**args))
+
+        if json_schema.is_nullable(to_schema) and not json_schema.is_nullable(from_schema):
+            cur.execute('''
+                ALTER TABLE {table} ALTER COLUMN {to_column} DROP NOT NULL
+                '''.format(**args))
+
+        ## `from_column` no longer exists, so there is nothing left to drop
+        self.migrated_columns.add((table_name, from_column))
 
         # reset table schema cache so the next request for schema will update from the DB
         self.table_schema_cache = {}
 
     def drop_column(self, cur, table_name, column_name):
+        if (table_name, column_name) in self.migrated_columns:
+            self.migrated_columns.remove((table_name, column_name))
+            return None
+
         cur.execute('''
             ALTER TABLE {database}.{table_schema}.{table_name}
             DROP COLUMN {column_name}
@@ -693,13 +1460,7 @@ class SnowflakeTarget(SQLInterface):
         :param metadata: Metadata Dict
         :return: None
         """
-        cur.execute('''
-            COMMENT ON TABLE {}.{}.{} IS '{}'
-            '''.format(
-            sql.identifier(self.connection.configured_database),
-            sql.identifier(self.connection.configured_schema),
-            sql.identifier(table_name),
-            json.dumps(metadata)))
+        cur.execute(self._set_table_metadata_statement(table_name, metadata))
 
         # if the table is in our info cache, then update it there. otherwise, it will be lazy-loaded
         # naturally on the first request for it later
@@ -707,6 +1468,15 @@ class SnowflakeTarget(SQLInterface):
         if table_info is not None:
             self._add_table_info(self.connection.configured_database, self.connection.configured_schema, table_name, metadata)
 
+    def _set_table_metadata_statement(self, table_name, metadata):
+        return '''
+            COMMENT ON TABLE {}.{}.{} IS '{}'
+            '''.format(
+            sql.identifier(self.connection.configured_database),
+            sql.identifier(self.connection.configured_schema),
+            sql.identifier(table_name),
+            json.dumps(metadata))
+
     def _get_table_metadata(self, cur, table_name):
         all_tables = self._get_all_table_info(cur, self.connection.configured_database, self.connection.configured_schema)
         table = all_tables.get(table_name)
@@ -35,3 +35,18 @@ def valid_identifier(x):
 def identifier(x):
     valid_identifier(x)
     return '"{}"'.format(x)
+
+
+def stage_name(x):
+    """
+    Validate a, possibly database and schema qualified, stage name such as `MY_DB.MY_SCHEMA.MY_STAGE`.
+    The name is left unquoted so that it resolves the same way it does for the user who created it.
+    """
+    parts = x.split('.') if isinstance(x, str) else [x]
+    if len(parts) > 3:
+        raise SQLError('Stage name must be of the form `[<database>.][<schema>.]<stage>`. Got `{}`'.format(x))
+
+    for part in parts:
+        valid_identifier(part)
+
+    return x
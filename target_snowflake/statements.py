@@ -0,0 +1,149 @@
+import re
+import threading
+
+DDL = 'ddl'
+PUT = 'put'
+COPY = 'copy'
+DELETE = 'delete'
+INSERT = 'insert'
+UPDATE = 'update'
+COMMENT = 'comment'
+SHOW = 'show'
+SELECT = 'select'
+REMOVE = 'remove'
+TRANSACTION = 'transaction'
+SESSION = 'session'
+OTHER = 'other'
+
+_KINDS = {
+    'CREATE': DDL,
+    'ALTER': DDL,
+    'DROP': DDL,
+    'TRUNCATE': DDL,
+    'UNDROP': DDL,
+    'PUT': PUT,
+    'COPY': COPY,
+    'DELETE': DELETE,
+    'INSERT': INSERT,
+    'UPDATE': UPDATE,
+    'MERGE': UPDATE,
+    'COMMENT': COMMENT,
+    'SHOW': SHOW,
+    'DESC': SHOW,
+    'DESCRIBE': SHOW,
+    'LIST': SHOW,
+    'SELECT': SELECT,
+    'WITH': SELECT,
+    'REMOVE': REMOVE,
+    'BEGIN': TRANSACTION,
+    'COMMIT': TRANSACTION,
+    'ROLLBACK': TRANSACTION,
+}
+
+_FIRST_KEYWORD = re.compile(r'\s*(\w+)')
+_ALTER_SESSION = re.compile(r'\s*ALTER\s+SESSION\b', re.IGNORECASE)
+
+## Upper bounds, in milliseconds, of the latency histogram buckets. Anything slower lands in a
+## final, unbounded, bucket.
+BUCKET_MILLIS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 300000)
+
+
+def classify_statement(command):
+    """
+    :param command: string, SQL. Multi statement requests are classified by their first statement.
+    :return: string, one of the statement kinds of this module
+    """
+    match = _FIRST_KEYWORD.match(command)
+    if not match:
+        return OTHER
+    if _ALTER_SESSION.match(command):
+        return SESSION
+    return _KINDS.get(match.group(1).upper(), OTHER)
+
+
+class _KindStats:
+    def __init__(self):
+        self.count = 0
+        self.failed = 0
+        self.rows = 0
+        self.total_millis = 0.0
+        self.max_millis = 0.0
+        self.buckets = [0] * (len(BUCKET_MILLIS) + 1)
+
+    def percentile(self, fraction):
+        """
+        :return: upper bound of the bucket holding the `fraction` percentile, None when unbounded
+        """
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return BUCKET_MILLIS[i] if i < len(BUCKET_MILLIS) else None
+        return None
+
+
+class StatementStats:
+    """
+    In process latency histograms, and row counts, of the statements executed on a connection,
+    by statement kind. Safe to share between threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._kinds = {}
+
+    def record(self, kind, millis, rows=None, failed=False):
+        """
+        :param kind: string, see `classify_statement`
+        :param millis: float
+        :param rows: int, rows affected or returned, when known
+        :param failed: boolean
+        """
+        bucket = len(BUCKET_MILLIS)
+        for i, bound in enumerate(BUCKET_MILLIS):
+            if millis <= bound:
+                bucket = i
+                break
+
+        with self._lock:
+            stats = self._kinds.get(kind)
+            if stats is None:
+                stats = self._kinds[kind] = _KindStats()
+
+            stats.count += 1
+            stats.total_millis += millis
+            stats.max_millis = max(stats.max_millis, millis)
+            stats.buckets[bucket] += 1
+            if failed:
+                stats.failed += 1
+            if rows and rows > 0:
+                stats.rows += rows
+
+    def summary(self):
+        """
+        :return: {'<kind>': {'count': int, 'failed': int, 'rows': int, 'total_millis': int,
+                             'max_millis': int, 'p50_millis': int, 'p95_millis': int,
+                             'histogram': {'<=<bound>': int, ..., '><bound>': int}}, ...}
+        """
+        summary = {}
+
+        with self._lock:
+            for kind, stats in sorted(self._kinds.items()):
+                histogram = {}
+                for i, count in enumerate(stats.buckets):
+                    if i < len(BUCKET_MILLIS):
+                        histogram['<={}'.format(BUCKET_MILLIS[i])] = count
+                    else:
+                        histogram['>{}'.format(BUCKET_MILLIS[-1])] = count
+
+                summary[kind] = {'count': stats.count,
+                                 'failed': stats.failed,
+                                 'rows': stats.rows,
+                                 'total_millis': int(stats.total_millis),
+                                 'max_millis': int(stats.max_millis),
+                                 'p50_millis': stats.percentile(0.5),
+                                 'p95_millis': stats.percentile(0.95),
+                                 'histogram': histogram}
+
+        return summary
@@ -0,0 +1,213 @@
+from collections import deque
+from datetime import datetime, timezone
+import json
+import os
+import threading
+import time
+
+import singer
+from target_postgres.stream_tracker import StreamTracker
+
+LOGGER = singer.get_logger()
+
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+
+
+def _isoformat(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat() if timestamp is not None else None
+
+
+class ProgressTracker(StreamTracker):
+    """
+    `StreamTracker` which also keeps what a `StatusFile` reports: the records committed by each
+    stream's batches, how long its last flush took, which stream is being flushed, and when each
+    queued STATE message arrived.
+    """
+
+    def __init__(self, target, emit_states):
+        super(ProgressTracker, self).__init__(target, emit_states)
+
+        # {'<stream>': {'committed': int, 'flushes': int, 'last_flush_seconds': float, 'last_flush_at': float}}
+        self.progress = {}
+        # (stream, time.monotonic() it started at) of the batch being written
+        self.flushing = None
+        self.last_emitted_state_at = None
+
+    def handle_state_message(self, line_data):
+        super(ProgressTracker, self).handle_state_message(line_data)
+
+        if self.state_queue and 'received_at' not in self.state_queue[-1]:
+            self.state_queue[-1]['received_at'] = time.time()
+
+    def _write_batch_and_update_watermarks(self, stream):
+        ## Same as `StreamTracker._write_batch_and_update_watermarks`, keeping the result of the batch
+        stream_buffer = self.streams[stream]
+        count = stream_buffer.count
+
+        started_at = time.monotonic()
+        self.flushing = (stream, started_at)
+        try:
+            result = self.target.write_batch(stream_buffer)
+        finally:
+            self.flushing = None
+
+        stream_buffer.flush_buffer()
+        self.stream_flush_watermarks[stream] = self.stream_add_watermarks.get(stream, 0)
+
+        if count:
+            progress = self.progress.setdefault(stream, {'committed': 0, 'flushes': 0})
+            progress['committed'] += (result or {}).get('records_persisted', 0)
+            progress['flushes'] += 1
+            progress['last_flush_seconds'] = time.monotonic() - started_at
+            progress['last_flush_at'] = time.time()
+
+    def _emit_safe_queued_states(self, force=False):
+        last_emitted_state = self.last_emitted_state
+        super(ProgressTracker, self)._emit_safe_queued_states(force=force)
+        if self.last_emitted_state is not last_emitted_state:
+            self.last_emitted_state_at = time.time()
+
+
+class StatusFile:
+    """
+    Periodically writes the progress of a `ProgressTracker` to a JSON file at `path`, from a
+    background thread, for orchestrators to detect stalls with. The file is replaced atomically.
+
+    Rates are measured over the last `window_seconds`. Records are `received` once they are
+    buffered, and `committed` once their batch is.
+    """
+
+    def __init__(self, path, tracker, interval_seconds=10, window_seconds=60):
+        self.path = path
+        self.tracker = tracker
+        self.interval_seconds = interval_seconds
+        self.window_seconds = window_seconds
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self.started_at = time.time()
+        # [(time.monotonic(), {'<stream>': (received, committed)}), ...]
+        self._samples = deque()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(FAILED if exc_type else FINISHED)
+
+    def start(self):
+        self.write()
+        self._thread = threading.Thread(target=self._run, name='status-file', daemon=True)
+        self._thread.start()
+
+    def close(self, state=FINISHED):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.write(state)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval_seconds):
+            try:
+                self.write()
+            except Exception:
+                LOGGER.warning('Could not write status file {}'.format(self.path), exc_info=True)
+
+    def _rate(self, now, stream, index, current):
+        for sampled_at, counts in self._samples:
+            if stream in counts:
+                if now > sampled_at:
+                    return round((current - counts[stream][index]) / (now - sampled_at), 1)
+                break
+        return None
+
+    def status(self, state=RUNNING):
+        """
+        :param state: string, `running`, `finished` or `failed`
+        :return: dict
+        """
+        tracker = self.tracker
+        now = time.monotonic()
+
+        ## The tracker is updated by the main thread while this runs, so only work on copies of it
+        streams = list(tracker.streams.items())
+        state_queue = list(tracker.state_queue)
+        flush_watermarks = dict(tracker.stream_flush_watermarks)
+        streams_added_to = set(tracker.streams_added_to)
+        flushing = tracker.flushing
+
+        ## STATE messages are emitted once every stream's records which came before them are committed
+        pending_states = []
+        for entry in state_queue:
+            pending_states.append(sorted(stream for stream in streams_added_to
+                                         if flush_watermarks.get(stream, 0) < entry['watermark']))
+
+        status = {'state': state,
+                  'pid': os.getpid(),
+                  'started_at': _isoformat(self.started_at),
+                  'updated_at': _isoformat(time.time()),
+                  'flushing': None,
+                  'streams': {},
+                  'pending_states': len(state_queue),
+                  'oldest_pending_state': None,
+                  'last_emitted_state': tracker.last_emitted_state,
+                  'last_emitted_state_at': _isoformat(tracker.last_emitted_state_at)}
+
+        if flushing is not None:
+            status['flushing'] = {'stream': flushing[0], 'seconds': round(now - flushing[1], 3)}
+
+        if state_queue:
+            received_at = state_queue[0].get('received_at')
+            status['oldest_pending_state'] = {
+                'value': state_queue[0]['state'],
+                'received_at': _isoformat(received_at),
+                'age_seconds': round(time.time() - received_at, 3) if received_at is not None else None,
+                'waiting_on': pending_states[0]}
+
+        counts = {}
+        for stream, stream_buffer in streams:
+            progress = dict(tracker.progress.get(stream, {}))
+            committed = progress.get('committed', 0)
+            received = committed + stream_buffer.count
+            counts[stream] = (received, committed)
+
+            with self._lock:
+                received_per_sec = self._rate(now, stream, 0, received)
+                committed_per_sec = self._rate(now, stream, 1, committed)
+
+            status['streams'][stream] = {
+                'buffered_rows': stream_buffer.count,
+                'buffered_bytes': getattr(stream_buffer, 'size', None),
+                'received_rows': received,
+                'committed_rows': committed,
+                'received_rows_per_sec': received_per_sec,
+                'committed_rows_per_sec': committed_per_sec,
+                'flushes': progress.get('flushes', 0),
+                'last_flush_seconds': round(progress['last_flush_seconds'], 3) if 'last_flush_seconds' in progress
+                else None,
+                'last_flush_at': _isoformat(progress.get('last_flush_at')),
+                'blocking_states': sum(1 for waiting_on in pending_states if stream in waiting_on)}
+
+        with self._lock:
+            self._samples.append((now, counts))
+            ## Keep one sample older than the window, to measure over all of it
+            while len(self._samples) > 1 and now - self._samples[1][0] >= self.window_seconds:
+                self._samples.popleft()
+
+        return status
+
+    def write(self, state=RUNNING):
+        status = self.status(state)
+
+        temp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(temp_path, 'w', encoding='utf-8') as status_file:
+            json.dump(status, status_file, indent=2, sort_keys=True, default=str)
+        os.replace(temp_path, self.path)
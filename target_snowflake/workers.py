@@ -0,0 +1,76 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from target_postgres import denest
+from target_postgres.singer_stream import RAW_LINE_SIZE
+
+from target_snowflake import ingest
+from target_snowflake.singer_stream import VALIDATED, compiled_validator
+
+
+def _decode_and_validate(fingerprint, schema, lines, exact_numbers, validate):
+    validator = compiled_validator(fingerprint, schema) if validate else None
+
+    messages = []
+    for line in lines:
+        message = ingest.loads(line, exact_numbers=exact_numbers)
+        message[RAW_LINE_SIZE] = len(line)
+
+        ## Invalid records are left for the parent process to validate again, so that the
+        ##  stream's `invalid_records` bookkeeping and threshold apply unchanged.
+        if validator is not None and 'record' in message and validator.is_valid(message['record']):
+            message[VALIDATED] = True
+
+        messages.append(message)
+
+    return messages
+
+
+def _merge_table_batches(results):
+    merged = results[0]
+    for table_batches in results[1:]:
+        for merged_batch, table_batch in zip(merged, table_batches):
+            merged_batch['records'].extend(table_batch['records'])
+    return merged
+
+
+class RecordWorkerPool:
+    """
+    Pool of worker processes which take the CPU bound work of decoding, validating and denesting
+    records off the main process.
+    """
+
+    def __init__(self, workers, denest_chunk_rows=10000):
+        self.workers = workers
+        self.denest_chunk_rows = denest_chunk_rows
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+
+    def submit_lines(self, fingerprint, schema, lines, exact_numbers=False, validate=True):
+        """
+        Decode, and optionally validate, the raw RECORD message `lines` of a single stream in a worker.
+        :param fingerprint: string, see `singer_stream.schema_fingerprint`
+        :param schema: JSON Schema of the stream
+        :param lines: [bytes or str, ...]
+        :param exact_numbers: boolean, see `ingest.loads`
+        :param validate: boolean
+        :return: Future of [{...}, ...]
+        """
+        return self.executor.submit(_decode_and_validate, fingerprint, schema, lines, exact_numbers, validate)
+
+    def to_table_batches(self, schema, key_properties, records):
+        """
+        Parallel equivalent of `denest.to_table_batches`. Records keep their order.
+        """
+        if len(records) < 2 * self.denest_chunk_rows:
+            return denest.to_table_batches(schema, key_properties, records)
+
+        chunk_rows = max(self.denest_chunk_rows, -(-len(records) // self.workers))
+        chunks = [records[i:i + chunk_rows] for i in range(0, len(records), chunk_rows)]
+
+        return _merge_table_batches(list(self.executor.map(denest.to_table_batches,
+                                                           repeat(schema),
+                                                           repeat(key_properties),
+                                                           chunks)))
+
+    def shutdown(self):
+        self.executor.shutdown()
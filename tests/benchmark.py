@@ -0,0 +1,164 @@
+"""
+Offline benchmark of the target's Python hot paths: parsing, buffering, denesting, CSV
+serialization and staging. Snowflake is replaced by `target_snowflake.bench.FakeConnection`, so
+no account is needed. Inputs are generated from a fixed seed, which keeps results comparable
+across commits.
+
+    python tests/benchmark.py --rows 10000 --output benchmarks.jsonl
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import subprocess
+
+from target_postgres import denest
+from target_postgres.singer import SEQUENCE
+
+from fixtures import CatStream, MultiTypeStream, NestedStream, fake
+from target_snowflake import ingest
+from target_snowflake.bench import FakeConnection, Measurement, PhaseRecorder
+from target_snowflake.singer_stream import BufferedSingerStream
+from target_snowflake.snowflake import SnowflakeTarget
+
+STREAMS = {
+    'cats': lambda rows: CatStream(rows, nested_count=2, sequence=1),
+    'nested': lambda rows: NestedStream(rows, sequence=1),
+    'multi_type': lambda rows: MultiTypeStream(rows, sequence=1),
+}
+
+## Phases which handle every row, and every staged byte, of a batch
+ROW_PHASES = ('serialize', 'stage', 'write_file')
+
+
+def generate_lines(name, rows, seed):
+    seed_generators(seed)
+    return stream_lines(STREAMS[name](rows))
+
+
+def seed_generators(seed):
+    random.seed(seed)
+    fake.seed_instance(seed)
+    fake.unique.clear()
+
+
+def stream_lines(stream):
+    """
+    :param stream: FakeStream
+    :return: [string, ...], every message of `stream`
+    """
+    # The fixture streams print every record they generate
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        lines = list(stream)
+
+    ## Records carry their sequence, instead of being stamped with the time they are batched at,
+    ##  so that every run loads identical rows
+    for i, line in enumerate(lines):
+        message = json.loads(line)
+        if message['type'] == 'RECORD':
+            message['sequence'] = message[SEQUENCE]
+            lines[i] = json.dumps(message)
+
+    return lines
+
+
+def bench_stream(name, lines, batch_rows):
+    results = []
+    line_bytes = sum(len(line.encode('utf-8')) for line in lines)
+
+    with Measurement('parse', rows=len(lines), bytes=line_bytes) as measurement:
+        messages = [ingest.loads(line) for line in lines]
+    results.append(measurement.result())
+
+    schema_message = messages[0]
+    record_messages = [message for message in messages if message['type'] == 'RECORD']
+
+    buffer = BufferedSingerStream(schema_message['stream'],
+                                  schema_message['schema'],
+                                  schema_message['key_properties'])
+    buffer.max_rows = len(record_messages) + 1
+    with Measurement('buffer', rows=len(record_messages), bytes=line_bytes) as measurement:
+        for message in record_messages:
+            buffer.add_record_message(message)
+    results.append(measurement.result())
+
+    records = buffer.get_batch()
+    with Measurement('denest', rows=len(records)) as measurement:
+        table_batches = denest.to_table_batches(buffer.schema, buffer.key_properties, records)
+    measurement.rows = sum(len(table_batch['records']) for table_batch in table_batches)
+    results.append(measurement.result())
+
+    results.append(bench_load(lines, batch_rows, rows=len(record_messages), bytes=line_bytes))
+
+    return results
+
+
+def bench_load(lines, batch_rows, rows, bytes):
+    """
+    Load `lines` through `SnowflakeTarget` and a `FakeConnection`.
+    :return: `Measurement.result()`, along with the seconds of each phase of the load
+    """
+    connection = FakeConnection()
+    with PhaseRecorder() as recorder:
+        target = SnowflakeTarget(connection)
+        with Measurement('load', rows=rows, bytes=bytes) as measurement:
+            ingest.stream_to_target(iter(lines), target, config={'max_batch_rows': batch_rows})
+    result = measurement.result()
+
+    table_rows = recorder.counts.get('table_rows_persisted', 0)
+    staged_bytes = recorder.counts.get('staged_bytes', 0)
+    result['phases'] = {}
+    for phase, seconds in sorted(recorder.phase_seconds.items()):
+        result['phases'][phase] = {'seconds': round(seconds, 6)}
+        if phase in ROW_PHASES and seconds > 0:
+            result['phases'][phase]['rows_per_sec'] = round(table_rows / seconds, 1)
+            result['phases'][phase]['bytes_per_sec'] = round(staged_bytes / seconds, 1)
+    result['table_rows'] = table_rows
+    result['staged_bytes'] = staged_bytes
+    result['statements'] = len(connection.executed)
+
+    return result
+
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000, help='Records per stream')
+    parser.add_argument('--batch-rows', type=int, default=200000, help='`max_batch_rows` of the target')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--streams', default=','.join(STREAMS), help='Comma separated, of: ' + ', '.join(STREAMS))
+    parser.add_argument('--output', help='File to append the results to, as a JSON line')
+    args = parser.parse_args(argv)
+
+    report = {'commit': commit(),
+              'python': platform.python_version(),
+              'rows': args.rows,
+              'batch_rows': args.batch_rows,
+              'seed': args.seed,
+              'streams': {}}
+
+    for name in args.streams.split(','):
+        lines = generate_lines(name, args.rows, args.seed)
+        report['streams'][name] = bench_stream(name, lines, args.batch_rows)
+
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        with open(args.output, 'a') as output:
+            output.write(json.dumps(report, sort_keys=True) + '\n')
+
+    return report
+
+
+if __name__ == '__main__':
+    main()
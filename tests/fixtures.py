@@ -11,22 +11,22 @@ from target_snowflake import sql
 from target_snowflake.connection import connect
 
 CONFIG = {
-    'snowflake_account': os.environ['SNOWFLAKE_ACCOUNT'],
-    'snowflake_database': os.environ['SNOWFLAKE_DATABASE'],
-    'snowflake_warehouse': os.environ['SNOWFLAKE_WAREHOUSE'],
-    'snowflake_schema': os.environ['SNOWFLAKE_SCHEMA'],
-    'snowflake_username': os.environ['SNOWFLAKE_USERNAME'],
-    'snowflake_password': os.environ['SNOWFLAKE_PASSWORD'],
+    'snowflake_account': os.environ.get('SNOWFLAKE_ACCOUNT'),
+    'snowflake_database': os.environ.get('SNOWFLAKE_DATABASE'),
+    'snowflake_warehouse': os.environ.get('SNOWFLAKE_WAREHOUSE'),
+    'snowflake_schema': os.environ.get('SNOWFLAKE_SCHEMA'),
+    'snowflake_username': os.environ.get('SNOWFLAKE_USERNAME'),
+    'snowflake_password': os.environ.get('SNOWFLAKE_PASSWORD'),
     'disable_collection': True,
     'logging_level': 'DEBUG'
 }
 
 S3_CONFIG = {
     'target_s3':
-        {'aws_access_key_id': os.environ['TARGET_S3_AWS_ACCESS_KEY_ID'],
-         'aws_secret_access_key': os.environ['TARGET_S3_AWS_SECRET_ACCESS_KEY'],
-         'bucket': os.environ['TARGET_S3_BUCKET'],
-         'key_prefix': os.environ['TARGET_S3_KEY_PREFIX']},
+        {'aws_access_key_id': os.environ.get('TARGET_S3_AWS_ACCESS_KEY_ID'),
+         'aws_secret_access_key': os.environ.get('TARGET_S3_AWS_SECRET_ACCESS_KEY'),
+         'bucket': os.environ.get('TARGET_S3_BUCKET'),
+         'key_prefix': os.environ.get('TARGET_S3_KEY_PREFIX')},
     **CONFIG
 }
 
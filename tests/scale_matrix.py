@@ -0,0 +1,226 @@
+"""
+Scale matrix of synthetic Singer streams, loaded through the target's serialization and staging
+paths against `target_snowflake.bench.FakeConnection`. Each cell varies the shape of the stream:
+column count, nesting depth, array fan-out, key duplication rate and timestamp density. Every
+cell runs in a fresh process, so that its peak RSS is its own.
+
+Cells are compared to a stored baseline, and the run fails when a cell's rows/sec drops, or its
+peak RSS grows, by more than the tolerance. Baselines are specific to the machine they were
+recorded on.
+
+    python tests/scale_matrix.py --update-baseline
+    python tests/scale_matrix.py
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sys
+
+from fixtures import FakeStream
+
+import benchmark
+
+## Shape of the base cell, and the values each axis takes in turn
+BASE = {'columns': 20, 'depth': 0, 'fanout': 0, 'duplicates': 0.0, 'timestamps': 0.2}
+AXES = {'columns': [5, 20, 100],
+        'depth': [0, 2, 4],
+        'fanout': [0, 5, 20],
+        'duplicates': [0.0, 0.1, 0.5],
+        'timestamps': [0.0, 0.2, 0.8]}
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scale_baseline.json')
+
+
+def matrix_schema(columns, depth, fanout, timestamps):
+    properties = {'id': {'type': 'integer'}}
+
+    timestamp_columns = int(round(columns * timestamps))
+    for i in range(columns):
+        if i < timestamp_columns:
+            column = {'type': ['null', 'string'], 'format': 'date-time'}
+        else:
+            column = {'type': ['null', ['integer', 'number', 'string'][i % 3]]}
+        properties['column_{:03d}'.format(i)] = column
+
+    nested = properties
+    for level in range(depth):
+        nested['nested_{}'.format(level)] = {'type': ['null', 'object'],
+                                             'properties': {'value': {'type': ['null', 'string']}}}
+        nested = nested['nested_{}'.format(level)]['properties']
+
+    if fanout:
+        properties['items'] = {'type': ['null', 'array'],
+                               'items': {'type': 'object',
+                                         'properties': {'position': {'type': 'integer'},
+                                                        'label': {'type': ['null', 'string']},
+                                                        'updated_at': {'type': ['null', 'string'],
+                                                                       'format': 'date-time'}}}}
+
+    return {'type': 'SCHEMA',
+            'stream': 'matrix',
+            'schema': {'additionalProperties': False, 'properties': properties},
+            'key_properties': ['id']}
+
+
+class MatrixStream(FakeStream):
+    stream = 'matrix'
+
+    def __init__(self, n, columns, depth, fanout, duplicates, timestamps, **kwargs):
+        super(MatrixStream, self).__init__(n, duplicates=int(n * duplicates), **kwargs)
+        self.schema = matrix_schema(columns, depth, fanout, timestamps)
+        self.depth = depth
+        self.fanout = fanout
+        self.columns = [(name, column) for name, column in self.schema['schema']['properties'].items()
+                        if name.startswith('column_')]
+
+    def generate_record(self):
+        record = {'id': self.id}
+
+        for name, column in self.columns:
+            if 'format' in column:
+                record[name] = '2024-{:02d}-{:02d}T{:02d}:{:02d}:00+00:00'.format(random.randint(1, 12),
+                                                                                  random.randint(1, 28),
+                                                                                  random.randint(0, 23),
+                                                                                  random.randint(0, 59))
+            elif 'integer' in column['type']:
+                record[name] = random.randint(-10 ** 9, 10 ** 9)
+            elif 'number' in column['type']:
+                record[name] = random.uniform(-10 ** 6, 10 ** 6)
+            else:
+                record[name] = '{:x}'.format(random.getrandbits(64))
+
+        nested = record
+        for level in range(self.depth):
+            nested['nested_{}'.format(level)] = {'value': 'level {}'.format(level)}
+            nested = nested['nested_{}'.format(level)]
+
+        if self.fanout:
+            record['items'] = [{'position': i,
+                                'label': 'item {}'.format(i),
+                                'updated_at': '2024-01-01T00:00:{:02d}+00:00'.format(i % 60)}
+                               for i in range(self.fanout)]
+
+        return record
+
+
+def cells(full=False):
+    """
+    :param full: boolean, every combination of the axes, instead of varying one axis at a time
+    :return: [{'columns': int, ...}, ...]
+    """
+    if full:
+        names = sorted(AXES)
+        return [dict(zip(names, values)) for values in itertools.product(*[AXES[name] for name in names])]
+
+    result = [dict(BASE)]
+    for name, values in sorted(AXES.items()):
+        for value in values:
+            if value != BASE[name]:
+                result.append(dict(BASE, **{name: value}))
+    return result
+
+
+def cell_key(cell):
+    return ','.join('{}={}'.format(name, cell[name]) for name in sorted(cell))
+
+
+def run_cell(cell, rows, batch_rows, seed):
+    benchmark.seed_generators(seed)
+    lines = benchmark.stream_lines(MatrixStream(rows, sequence=1, **cell))
+    result = benchmark.bench_load(lines,
+                                  batch_rows,
+                                  rows=rows,
+                                  bytes=sum(len(line.encode('utf-8')) for line in lines))
+
+    serialize_stage_seconds = sum(result['phases'].get(phase, {}).get('seconds', 0.0)
+                                  for phase in ('serialize', 'stage'))
+    result['serialize_stage_rows_per_sec'] = \
+        round(result['table_rows'] / serialize_stage_seconds, 1) if serialize_stage_seconds else None
+    return result
+
+
+def compare(results, baseline, rate_tolerance, memory_tolerance):
+    """
+    :return: [string, ...], descriptions of the cells which regressed beyond the tolerances
+    """
+    regressions = []
+    for key, result in sorted(results.items()):
+        expected = baseline.get(key)
+        if expected is None:
+            continue
+
+        for metric in ('rows_per_sec', 'serialize_stage_rows_per_sec'):
+            if expected.get(metric) and result.get(metric) is not None \
+                    and result[metric] < expected[metric] * (1 - rate_tolerance):
+                regressions.append('{}: {} {} is below the baseline of {}'.format(key,
+                                                                                  metric,
+                                                                                  result[metric],
+                                                                                  expected[metric]))
+
+        if expected.get('peak_rss_mb') and result['peak_rss_mb'] > expected['peak_rss_mb'] * (1 + memory_tolerance):
+            regressions.append('{}: peak_rss_mb {} is above the baseline of {}'.format(key,
+                                                                                     result['peak_rss_mb'],
+                                                                                     expected['peak_rss_mb']))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=5000, help='Records per cell')
+    parser.add_argument('--batch-rows', type=int, default=2000, help='`max_batch_rows` of the target')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--full', action='store_true', help='Run every combination of the axes')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--update-baseline', action='store_true', help='Store the results as the new baseline')
+    parser.add_argument('--rate-tolerance', type=float, default=0.2,
+                        help='Fraction rows/sec may drop below the baseline by')
+    parser.add_argument('--memory-tolerance', type=float, default=0.2,
+                        help='Fraction peak RSS may grow above the baseline by')
+    args = parser.parse_args(argv)
+
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for cell in cells(args.full):
+        with context.Pool(1) as pool:
+            result = pool.apply(run_cell, (cell, args.rows, args.batch_rows, args.seed))
+        results[cell_key(cell)] = {'rows_per_sec': result['rows_per_sec'],
+                                   'serialize_stage_rows_per_sec': result['serialize_stage_rows_per_sec'],
+                                   'peak_rss_mb': result['peak_rss_mb'],
+                                   'table_rows': result['table_rows'],
+                                   'staged_bytes': result['staged_bytes']}
+        print('{}: {}'.format(cell_key(cell), json.dumps(results[cell_key(cell)])), file=sys.stderr)
+
+    report = {'commit': benchmark.commit(), 'rows': args.rows, 'batch_rows': args.batch_rows, 'seed': args.seed,
+              'cells': results}
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(report, baseline_file, indent=2, sort_keys=True)
+        print('Stored the baseline in {}'.format(args.baseline), file=sys.stderr)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('No baseline in {}, run with --update-baseline first'.format(args.baseline), file=sys.stderr)
+        return 1
+
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+
+    if (baseline['rows'], baseline['batch_rows'], baseline['seed']) != (args.rows, args.batch_rows, args.seed):
+        print('The baseline was recorded with other --rows, --batch-rows or --seed', file=sys.stderr)
+        return 1
+
+    regressions = compare(results, baseline['cells'], args.rate_tolerance, args.memory_tolerance)
+    for regression in regressions:
+        print('REGRESSION {}'.format(regression), file=sys.stderr)
+
+    print(json.dumps(report, indent=2))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
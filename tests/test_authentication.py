@@ -24,7 +24,7 @@ class TestAuthenticationConfiguration:
 
         # Mock both connect and target_tools.main to avoid actual execution
         with patch('target_snowflake.connect') as mock_connect, \
-             patch('target_snowflake.target_tools.main') as mock_target_main:
+             patch('target_snowflake.ingest.main') as mock_target_main:
 
             mock_connection = MagicMock()
             mock_connect.return_value.__enter__.return_value = mock_connection
@@ -83,7 +83,7 @@ kePnRegr03GHzqW5tZzDbA==
 
         # Mock both connect and target_tools.main to avoid actual execution
         with patch('target_snowflake.connect') as mock_connect, \
-             patch('target_snowflake.target_tools.main') as mock_target_main:
+             patch('target_snowflake.ingest.main') as mock_target_main:
 
             mock_connection = MagicMock()
             mock_connect.return_value.__enter__.return_value = mock_connection
@@ -144,7 +144,7 @@ kePnRegr03GHzqW5tZzDbA==
 
         # Mock both connect and target_tools.main to avoid actual execution
         with patch('target_snowflake.connect') as mock_connect, \
-             patch('target_snowflake.target_tools.main') as mock_target_main:
+             patch('target_snowflake.ingest.main') as mock_target_main:
 
             mock_connection = MagicMock()
             mock_connect.return_value.__enter__.return_value = mock_connection
@@ -190,7 +190,7 @@ kePnRegr03GHzqW5tZzDbA==
 
         # Mock both connect and target_tools.main to avoid actual execution
         with patch('target_snowflake.connect') as mock_connect, \
-             patch('target_snowflake.target_tools.main') as mock_target_main:
+             patch('target_snowflake.ingest.main') as mock_target_main:
 
             mock_connection = MagicMock()
             mock_connect.return_value.__enter__.return_value = mock_connection
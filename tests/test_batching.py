@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+import pytest
+
+from target_snowflake.batching import AdaptiveBatchSizer
+
+
+def make_buffer(max_rows, stream='cats'):
+    return SimpleNamespace(stream=stream, max_rows=max_rows)
+
+
+def test_latency__grows_fast_batches_within_step():
+    sizer = AdaptiveBatchSizer(target_seconds=60, min_rows=100, max_rows=10000000)
+    stream_buffer = make_buffer(100000)
+
+    # 100k rows in 10s => 10k rows/s => 600k rows for 60s, but limited to a 2x step
+    assert sizer.observe(stream_buffer, 100000, 10.0) == 200000
+    assert stream_buffer.max_rows == 200000
+
+
+def test_latency__shrinks_slow_batches():
+    sizer = AdaptiveBatchSizer(target_seconds=60, min_rows=100, max_rows=10000000)
+    stream_buffer = make_buffer(100000)
+
+    # 100k rows in 80s => 75k rows for 60s
+    assert sizer.observe(stream_buffer, 100000, 80.0) == 75000
+
+
+def test_latency__respects_bounds():
+    sizer = AdaptiveBatchSizer(target_seconds=60, min_rows=90000, max_rows=120000)
+    stream_buffer = make_buffer(100000)
+
+    assert sizer.observe(stream_buffer, 100000, 1.0) == 120000
+
+    stream_buffer = make_buffer(100000, stream='dogs')
+    assert sizer.observe(stream_buffer, 100000, 1000.0) == 90000
+
+
+def test_ignores_partial_batches():
+    sizer = AdaptiveBatchSizer()
+    stream_buffer = make_buffer(100000)
+
+    assert sizer.observe(stream_buffer, 10, 5.0) is None
+    assert stream_buffer.max_rows == 100000
+
+
+def test_throughput__reverses_when_rate_drops():
+    sizer = AdaptiveBatchSizer(mode='throughput', min_rows=1000, max_rows=1000000)
+    stream_buffer = make_buffer(10000)
+
+    assert sizer.observe(stream_buffer, 10000, 1.0) == 20000
+    # 20k rows/s is an improvement over 10k rows/s, keep growing
+    assert sizer.observe(stream_buffer, 20000, 1.0) == 40000
+    # 10k rows/s is worse, step back down
+    assert sizer.observe(stream_buffer, 40000, 4.0) == 20000
+
+
+def test_invalid_config():
+    with pytest.raises(ValueError):
+        AdaptiveBatchSizer(mode='fastest')
+
+    with pytest.raises(ValueError):
+        AdaptiveBatchSizer(min_rows=10, max_rows=5)
@@ -0,0 +1,153 @@
+import gzip
+import io
+import json
+
+import scale_matrix
+from target_snowflake import ingest
+from target_snowflake.bench import FakeConnection, PhaseRecorder, cli
+from target_snowflake.snowflake import SnowflakeTarget
+
+
+def lines(versions=(None,)):
+    messages = [{'type': 'SCHEMA',
+                 'stream': 'cats',
+                 'schema': {'properties': {'id': {'type': 'integer'},
+                                           'name': {'type': ['null', 'string']},
+                                           'toys': {'type': ['null', 'array'],
+                                                    'items': {'type': 'string'}}}},
+                 'key_properties': ['id']}]
+    for version in versions:
+        for i in range(10):
+            message = {'type': 'RECORD',
+                       'stream': 'cats',
+                       'record': {'id': i, 'name': 'cat {}'.format(i), 'toys': ['ball', 'mouse']},
+                       'sequence': i}
+            if version is not None:
+                message['version'] = version
+            messages.append(message)
+        if version is not None:
+            messages.append({'type': 'ACTIVATE_VERSION', 'stream': 'cats', 'version': version})
+    return [json.dumps(message) for message in messages]
+
+
+def test_fake_connection__catalog():
+    connection = FakeConnection(database='DB', schema='SCH')
+
+    with connection.cursor() as cur:
+        cur.execute('CREATE TABLE "DB"."SCH"."CATS" ("_SDC_PLACEHOLDER" BOOLEAN)')
+        cur.execute('ALTER TABLE "DB"."SCH"."CATS" ADD COLUMN "NAME" text NOT NULL')
+        cur.execute('ALTER TABLE "DB"."SCH"."CATS" ALTER COLUMN "NAME" DROP NOT NULL')
+        cur.execute('ALTER TABLE "DB"."SCH"."CATS" DROP COLUMN "_SDC_PLACEHOLDER"')
+        cur.execute("COMMENT ON TABLE \"DB\".\"SCH\".\"CATS\" IS '{\"path\": [\"cats\"]}'")
+        cur.execute('CREATE TABLE "DB"."SCH"."TMP" LIKE "DB"."SCH"."CATS"')
+
+        cur.execute('SHOW TABLES IN SCHEMA "DB"."SCH"')
+        assert [(row[1], row[5]) for row in cur.fetchall()] == [('CATS', '{"path": ["cats"]}'), ('TMP', '')]
+
+        cur.execute('''
+            SELECT table_name, column_name, data_type, is_nullable
+            FROM "DB".information_schema.columns
+            WHERE table_schema = 'SCH'
+        ''')
+        assert cur.fetchall() == [('CATS', 'NAME', 'TEXT', 'YES'), ('TMP', 'NAME', 'TEXT', 'YES')]
+
+        cur.execute('DROP TABLE "DB"."SCH"."TMP"')
+        assert list(connection.tables) == ['CATS']
+
+
+def test_target_loads_through_fake_connection():
+    connection = FakeConnection()
+    target = SnowflakeTarget(connection)
+
+    with PhaseRecorder() as recorder:
+        ingest.stream_to_target(iter(lines()), target)
+        ingest.stream_to_target(iter(lines()), target)
+
+    assert set(connection.tables) == {'CATS', 'CATS__TOYS'}
+    assert recorder.counts['table_rows_persisted'] == 60
+    assert {'serialize', 'stage', 'copy', 'insert', 'merge_delete', 'merge_insert'} <= set(recorder.phase_seconds)
+    assert connection.put_files == 4
+
+
+def test_target_activates_versions_through_fake_connection():
+    connection = FakeConnection()
+    target = SnowflakeTarget(connection)
+
+    with PhaseRecorder() as recorder:
+        ingest.stream_to_target(iter(lines(versions=(1, 2))), target, config={'max_batch_rows': 5})
+
+    assert set(connection.tables) == {'CATS', 'CATS__TOYS'}
+    assert json.loads(connection.tables['CATS'].comment)['version'] == 2
+    assert 'activate_version' in recorder.phase_seconds
+
+
+def test_scrub_record():
+    record = {'id': 1,
+              'name': 'Tom',
+              'owner': {'email': 'a@b.c', 'age': 3},
+              'toys': [{'name': 'ball'}, {'name': 'Tom'}]}
+
+    cli.scrub_record(record, [('name',), ('owner', 'email'), ('owner', 'age'), ('toys', 'name')])
+
+    assert record['id'] == 1
+    assert record['name'] != 'Tom' and len(record['name']) == 3
+    assert len(record['owner']['email']) == 5
+    assert record['owner']['age'] == 3
+    assert record['toys'][1]['name'] == record['name']
+
+
+def test_record_and_replay(tmpdir):
+    path = str(tmpdir.join('capture.jsonl.gz'))
+    data = ('\n'.join(lines()) + '\n').encode('utf-8')
+    tee = io.BytesIO()
+
+    assert cli.record(io.BytesIO(data), path, scrub=['name'], tee=tee) == 11
+    assert tee.getvalue() == data
+
+    with gzip.open(path, 'rb') as capture:
+        captured = [json.loads(line) for line in capture]
+    assert [message['record']['id'] for message in captured[1:]] == list(range(10))
+    assert all(not message['record']['name'].startswith('cat') for message in captured[1:])
+
+    report = cli.replay(path, {}, stand_in=True)
+
+    assert report['rows'] == 10
+    assert report['streams']['cats']['records'] == 10
+    assert report['streams']['cats']['write_seconds'] > 0
+    assert 'serialize' in report['streams']['cats']['phases']
+
+
+def test_scale_matrix__cells():
+    cells = scale_matrix.cells()
+
+    assert cells[0] == scale_matrix.BASE
+    assert len(cells) == 1 + sum(len(values) - 1 for values in scale_matrix.AXES.values())
+    assert all(sum(cell[name] != scale_matrix.BASE[name] for name in cell) <= 1 for cell in cells)
+
+
+def test_scale_matrix__stream_shape():
+    stream = scale_matrix.MatrixStream(3, columns=10, depth=2, fanout=4, duplicates=0.0, timestamps=0.5, sequence=1)
+    lines = [json.loads(line) for line in scale_matrix.benchmark.stream_lines(stream)]
+
+    properties = lines[0]['schema']['properties']
+    assert len([name for name in properties if name.startswith('column_')]) == 10
+    assert len([column for column in properties.values() if column.get('format') == 'date-time']) == 5
+
+    record = lines[1]['record']
+    assert record['nested_0']['nested_1'] == {'value': 'level 1'}
+    assert len(record['items']) == 4
+    assert len(lines) == 4
+
+
+def test_scale_matrix__compare():
+    baseline = {'a': {'rows_per_sec': 100.0, 'serialize_stage_rows_per_sec': 200.0, 'peak_rss_mb': 50.0}}
+
+    assert scale_matrix.compare({'a': {'rows_per_sec': 85.0, 'serialize_stage_rows_per_sec': 190.0, 'peak_rss_mb': 55.0},
+                                 'b': {'rows_per_sec': 1.0, 'serialize_stage_rows_per_sec': 1.0, 'peak_rss_mb': 1.0}},
+                                baseline, 0.2, 0.2) == []
+
+    regressions = scale_matrix.compare({'a': {'rows_per_sec': 70.0,
+                                              'serialize_stage_rows_per_sec': 190.0,
+                                              'peak_rss_mb': 70.0}},
+                                       baseline, 0.2, 0.2)
+    assert len(regressions) == 2
@@ -0,0 +1,143 @@
+import pytest
+from snowflake.connector.cursor import SnowflakeCursor
+from snowflake.connector.errors import OperationalError, ProgrammingError
+
+from target_snowflake import connection
+from target_snowflake.connection import RetryPolicy, classify_error, with_retries
+from target_snowflake.exceptions import SnowflakeError
+
+
+class FakeLogger:
+    def warning(self, *args, **kwargs):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, max_attempts=3):
+        self.LOGGER = FakeLogger()
+        self.retry_policy = RetryPolicy(max_attempts=max_attempts, backoff_seconds=0)
+        self.reconnects = 0
+
+    def is_closed(self):
+        return False
+
+    def reconnect(self):
+        self.reconnects += 1
+
+
+def failing(errors, result='done'):
+    errors = list(errors)
+
+    def operation():
+        if errors:
+            raise errors.pop(0)
+        return result
+
+    return operation
+
+
+def test_classify_error():
+    assert classify_error(ProgrammingError(msg='timeout', errno=630)) == connection.TRANSIENT
+    assert classify_error(ProgrammingError(msg='canceled', sqlstate='57014')) == connection.TRANSIENT
+    assert classify_error(OperationalError(msg='expired', errno=390112)) == connection.SESSION_LOST
+    assert classify_error(ConnectionResetError()) == connection.SESSION_LOST
+    assert classify_error(ProgrammingError(msg='syntax', errno=1003, sqlstate='42000')) is None
+    assert classify_error(ValueError()) is None
+
+    ## Wrapped the way `SnowflakeTarget` wraps errors
+    assert classify_error(SnowflakeError('Exception writing records',
+                                         ProgrammingError(msg='timeout', errno=630))) == connection.TRANSIENT
+
+
+def test_with_retries__reconnects_lost_sessions():
+    conn = FakeConnection()
+
+    assert with_retries(conn,
+                        failing([OperationalError(msg='expired', errno=390112),
+                                 ProgrammingError(msg='timeout', errno=630)]),
+                        'Batch') == 'done'
+    assert conn.reconnects == 1
+
+
+def test_with_retries__gives_up():
+    conn = FakeConnection(max_attempts=2)
+
+    with pytest.raises(ProgrammingError):
+        with_retries(conn,
+                     failing([ProgrammingError(msg='timeout', errno=630)] * 2),
+                     'Batch')
+
+
+def test_with_retries__does_not_retry_other_errors():
+    conn = FakeConnection()
+
+    with pytest.raises(ValueError):
+        with_retries(conn, failing([ValueError(), ProgrammingError(msg='timeout', errno=630)]), 'Batch')
+
+
+class RecordingCursor:
+    def __init__(self, executed):
+        self.executed = executed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, command, params=None):
+        self.executed.append((command, params))
+
+
+def test_set_query_tag__only_when_changed():
+    conn = object.__new__(connection.Connection)
+    conn._query_tag = None
+    executed = []
+    conn.cursor = lambda: RecordingCursor(executed)
+
+    conn.set_query_tag('{"phase": "copy"}')
+    conn.set_query_tag('{"phase": "copy"}')
+    conn.set_query_tag('{"phase": "merge"}')
+    conn.set_query_tag(None)
+
+    assert executed == [('ALTER SESSION SET QUERY_TAG = %s', ['{"phase": "copy"}']),
+                        ('ALTER SESSION SET QUERY_TAG = %s', ['{"phase": "merge"}']),
+                        ('ALTER SESSION UNSET QUERY_TAG', None)]
+
+
+class StatementRecorder:
+    retry_policy = None
+
+    def __init__(self):
+        self.recorded = []
+
+    def record_statement(self, command, millis, query_id, rows, failed, params=None):
+        self.recorded.append((command, query_id, failed))
+
+
+def test_millis_logging_cursor__records_query_id_of_failed_statement(monkeypatch):
+    def execute(cursor, command, **kwargs):
+        if command.startswith('DELETE'):
+            raise ProgrammingError(msg='syntax', errno=1003, sfqid='q2')
+        if command.endswith('(2)'):
+            raise ValueError()
+        cursor._sfqid = 'q1'
+
+    monkeypatch.setattr(SnowflakeCursor, 'execute', execute)
+
+    recorder = StatementRecorder()
+    cur = object.__new__(connection.MillisLoggingCursor)
+    cur._connection = recorder
+    cur._sfqid = None
+    cur._total_rowcount = -1
+
+    cur.execute('INSERT INTO "CATS" VALUES (1)')
+    with pytest.raises(ProgrammingError):
+        cur.execute('DELETE FROM "CATS"')
+    with pytest.raises(ValueError):
+        cur.execute('INSERT INTO "CATS" VALUES (2)')
+
+    ## Never the id of the previous, successful, statement
+    assert recorder.recorded == [('INSERT INTO "CATS" VALUES (1)', 'q1', False),
+                                 ('DELETE FROM "CATS"', 'q2', True),
+                                 ('INSERT INTO "CATS" VALUES (2)', None, True)]
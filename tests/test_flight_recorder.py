@@ -0,0 +1,99 @@
+import json
+
+from target_snowflake import ingest
+from target_snowflake.bench import FakeConnection
+from target_snowflake.flight_recorder import FlightRecorder
+from target_snowflake.snowflake import SnowflakeTarget
+
+from test_bench import lines
+from test_s3 import make_s3
+
+
+class NoMonitorConnection(FakeConnection):
+    def cursor(self, as_dict=False):
+        raise Exception('Insufficient privileges to operate on query')
+
+
+def read_entries(path):
+    with open(path) as entries:
+        return [json.loads(line) for line in entries]
+
+
+def test_record__only_slow_loading_statements(tmpdir):
+    path = str(tmpdir.join('flights.jsonl'))
+    recorder = FlightRecorder(path, 1000)
+    connection = FakeConnection(flight_recorder=recorder)
+    recorder.context = {'table': 'CATS', 'temp_rows': 10}
+
+    assert recorder.record(connection, 'INSERT INTO "CATS" VALUES (1)', 999, 'q1', 1, False) is None
+    assert recorder.record(connection, 'SELECT COUNT(1) FROM "CATS"', 5000, 'q2', 1, False) is None
+
+    entry = recorder.record(connection, 'DELETE FROM "CATS" WHERE "ID" > %s', 5000, 'q3', 4, True, params=[3])
+    recorder.close()
+
+    assert read_entries(path) == [entry]
+    assert entry['kind'] == 'delete'
+    assert (entry['table'], entry['temp_rows']) == ('CATS', 10)
+    assert (entry['millis'], entry['query_id'], entry['rows'], entry['failed']) == (5000, 'q3', 4, True)
+    assert entry['sql'] == 'DELETE FROM "CATS" WHERE "ID" > %s'
+    assert (entry['param_count'], entry['param_types']) == (1, ['int'])
+    assert entry['operator_stats'] == []
+    assert connection.executed[-1] == 'SELECT * FROM TABLE(GET_QUERY_OPERATOR_STATS(%s))'
+
+
+def test_record__operator_stats_not_permitted(tmpdir):
+    recorder = FlightRecorder(str(tmpdir.join('flights.jsonl')), 0)
+
+    entry = recorder.record(NoMonitorConnection(), 'COPY INTO "TMP" FROM @"STAGE"', 10, 'q1', 10, False)
+
+    assert 'operator_stats' not in entry
+    assert entry['operator_stats_error'] == 'Insufficient privileges to operate on query'
+
+    recorder.operator_stats = False
+    assert 'operator_stats_error' not in recorder.record(NoMonitorConnection(), 'COPY INTO "TMP"', 10, 'q2', 10, False)
+
+
+def test_target_records_table_context(tmpdir):
+    path = str(tmpdir.join('flights.jsonl'))
+    recorder = FlightRecorder(path, 0, operator_stats=False)
+    target = SnowflakeTarget(FakeConnection(flight_recorder=recorder))
+
+    ingest.stream_to_target(iter(lines()), target, config={'disable_collection': True})
+    recorder.close()
+
+    entries = read_entries(path)
+    assert {(entry['kind'], entry['table']) for entry in entries} == {('copy', 'CATS'),
+                                                                      ('insert', 'CATS'),
+                                                                      ('copy', 'CATS__TOYS'),
+                                                                      ('insert', 'CATS__TOYS')}
+    for entry in entries:
+        assert entry['stream'] == 'cats'
+        assert entry['batch'] == 1
+        assert entry['run'] == target.run_id
+        if entry['table'] == 'CATS':
+            assert (entry['key_properties'], entry['temp_rows']) == (['ID'], 10)
+        else:
+            assert (entry['key_properties'], entry['temp_rows']) == (['_SDC_SOURCE_KEY_ID'], 20)
+        assert entry['temp_table'].startswith('TMP_')
+
+    assert recorder.context == {}
+
+
+def test_target_does_not_record_credentials(tmpdir):
+    path = str(tmpdir.join('flights.jsonl'))
+    recorder = FlightRecorder(path, 0, operator_stats=False)
+    s3 = make_s3()
+    s3.credentials = lambda: {'aws_access_key_id': 'AKIAEXAMPLEKEYID', 'aws_secret_access_key': 'EXAMPLE/SECRET'}
+    target = SnowflakeTarget(FakeConnection(flight_recorder=recorder), s3=s3)
+
+    ingest.stream_to_target(iter(lines()), target, config={'disable_collection': True})
+    recorder.close()
+
+    copies = [entry for entry in read_entries(path) if entry['kind'] == 'copy']
+    assert len(copies) == 2
+    assert all((entry['param_count'], entry['param_types']) == (2, ['str', 'str']) for entry in copies)
+
+    with open(path) as entries:
+        recorded = entries.read()
+    assert 'AKIAEXAMPLEKEYID' not in recorded
+    assert 'EXAMPLE/SECRET' not in recorded
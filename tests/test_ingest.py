@@ -0,0 +1,127 @@
+import io
+import json
+import math
+from decimal import Decimal
+
+from target_snowflake import ingest
+
+
+SCHEMA = {'type': 'SCHEMA',
+          'stream': 'cats',
+          'schema': {'properties': {'id': {'type': 'integer'},
+                                    'weight': {'type': ['null', 'number']}}},
+          'key_properties': ['id']}
+
+
+class RecordingTarget:
+    def __init__(self):
+        self.batches = []
+        self.activated = []
+
+    def write_batch(self, stream_buffer):
+        self.batches.append((stream_buffer.stream, [r['record']['id'] for r in stream_buffer.peek_buffer()]))
+
+    def activate_version(self, stream_buffer, version):
+        self.activated.append((stream_buffer.stream, version))
+
+
+def record(id, stream='cats'):
+    return {'type': 'RECORD', 'stream': stream, 'record': {'id': id, 'weight': 4.5}}
+
+
+def to_binary_stream(messages):
+    return io.BytesIO(''.join(json.dumps(m) + '\n' for m in messages).encode('utf-8'))
+
+
+def test_read_lines__splits_across_chunks():
+    readable = io.BytesIO(b'{"a": 1}\n\n{"b": 2}\n{"c": 3}')
+
+    assert list(ingest.read_lines(readable, chunk_size=3)) == [b'{"a": 1}', b'{"b": 2}', b'{"c": 3}']
+
+
+def test_read_lines__text():
+    readable = io.StringIO('{"a": 1}\n{"b": 2}\n')
+
+    assert list(ingest.read_lines(readable, chunk_size=5)) == ['{"a": 1}', '{"b": 2}']
+
+
+def test_loads__exact_numbers():
+    assert ingest.loads(b'{"n": 1.1}', exact_numbers=True) == {'n': Decimal('1.1')}
+    assert float(ingest.loads(b'{"n": 1.1}')['n']) == 1.1
+
+
+def test_loads__non_finite_numbers():
+    for line in (b'{"n": NaN, "m": Infinity}', '{"n": NaN, "m": Infinity}'):
+        message = ingest.loads(line)
+        assert math.isnan(message['n'])
+        assert message['m'] == float('inf')
+
+
+def test_loads__wide_integers():
+    for line in (b'{"id": 123456789012345678901234567890}', '{"id": 123456789012345678901234567890}'):
+        assert ingest.loads(line) == {'id': 123456789012345678901234567890}
+
+    assert ingest.loads(b'{"id": -9223372036854775809}') == {'id': -9223372036854775809}
+    assert ingest.loads(b'{"id": 9223372036854775807}') == {'id': 9223372036854775807}
+
+
+def test_stream_to_target__binary_stream(capsys):
+    target = RecordingTarget()
+    messages = [SCHEMA,
+                record(1),
+                record(2),
+                {'type': 'STATE', 'value': {'bookmark': 2}},
+                record(3)]
+
+    ingest.stream_to_target(to_binary_stream(messages), target, config={'disable_collection': True})
+
+    assert target.batches == [('cats', [1, 2, 3])]
+    assert json.loads(capsys.readouterr().out) == {'bookmark': 2}
+
+
+def test_stream_to_target__flushes_full_buffers_and_activates():
+    target = RecordingTarget()
+    messages = [dict(SCHEMA, stream='dogs'), SCHEMA]
+    messages += [record(i) for i in range(10)]
+    messages += [record(i, stream='dogs') for i in range(3)]
+    messages.append({'type': 'ACTIVATE_VERSION', 'stream': 'dogs', 'version': 1})
+
+    ingest.stream_to_target([json.dumps(m) for m in messages],
+                            target,
+                            config={'disable_collection': True,
+                                    'max_batch_rows': 4,
+                                    'batch_detection_threshold': 4})
+
+    assert target.batches[0] == ('cats', [0, 1, 2, 3])
+    assert ('dogs', [0, 1, 2]) in target.batches
+    assert target.activated == [('dogs', 1)]
+    assert sorted(sum([ids for stream, ids in target.batches if stream == 'cats'], [])) == list(range(10))
+
+
+def test_stream_to_target__multiple_of_keeps_decimals():
+    target = RecordingTarget()
+    schema = json.loads(json.dumps(SCHEMA))
+    schema['schema']['properties']['weight']['multipleOf'] = 0.1
+
+    ingest.stream_to_target([json.dumps(schema), json.dumps(record(1))],
+                            target,
+                            config={'disable_collection': True})
+
+    assert target.batches == [('cats', [1])]
+
+
+def test_stream_to_target__non_finite_numbers_and_wide_integers():
+    target = RecordingTarget()
+    lines = [json.dumps(SCHEMA),
+             '{"type": "RECORD", "stream": "cats", "record": {"id": 1, "weight": NaN}}',
+             '{"type": "RECORD", "stream": "cats", "record": {"id": 123456789012345678901234567890, "weight": 1.5}}']
+
+    ingest.stream_to_target(lines, target, config={'disable_collection': True})
+
+    assert target.batches == [('cats', [1, 123456789012345678901234567890])]
+
+
+def test_ingester__max_batch_size_alias():
+    assert ingest.Ingester(None, None, {'max_batch_size': 1000}).max_buffer_size == 1000
+    assert ingest.Ingester(None, None, {'max_batch_size': 1000, 'max_buffer_size': 2000}).max_buffer_size == 2000
+    assert ingest.Ingester(None, None, {}).max_buffer_size == 104857600
@@ -0,0 +1,40 @@
+from target_snowflake.journal import LoadJournal
+
+
+def test_pending(tmp_path):
+    path = str(tmp_path / 'journal' / 'loads.jsonl')
+    journal = LoadJournal(path)
+
+    committed = journal.begin('cats', 'CATS', [1, 2])
+    journal.temp_table(committed, 'TMP_A')
+    journal.commit(committed)
+
+    interrupted = journal.begin('dogs', 'DOGS', [3, 4])
+    journal.temp_table(interrupted, 'TMP_B')
+    journal.staged(interrupted, '@STAGE/run/batch/')
+    journal.close()
+
+    ## A crash mid-write leaves a partial line behind
+    with open(path, 'a') as file:
+        file.write('{"event": "comm')
+
+    assert LoadJournal(path).pending() == [{'batch': interrupted,
+                                            'stream': 'dogs',
+                                            'table': 'DOGS',
+                                            'sequence': [3, 4],
+                                            'temp_tables': ['TMP_B'],
+                                            'staged': ['@STAGE/run/batch/']}]
+
+
+def test_abort_and_reset(tmp_path):
+    journal = LoadJournal(str(tmp_path / 'loads.jsonl'))
+
+    aborted = journal.begin('cats', 'CATS', None)
+    journal.abort(aborted)
+    assert journal.pending() == []
+
+    journal.begin('cats', 'CATS', None)
+    assert len(journal.pending()) == 1
+
+    journal.reset()
+    assert journal.pending() == []
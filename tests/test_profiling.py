@@ -0,0 +1,84 @@
+import os
+import pstats
+import time
+import tracemalloc
+
+import pytest
+
+from target_snowflake import ingest
+from target_snowflake.bench import FakeConnection
+from target_snowflake.profiling import FlushProfiler
+from target_snowflake.snowflake import SnowflakeTarget
+
+from test_bench import lines
+
+
+def slow_flush():
+    time.sleep(0.1)
+
+
+def test_requires_a_sampling_rule(tmpdir):
+    with pytest.raises(ValueError):
+        FlushProfiler(str(tmpdir))
+
+
+def test_every_batches(tmpdir):
+    profiler = FlushProfiler(str(tmpdir), every_batches=2)
+
+    for batch_number in (1, 2, 3):
+        with profiler.batch('my/cats', batch_number):
+            sum(range(1000))
+
+    files = os.listdir(str(tmpdir))
+    assert [name.split('.', 1)[1] for name in files] == ['my_cats.000002.prof']
+    assert pstats.Stats(os.path.join(str(tmpdir), files[0])).total_calls > 0
+
+
+def test_slow_seconds(tmpdir):
+    profiler = FlushProfiler(str(tmpdir), slow_seconds=0.05, sample_interval_seconds=0.005)
+
+    with profiler.batch('cats', 1):
+        pass
+    assert os.listdir(str(tmpdir)) == []
+
+    with profiler.batch('cats', 2):
+        slow_flush()
+
+    files = os.listdir(str(tmpdir))
+    assert [name.split('.', 1)[1] for name in files] == ['cats.000002.folded']
+    with open(os.path.join(str(tmpdir), files[0])) as folded:
+        samples = [line.rsplit(' ', 1) for line in folded.read().splitlines()]
+    assert samples
+    assert any(':slow_flush:' in stack for stack, _ in samples)
+    assert all(int(count) > 0 for _, count in samples)
+
+
+def test_allocations(tmpdir):
+    profiler = FlushProfiler(str(tmpdir), every_batches=1, allocations=True)
+
+    with profiler.serialization('CATS'):
+        pass
+    assert os.listdir(str(tmpdir)) == []
+
+    with profiler.batch('cats', 1):
+        with profiler.serialization('CATS'):
+            rows = [['row {}'.format(i)] for i in range(1000)]
+
+    assert not tracemalloc.is_tracing()
+    assert len(rows) == 1000
+    snapshots = sorted(name.split('.', 1)[1] for name in os.listdir(str(tmpdir)))
+    assert snapshots == ['cats.000001.CATS.tracemalloc', 'cats.000001.prof']
+
+    path = [os.path.join(str(tmpdir), name) for name in os.listdir(str(tmpdir)) if name.endswith('.tracemalloc')][0]
+    statistics = tracemalloc.Snapshot.load(path).statistics('filename')
+    assert any(statistic.traceback[0].filename == __file__ for statistic in statistics)
+
+
+def test_target_profiles_batches(tmpdir):
+    profiler = FlushProfiler(str(tmpdir), every_batches=1, allocations=True)
+    target = SnowflakeTarget(FakeConnection(), profiler=profiler)
+
+    ingest.stream_to_target(iter(lines()), target, config={'disable_collection': True})
+
+    assert sorted(name.split('.', 1)[1] for name in os.listdir(str(tmpdir))) == \
+           ['cats.000001.CATS.tracemalloc', 'cats.000001.CATS__TOYS.tracemalloc', 'cats.000001.prof']
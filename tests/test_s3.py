@@ -0,0 +1,71 @@
+import gzip
+
+import pytest
+
+from target_snowflake.s3 import S3
+
+
+class FakeClient:
+    def __init__(self):
+        self.objects = {}
+
+    def upload_fileobj(self, fileobj, bucket, key, Config=None):
+        data = b''
+        chunk = fileobj.read(7)
+        while chunk:
+            data += chunk
+            chunk = fileobj.read(7)
+        self.objects[key] = data
+
+
+class Rows:
+    def __init__(self, rows):
+        self.rows = iter(rows)
+
+    def read(self):
+        return next(self.rows, '')
+
+
+def make_s3(**kwargs):
+    s3 = S3('key', 'secret', 'bucket', 'prefix/', **kwargs)
+    s3.client = FakeClient()
+    return s3
+
+
+def test_persist_parts__gzip_single_file():
+    s3 = make_s3()
+    rows = ['{},cat\n'.format(i) for i in range(100)]
+
+    bucket, prefix, keys = s3.persist_parts(Rows(rows), key_prefix='TMP__')
+
+    assert bucket == 'bucket'
+    assert prefix.startswith('prefix/TMP__') and prefix.endswith('/')
+    assert keys == [prefix + 'part_00000.csv.gz']
+    assert gzip.decompress(s3.client.objects[keys[0]]).decode('utf-8') == ''.join(rows)
+
+
+def test_persist_parts__splits_files():
+    s3 = make_s3(compression='none', max_file_size=20)
+    rows = ['{},cat\n'.format(i) for i in range(10)]
+
+    bucket, prefix, keys = s3.persist_parts(Rows(rows))
+
+    assert len(keys) == 3
+    assert all(key.endswith('.csv') for key in keys)
+    assert b''.join(s3.client.objects[key] for key in keys).decode('utf-8') == ''.join(rows)
+
+
+def test_invalid_compression():
+    with pytest.raises(ValueError):
+        make_s3(compression='zstd')
+
+
+def test_persist_parts__reports_part_sizes():
+    s3 = make_s3(compression='none', max_file_size=20)
+    rows = ['{},cat\n'.format(i) for i in range(10)]
+    parts = []
+
+    bucket, prefix, keys = s3.persist_parts(Rows(rows), on_part=lambda key, size: parts.append((key, size)))
+
+    assert [key for key, _ in parts] == keys
+    assert sum(size for _, size in parts) == len(''.join(rows))
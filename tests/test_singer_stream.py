@@ -0,0 +1,91 @@
+import pytest
+from target_postgres.exceptions import SingerStreamError
+from target_postgres.singer_stream import RAW_LINE_SIZE
+
+from target_snowflake.singer_stream import BufferedSingerStream, parse_validation_mode
+
+SCHEMA = {'additionalProperties': False,
+          'properties': {'id': {'type': 'integer'}}}
+
+
+def record_message(id):
+    return {'type': 'RECORD', 'stream': 'cats', 'record': {'id': id}, 'sequence': 1}
+
+
+def test_parse_validation_mode():
+    assert parse_validation_mode(None) == 1
+    assert parse_validation_mode('full') == 1
+    assert parse_validation_mode('off') == 0
+    assert parse_validation_mode('sample:10') == 10
+
+    for invalid in ['sample:0', 'sample:x', 'some']:
+        with pytest.raises(ValueError):
+            parse_validation_mode(invalid)
+
+
+def test_validators_are_shared_by_schema():
+    a = BufferedSingerStream('cats', SCHEMA, ['id'])
+    b = BufferedSingerStream('dogs', dict(SCHEMA), ['id'])
+
+    assert a.validator is b.validator
+
+
+def test_full__rejects_invalid():
+    stream_buffer = BufferedSingerStream('cats', SCHEMA, ['id'])
+
+    with pytest.raises(SingerStreamError):
+        stream_buffer.add_record_message(record_message('one'))
+
+
+def test_sample__only_validates_every_nth():
+    stream_buffer = BufferedSingerStream('cats', SCHEMA, ['id'], validate_every=2, invalid_records_detect=False)
+
+    for id in [1, 'two', 'three']:
+        stream_buffer.add_record_message(record_message(id))
+
+    # The first and third records are sampled
+    assert stream_buffer.count == 2
+    assert stream_buffer.unvalidated_count == 1
+    assert len(stream_buffer.invalid_records) == 1
+
+
+def test_off__validate_buffer_drops_invalid():
+    stream_buffer = BufferedSingerStream('cats', SCHEMA, ['id'], validate_every=0, invalid_records_threshold=5)
+
+    for id in [1, 'two', 3]:
+        stream_buffer.add_record_message(record_message(id))
+    assert stream_buffer.count == 3
+
+    # `get_batch` adds `_sdc_*` fields in place, which must not fail validation
+    stream_buffer.get_batch()
+
+    assert stream_buffer.validate_buffer() == 1
+    assert [m['record']['id'] for m in stream_buffer.peek_buffer()] == [1, 3]
+    assert stream_buffer.unvalidated_count == 0
+
+
+def test_off__validate_buffer_respects_threshold():
+    stream_buffer = BufferedSingerStream('cats', SCHEMA, ['id'], validate_every=0)
+    stream_buffer.add_record_message(record_message('one'))
+
+    with pytest.raises(SingerStreamError):
+        stream_buffer.validate_buffer()
+
+
+class RenamedStream(BufferedSingerStream):
+    pass
+
+
+def test_size__counts_buffered_records():
+    stream_buffer = RenamedStream('cats', SCHEMA, ['id'], invalid_records_detect=False)
+
+    for id in (1, 'two', 3):
+        message = record_message(id)
+        message[RAW_LINE_SIZE] = 10
+        stream_buffer.add_record_message(message)
+
+    ## Invalid records are not buffered
+    assert (stream_buffer.count, stream_buffer.size) == (2, 20)
+
+    stream_buffer.flush_buffer()
+    assert stream_buffer.size == 0
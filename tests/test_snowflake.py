@@ -0,0 +1,439 @@
+import json
+import re
+
+from target_snowflake import ingest
+from target_snowflake.bench import FakeConnection
+from target_snowflake.bench.fake import FakeCursor
+from target_snowflake.connection import RetryPolicy
+from target_snowflake.snowflake import SnowflakeTarget
+
+from test_bench import lines
+
+
+def load(messages, connection=None, config=None, **kwargs):
+    """
+    Load `messages` through a `SnowflakeTarget` on a `FakeConnection`.
+    :return: (FakeConnection, SnowflakeTarget)
+    """
+    connection = connection or FakeConnection()
+    target = SnowflakeTarget(connection, **kwargs)
+    ingest.stream_to_target(iter(messages), target, config=dict({'disable_collection': True}, **(config or {})))
+    return connection, target
+
+
+def executed(connection, keyword):
+    """
+    :return: [string, ...], statements `connection` executed which start with `keyword`, on a single line
+    """
+    statements = [' '.join(command.split()) for command in connection.executed]
+    return [statement for statement in statements if statement.upper().startswith(keyword)]
+
+
+def test_internal_stage__puts_under_run_prefix():
+    connection, target = load(lines(), internal_stage='MY_STAGE')
+
+    puts = executed(connection, 'PUT')
+    assert len(puts) == 1
+    assert re.match(r'^PUT file:///tmp/target-snowflake/\w+/\* @MY_STAGE/{}/\w+ PARALLEL = 8$'.format(target.run_id),
+                    puts[0])
+    assert connection.put_files == 2
+
+    ## Files are left in the stage until the run is over
+    assert executed(connection, 'REMOVE') == []
+    assert all('PURGE' not in copy for copy in executed(connection, 'COPY'))
+
+    target.cleanup()
+    assert executed(connection, 'REMOVE') == ['REMOVE @MY_STAGE/{}/'.format(target.run_id)]
+
+
+def test_internal_stage__purge():
+    connection, target = load(lines(), internal_stage='MY_STAGE', internal_stage_purge=True)
+
+    copies = executed(connection, 'COPY')
+    assert len(copies) == 2
+    assert all(copy.endswith('PURGE = TRUE') for copy in copies)
+
+    target.cleanup()
+    assert executed(connection, 'REMOVE') == []
+
+
+def test_table_stage__removes_files_after_each_merge():
+    connection, target = load(lines())
+
+    puts = executed(connection, 'PUT')
+    assert len(puts) == 2
+    assert all(re.search(r' @"BENCH"\."PUBLIC"\.%"TMP_\w+"$', put) for put in puts)
+
+    removes = executed(connection, 'REMOVE')
+    assert len(removes) == 2
+    assert all(re.match(r'^REMOVE @"BENCH"\."PUBLIC"\.%"TMP_\w+"$', remove) for remove in removes)
+
+    target.cleanup()
+    assert len(executed(connection, 'REMOVE')) == 2
+
+
+def test_named_stage__one_put_per_batch():
+    connection, target = load(lines(), internal_stage='MY_STAGE')
+
+    put_location = re.search(r' (@\S+) PARALLEL', executed(connection, 'PUT')[0]).group(1)
+
+    copies = executed(connection, 'COPY')
+    assert len(copies) == 2
+
+    files = []
+    for copy in copies:
+        temp_table, location = re.match(r'^COPY INTO "BENCH"\."PUBLIC"\."(TMP_\w+)" \(.*\) FROM (\S+) ', copy).groups()
+        ## Each table only loads its own file, out of the batch's upload
+        assert location == '{}/{}.csv'.format(put_location, temp_table)
+        files.append(location)
+
+    assert len(set(files)) == 2
+    assert connection.put_files == 2
+
+
+class SwapFailingConnection(FakeConnection):
+    """
+    Fails the first activation request part way, once it swapped the root table only.
+    """
+
+    def __init__(self, **kwargs):
+        super(SwapFailingConnection, self).__init__(**kwargs)
+        self.retry_policy = RetryPolicy(max_attempts=2, backoff_seconds=0)
+        self.failed = False
+
+    def cursor(self, as_dict=False):
+        connection = self
+
+        class Cursor(FakeCursor):
+            def _run(self, statement):
+                if not connection.failed and re.search(r'SWAP WITH "BENCH"\."PUBLIC"\."CATS__TOYS"', statement):
+                    connection.failed = True
+                    raise ConnectionError('Connection reset')
+                return super(Cursor, self)._run(statement)
+
+        return Cursor(self)
+
+
+def activation_requests(connection):
+    return [[' '.join(statement.split()) for statement in command.split(';')]
+            for command in connection.executed
+            if 'SWAP WITH' in command or 'DROP TABLE IF EXISTS' in command]
+
+
+def assert_version_active(connection, version):
+    assert set(connection.tables) == {'CATS', 'CATS__TOYS'}
+    assert json.loads(connection.tables['CATS'].comment)['version'] == version
+    assert json.loads(connection.tables['CATS'].comment)['path'] == ['cats']
+    assert json.loads(connection.tables['CATS__TOYS'].comment)['version'] == version
+    assert json.loads(connection.tables['CATS__TOYS'].comment)['path'] == ['cats', 'toys']
+
+
+def test_activate_version__swaps_and_comments_every_table():
+    connection, target = load(lines(versions=(1, 2)))
+
+    db_schema = '"BENCH"."PUBLIC".'
+    swap, drop = activation_requests(connection)
+    assert [statement.split(' IS ')[0] for statement in swap] == [
+        'ALTER TABLE {0}"CATS__2" SWAP WITH {0}"CATS"'.format(db_schema),
+        'COMMENT ON TABLE {0}"CATS"'.format(db_schema),
+        'COMMENT ON TABLE {0}"CATS__2"'.format(db_schema),
+        'ALTER TABLE {0}"CATS__2__TOYS" SWAP WITH {0}"CATS__TOYS"'.format(db_schema),
+        'COMMENT ON TABLE {0}"CATS__TOYS"'.format(db_schema),
+        'COMMENT ON TABLE {0}"CATS__2__TOYS"'.format(db_schema)]
+    assert drop == ['DROP TABLE IF EXISTS {}"CATS__2"'.format(db_schema),
+                    'DROP TABLE IF EXISTS {}"CATS__2__TOYS"'.format(db_schema)]
+
+    assert_version_active(connection, 2)
+
+
+def test_activate_version__completes_partial_activation():
+    connection, target = load(lines(versions=(1, 2)), connection=SwapFailingConnection())
+
+    db_schema = '"BENCH"."PUBLIC".'
+    failed, retried, drop = activation_requests(connection)
+    assert [statement.split(' IS ')[0] for statement in failed][0] == \
+           'ALTER TABLE {0}"CATS__2" SWAP WITH {0}"CATS"'.format(db_schema)
+
+    ## The root table was already swapped, so only its versioned table is dropped
+    assert [statement.split(' IS ')[0] for statement in retried] == [
+        'ALTER TABLE {0}"CATS__2__TOYS" SWAP WITH {0}"CATS__TOYS"'.format(db_schema),
+        'COMMENT ON TABLE {0}"CATS__TOYS"'.format(db_schema),
+        'COMMENT ON TABLE {0}"CATS__2__TOYS"'.format(db_schema)]
+    assert drop == ['DROP TABLE IF EXISTS {}"CATS__2"'.format(db_schema),
+                    'DROP TABLE IF EXISTS {}"CATS__2__TOYS"'.format(db_schema)]
+
+    assert_version_active(connection, 2)
+
+
+def merges(connection, table_name):
+    """
+    :return: [string, ...], `DELETE` and `INSERT` keywords of the statements writing to `table_name`
+    """
+    full_table_name = '"BENCH"."PUBLIC"."{}"'.format(table_name)
+    return [statement.split()[0] for statement in executed(connection, '')
+            if statement.split()[0] in ('DELETE', 'INSERT') and statement.split()[2].split('(')[0] == full_table_name]
+
+
+BATCHES_OF_5 = {'max_batch_rows': 5, 'batch_detection_threshold': 1}
+
+
+def test_requires_merge__empty_version_table_is_inserted_into():
+    connection, target = load(lines(versions=(1, 2)), config=BATCHES_OF_5)
+
+    ## Only the first batch of a version finds its table empty
+    assert merges(connection, 'CATS') == ['INSERT', 'DELETE', 'INSERT']
+    assert merges(connection, 'CATS__2') == ['INSERT', 'DELETE', 'INSERT']
+    assert 'CATS__2' in target.direct_load_tables
+
+
+def test_requires_merge__direct_load_versions():
+    connection, target = load(lines(versions=(1, 2)), config=BATCHES_OF_5, direct_load_versions=True)
+
+    assert merges(connection, 'CATS__2') == ['INSERT', 'INSERT']
+
+
+def test_requires_merge__non_empty_version_table_is_merged():
+    ## A run which stopped before activating version 2
+    connection, target = load(lines(versions=(1, 2))[:-1])
+    assert merges(connection, 'CATS__2') == ['INSERT']
+
+    connection, target = load(lines(versions=(2,)), connection=connection)
+
+    assert merges(connection, 'CATS__2') == ['INSERT', 'DELETE', 'INSERT']
+    assert 'CATS__2' not in target.direct_load_tables
+
+
+class BoundsConnection(FakeConnection):
+    """
+    Answers the `SELECT` of a temp table's key and sequence bounds with `bounds`, and keeps the
+    params of every statement in `params`.
+    """
+
+    def __init__(self, bounds, **kwargs):
+        super(BoundsConnection, self).__init__(**kwargs)
+        self.bounds = bounds
+        self.params = []
+
+    def cursor(self, as_dict=False):
+        connection = self
+
+        class Cursor(FakeCursor):
+            def execute(self, command, params=None, **kwargs):
+                connection.params.append(params)
+                return super(Cursor, self).execute(command, params=params, **kwargs)
+
+            def _run(self, statement):
+                if re.match(r'\s*SELECT MIN\(', statement):
+                    self._rows = [connection.bounds]
+                    return
+                return super(Cursor, self)._run(statement)
+
+        return Cursor(self)
+
+
+def update(bounds, key_properties=('ID',)):
+    """
+    Merge temp table `TMP` into `CATS`, with the temp table's keys and sequence bounded by `bounds`.
+    :return: ((DELETE, its params), (INSERT, its params))
+    """
+    connection = BoundsConnection(bounds)
+    target = SnowflakeTarget(connection)
+
+    with connection.cursor() as cur:
+        cur.execute('CREATE TABLE "BENCH"."PUBLIC"."CATS" ("ID" NUMBER)')
+        target.perform_update(cur, 'CATS', 'TMP', list(key_properties), ['ID'], [])
+
+    statements = [(' '.join(command.split()), params) for command, params in zip(connection.executed,
+                                                                                 connection.params)]
+    delete, = [statement for statement in statements if statement[0].startswith('DELETE')]
+    insert, = [statement for statement in statements if statement[0].startswith('INSERT')]
+    return delete, insert
+
+
+def test_key_range_predicates():
+    (delete, delete_params), (insert, insert_params) = update((3, 9, 42))
+
+    key_range = ' AND "BENCH"."PUBLIC"."CATS"."ID" BETWEEN %s AND %s'
+    sequence_range = ' AND "BENCH"."PUBLIC"."CATS"."_SDC_SEQUENCE" <= %s'
+
+    ## In the JOIN, and again in the DELETE's own WHERE
+    assert delete.count(key_range + sequence_range) == 2
+    assert delete.count('%s') == 6
+    assert delete_params == [3, 9, 42, 3, 9, 42]
+
+    ## The INSERT only looks the keys up, so it is bounded by them alone
+    assert insert.count(key_range) == 1
+    assert sequence_range not in insert
+    assert insert_params == [3, 9]
+
+
+def test_key_range_predicates__single_key():
+    (delete, delete_params), (insert, insert_params) = update((5, 5, 42))
+
+    assert delete_params == [5, 5, 42, 5, 5, 42]
+    assert insert_params == [5, 5]
+
+
+def test_key_range_predicates__nullable_key():
+    ## A key column of only NULLs has no bounds, so it is left unbounded
+    (delete, delete_params), (insert, insert_params) = update((3, 9, None, None, 42), key_properties=('ID', 'NAME'))
+
+    assert '"NAME" BETWEEN' not in delete
+    assert delete.count('"ID" BETWEEN %s AND %s') == 2
+    assert delete.count('%s') == len(delete_params)
+    assert delete_params == [3, 9, 42, 3, 9, 42]
+    assert insert_params == [3, 9]
+
+
+def test_key_range_predicates__no_bounds():
+    (delete, delete_params), (insert, insert_params) = update((None, None, None))
+
+    assert 'BETWEEN' not in delete and '<=' not in delete
+    assert delete_params == []
+    assert insert_params == []
+
+
+def test_manage_clustering__min_rows():
+    connection, target = load(lines(), cluster_min_rows=2)
+    connection, target = load(lines(), connection=connection, cluster_min_rows=2)
+
+    ## The fake counts a row per INSERT, so `CATS` holds 1 row after the first run, and 2 after the second
+    assert executed(connection, 'ALTER TABLE "BENCH"."PUBLIC"."CATS" CLUSTER BY') == []
+
+    connection, target = load(lines(), connection=connection, cluster_min_rows=2)
+
+    assert executed(connection, 'ALTER TABLE "BENCH"."PUBLIC"."CATS" CLUSTER BY') == \
+           ['ALTER TABLE "BENCH"."PUBLIC"."CATS" CLUSTER BY ("ID")']
+    assert connection.tables['CATS'].cluster_by == 'LINEAR("ID")'
+    assert json.loads(connection.tables['CATS'].comment)['cluster_by'] == '"ID"'
+
+    ## The clustering key is already in the table's metadata
+    connection, target = load(lines(), connection=connection, cluster_min_rows=2)
+    assert len(executed(connection, 'ALTER TABLE "BENCH"."PUBLIC"."CATS" CLUSTER BY')) == 1
+
+
+def test_manage_clustering__cluster_by():
+    connection, target = load(lines(), cluster_by={'CATS': 'LEFT("NAME", 3)', 'CATS__TOYS': ''})
+
+    assert executed(connection, 'ALTER TABLE "BENCH"."PUBLIC"."CATS" CLUSTER BY') == \
+           ['ALTER TABLE "BENCH"."PUBLIC"."CATS" CLUSTER BY (LEFT("NAME", 3))']
+    assert json.loads(connection.tables['CATS'].comment)['cluster_by'] == 'LEFT("NAME", 3)'
+
+    ## Listed without an expression, a table is clustered by its key properties, whatever its size
+    assert executed(connection, 'ALTER TABLE "BENCH"."PUBLIC"."CATS__TOYS" CLUSTER BY') == \
+           ['ALTER TABLE "BENCH"."PUBLIC"."CATS__TOYS" CLUSTER BY ("_SDC_SOURCE_KEY_ID")']
+
+
+class HashingTarget(SnowflakeTarget):
+    """
+    Keeps the row hashes of every batch in `hashes`, by `ID`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(HashingTarget, self).__init__(*args, **kwargs)
+        self.hashes = []
+
+    def _add_row_hashes(self, row_hash_column, rows):
+        super(HashingTarget, self)._add_row_hashes(row_hash_column, rows)
+        self.hashes.append({row['ID']: row[row_hash_column] for row in rows})
+
+
+def resent(messages, sequence, **changes):
+    """
+    :return: [string, ...], `messages` as sent again at `sequence`, with record `id` changed to `changes[id]`
+    """
+    sent = []
+    for line in messages:
+        message = json.loads(line)
+        if message['type'] == 'RECORD':
+            message['sequence'] += sequence
+            message['record'].update(changes.get('id_{}'.format(message['record']['id']), {}))
+        sent.append(json.dumps(message))
+    return sent
+
+
+def test_row_hash__leaves_out_sdc_columns():
+    connection = FakeConnection()
+    target = HashingTarget(connection, row_hash=True)
+
+    ingest.stream_to_target(iter(lines()), target, config={'disable_collection': True})
+    ingest.stream_to_target(iter(resent(lines(), 100, id_3={'name': 'cat three'})),
+                            target,
+                            config={'disable_collection': True})
+
+    first, second = target.hashes
+    ## Only the row with a changed column has a new hash, whatever its `_sdc` sequence and received at
+    assert [id for id in first if first[id] != second[id]] == [3]
+    assert all(re.match(r'^[0-9a-f]{32}$', row_hash) for row_hash in first.values())
+
+    assert '_SDC_ROW_HASH' in connection.tables['CATS'].columns
+    assert '_SDC_ROW_HASH' not in connection.tables['CATS__TOYS'].columns
+
+
+def test_row_hash__unchanged_rows_are_not_rewritten():
+    connection, target = load(lines(), row_hash=True)
+    connection, target = load(lines(), connection=connection, row_hash=True)
+
+    deletes = executed(connection, 'DELETE')
+    assert len(deletes) == 2
+
+    ## Rows whose hash did not change are neither deleted, nor inserted again as their keys still match
+    cats, toys = deletes
+    assert cats.startswith('DELETE FROM "BENCH"."PUBLIC"."CATS" USING')
+    assert cats.count('AND "dedupped"."_SDC_ROW_HASH" IS DISTINCT FROM "BENCH"."PUBLIC"."CATS"."_SDC_ROW_HASH"') == 1
+    assert 'IS DISTINCT FROM' not in toys
+
+
+def retyped(messages, name_schema):
+    """
+    :return: [string, ...], `messages` with the `name` property of type `name_schema`, and ids as names
+    """
+    sent = []
+    for line in messages:
+        message = json.loads(line)
+        if message['type'] == 'SCHEMA':
+            message['schema']['properties']['name'] = name_schema
+        elif message['type'] == 'RECORD':
+            message['record']['name'] = message['record']['id']
+        sent.append(json.dumps(message))
+    return sent
+
+
+def alters(connection, since):
+    return [' '.join(command.split()) for command in connection.executed[since:]
+            if ' '.join(command.split()).startswith('ALTER TABLE "BENCH"."PUBLIC"."CATS" ')]
+
+
+def test_migrate_column__renames_split_column():
+    connection, target = load(lines())
+    since = len(connection.executed)
+
+    connection, target = load(retyped(lines(), {'type': ['null', 'integer']}), connection=connection)
+
+    table = 'ALTER TABLE "BENCH"."PUBLIC"."CATS"'
+    assert alters(connection, since) == [
+        table + ' ADD COLUMN "NAME__S" text',
+        table + ' ADD COLUMN "NAME__I" NUMBER',
+        ## Renamed into place, instead of rewriting the table, and left out by `drop_column`
+        table + ' DROP COLUMN "NAME__S"',
+        table + ' RENAME COLUMN "NAME" TO "NAME__S"']
+
+    assert connection.tables['CATS'].columns['NAME__S'] == ('TEXT', 'YES')
+    assert connection.tables['CATS'].columns['NAME__I'] == ('NUMBER', 'YES')
+    assert 'NAME' not in connection.tables['CATS'].columns
+    assert target.migrated_columns == set()
+
+
+def test_migrate_column__makes_renamed_column_nullable():
+    connection, target = load(retyped(lines(), {'type': 'integer'}))
+    assert connection.tables['CATS'].columns['NAME'] == ('NUMBER', 'NO')
+    since = len(connection.executed)
+
+    connection, target = load(lines(), connection=connection)
+
+    table = 'ALTER TABLE "BENCH"."PUBLIC"."CATS"'
+    assert alters(connection, since)[2:] == [
+        table + ' DROP COLUMN "NAME__I"',
+        table + ' RENAME COLUMN "NAME" TO "NAME__I"',
+        table + ' ALTER COLUMN "NAME__I" DROP NOT NULL']
+    assert connection.tables['CATS'].columns['NAME__I'] == ('NUMBER', 'YES')
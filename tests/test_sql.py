@@ -0,0 +1,13 @@
+import pytest
+
+from target_snowflake import sql
+from target_snowflake.exceptions import SQLError
+
+
+def test_stage_name():
+    assert sql.stage_name('MY_STAGE') == 'MY_STAGE'
+    assert sql.stage_name('MY_DB.MY_SCHEMA.MY_STAGE') == 'MY_DB.MY_SCHEMA.MY_STAGE'
+
+    for invalid in ['', 'A.B.C.D', 'MY_STAGE; DROP TABLE X', 'DB..STAGE']:
+        with pytest.raises(SQLError):
+            sql.stage_name(invalid)
@@ -0,0 +1,44 @@
+from target_snowflake import statements
+from target_snowflake.statements import StatementStats, classify_statement
+
+
+def test_classify_statement():
+    assert classify_statement('\n    CREATE TABLE "A"."B" ()') == statements.DDL
+    assert classify_statement('ALTER TABLE a SWAP WITH b;COMMENT ON TABLE b IS \'{}\'') == statements.DDL
+    assert classify_statement('  put file:///tmp/x @%T') == statements.PUT
+    assert classify_statement('COPY INTO a FROM @s') == statements.COPY
+    assert classify_statement('DELETE FROM a USING b') == statements.DELETE
+    assert classify_statement('INSERT INTO a (SELECT 1)') == statements.INSERT
+    assert classify_statement('COMMENT ON TABLE a IS \'\'') == statements.COMMENT
+    assert classify_statement('SHOW TABLES IN SCHEMA a') == statements.SHOW
+    assert classify_statement('DESC TABLE a') == statements.SHOW
+    assert classify_statement('SELECT MIN(a) FROM b') == statements.SELECT
+    assert classify_statement('ALTER SESSION SET QUERY_TAG = \'{}\'') == statements.SESSION
+    assert classify_statement('CALL something()') == statements.OTHER
+    assert classify_statement('') == statements.OTHER
+
+
+def test_statement_stats__summary():
+    stats = StatementStats()
+    for millis in [5, 5, 5, 40, 2000]:
+        stats.record(statements.COPY, millis, rows=10)
+    stats.record(statements.COPY, 400000, failed=True)
+    stats.record(statements.SHOW, 1, rows=-1)
+
+    summary = stats.summary()
+
+    assert list(summary) == [statements.COPY, statements.SHOW]
+
+    copy = summary[statements.COPY]
+    assert copy['count'] == 6
+    assert copy['failed'] == 1
+    assert copy['rows'] == 50
+    assert copy['max_millis'] == 400000
+    assert copy['p50_millis'] == 10
+    assert copy['p95_millis'] is None
+    assert copy['histogram']['<=10'] == 3
+    assert copy['histogram']['<=50'] == 1
+    assert copy['histogram']['<=2500'] == 1
+    assert copy['histogram']['>300000'] == 1
+
+    assert summary[statements.SHOW]['rows'] == 0
@@ -0,0 +1,131 @@
+import json
+
+import pytest
+
+from target_snowflake import ingest
+from target_snowflake.singer_stream import BufferedSingerStream
+from target_snowflake.status import ProgressTracker, StatusFile
+
+from test_ingest import SCHEMA, record, to_binary_stream
+
+
+class CountingTarget:
+    def write_batch(self, stream_buffer):
+        if stream_buffer.count:
+            return {'records_persisted': stream_buffer.count, 'rows_persisted': stream_buffer.count}
+        return None
+
+    def activate_version(self, stream_buffer, version):
+        pass
+
+
+class FailingTarget(CountingTarget):
+    def write_batch(self, stream_buffer):
+        raise Exception('Batch failed')
+
+
+def make_tracker():
+    tracker = ProgressTracker(CountingTarget(), True)
+    for stream in ('cats', 'dogs'):
+        tracker.register_stream(stream, BufferedSingerStream(stream, SCHEMA['schema'], SCHEMA['key_properties']))
+    return tracker
+
+
+def add_records(tracker, stream, ids):
+    for id in ids:
+        message = record(id, stream=stream)
+        message['__raw_line_size'] = 10
+        tracker.handle_record_message(stream, message)
+
+
+def test_status__pending_states(tmpdir):
+    tracker = make_tracker()
+    status_file = StatusFile(str(tmpdir.join('status.json')), tracker)
+
+    add_records(tracker, 'cats', range(3))
+    add_records(tracker, 'dogs', range(2))
+    tracker.handle_state_message({'type': 'STATE', 'value': {'bookmark': 1}})
+    tracker.flush_stream('cats')
+    add_records(tracker, 'cats', range(3, 4))
+
+    status = status_file.status()
+
+    assert status['state'] == 'running'
+    assert status['flushing'] is None
+    assert status['pending_states'] == 1
+    assert status['oldest_pending_state']['value'] == {'bookmark': 1}
+    ## Flush watermarks are message counters shared by every stream, so `cats` must flush past the STATE too
+    assert status['oldest_pending_state']['waiting_on'] == ['cats', 'dogs']
+    assert status['oldest_pending_state']['age_seconds'] >= 0
+    assert status['last_emitted_state'] is None
+
+    cats = status['streams']['cats']
+    assert (cats['buffered_rows'], cats['buffered_bytes']) == (1, 10)
+    assert (cats['received_rows'], cats['committed_rows'], cats['flushes']) == (4, 3, 1)
+    assert cats['last_flush_seconds'] >= 0
+    assert cats['blocking_states'] == 1
+
+    dogs = status['streams']['dogs']
+    assert (dogs['buffered_rows'], dogs['buffered_bytes']) == (2, 20)
+    assert (dogs['received_rows'], dogs['committed_rows'], dogs['flushes']) == (2, 0, 0)
+    assert dogs['last_flush_seconds'] is None
+    assert dogs['blocking_states'] == 1
+
+    tracker.flush_stream('dogs')
+    assert status_file.status()['oldest_pending_state']['waiting_on'] == ['cats']
+
+    tracker.flush_stream('cats')
+    status = status_file.status()
+
+    assert status['pending_states'] == 0
+    assert status['last_emitted_state'] == {'bookmark': 1}
+    assert status['last_emitted_state_at'] is not None
+    assert status['streams']['dogs']['committed_rows'] == 2
+    assert status['streams']['dogs']['committed_rows_per_sec'] > 0
+
+
+def test_status__flushing(tmpdir):
+    tracker = make_tracker()
+    status_file = StatusFile(str(tmpdir.join('status.json')), tracker)
+    statuses = []
+
+    class ObservedTarget(CountingTarget):
+        def write_batch(self, stream_buffer):
+            statuses.append(status_file.status())
+            return super(ObservedTarget, self).write_batch(stream_buffer)
+
+    tracker.target = ObservedTarget()
+    add_records(tracker, 'cats', range(2))
+    tracker.flush_stream('cats')
+
+    assert statuses[0]['flushing']['stream'] == 'cats'
+    assert status_file.status()['flushing'] is None
+
+
+def test_stream_to_target__writes_status_file(tmpdir):
+    path = str(tmpdir.join('status', 'status.json'))
+    messages = [SCHEMA, record(1), record(2), {'type': 'STATE', 'value': {'bookmark': 2}}]
+
+    ingest.stream_to_target(to_binary_stream(messages), CountingTarget(), config={'status_file': path,
+                                                                                  'state_support': False})
+
+    with open(path) as status_file:
+        status = json.load(status_file)
+
+    assert status['state'] == 'finished'
+    assert status['streams']['cats']['committed_rows'] == 2
+    assert status['streams']['cats']['buffered_rows'] == 0
+    assert tmpdir.join('status').listdir() == [tmpdir.join('status', 'status.json')]
+
+
+def test_stream_to_target__failed_status_file(tmpdir):
+    path = str(tmpdir.join('status.json'))
+
+    with pytest.raises(Exception):
+        ingest.stream_to_target(to_binary_stream([SCHEMA, record(1)]), FailingTarget(), config={'status_file': path})
+
+    with open(path) as status_file:
+        status = json.load(status_file)
+
+    assert status['state'] == 'failed'
+    assert status['streams']['cats']['buffered_rows'] == 1
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+from target_postgres import denest
+
+from target_snowflake import ingest
+from target_snowflake.workers import RecordWorkerPool
+
+from test_ingest import RecordingTarget, SCHEMA, record
+
+
+NESTED_SCHEMA = {'properties': {'id': {'type': 'integer'},
+                                'tags': {'type': 'array', 'items': {'type': 'string'}}}}
+
+
+@pytest.fixture
+def pool():
+    pool = RecordWorkerPool(2, denest_chunk_rows=5)
+    yield pool
+    pool.shutdown()
+
+
+def test_record_stream():
+    assert ingest.record_stream(b'{"type": "RECORD", "stream": "cats", "record": {}}') == 'cats'
+    assert ingest.record_stream('{"type":"RECORD","stream":"dogs","record":{}}') == 'dogs'
+    assert ingest.record_stream(b'{"stream": "cats", "type": "RECORD", "record": {}}') is None
+    assert ingest.record_stream(b'{"type": "STATE", "value": {}}') is None
+
+
+def test_to_table_batches__matches_denest(pool):
+    records = [{'id': i, 'tags': ['a'] * (i % 3)} for i in range(23)]
+
+    expected = denest.to_table_batches(NESTED_SCHEMA, ['id'], records)
+    actual = pool.to_table_batches(NESTED_SCHEMA, ['id'], records)
+
+    assert [b['streamed_schema']['path'] for b in actual] == [b['streamed_schema']['path'] for b in expected]
+    assert [b['records'] for b in actual] == [b['records'] for b in expected]
+
+
+def test_stream_to_target__with_workers(pool, capsys):
+    target = RecordingTarget()
+    invalid = record(4)
+    invalid['record']['id'] = 'four'
+
+    messages = [SCHEMA, record(1), record(2), {'type': 'STATE', 'value': {'at': 2}}, record(3), invalid, record(5)]
+
+    ingest.stream_to_target([json.dumps(m) for m in messages],
+                            target,
+                            config={'disable_collection': True,
+                                    'invalid_records_detect': False,
+                                    'batch_detection_threshold': 2},
+                            record_workers=pool)
+
+    assert target.batches == [('cats', [1, 2, 3, 5])]
+    assert json.loads(capsys.readouterr().out) == {'at': 2}